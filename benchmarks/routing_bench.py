@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Routing rule matcher microbenchmark
+
+Compiles a synthetic rules file with the given number of domain and CIDR
+rules and measures the per-request cost of a routing decision: the raw
+matcher (suffix trie / prefix tables) and the Router with its decision
+cache, for domains and IP literals that hit or miss the rules. Before
+timing it checks that IPv4-mapped IPv6 targets (::ffff:a.b.c.d) follow the
+IPv4 CIDR rules, and exits with status 1 when they do not.
+
+Usage:
+    python3 benchmarks/routing_bench.py --domains 10000 --cidrs 5000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import protocol  # noqa: E402
+import routing   # noqa: E402
+
+
+def make_rules(domains, cidrs, rng):
+    lines = ['direct *']
+    for i in range(domains):
+        action = rng.choice(routing.ACTIONS)
+        lines.append(f'{action} site{i}.{rng.choice(("com", "net", "org", "io"))}')
+    for _ in range(cidrs):
+        prefixlen = rng.choice((8, 12, 16, 20, 24, 28, 32))
+        address = '.'.join(str(rng.randrange(256)) for _ in range(4))
+        lines.append(f'{rng.choice(routing.ACTIONS)} {address}/{prefixlen}')
+    return lines
+
+
+def make_targets(count, domains, rng):
+    """(name, [(address_type, address), ...]) for each kind of lookup"""
+    return [
+        ('domain_hit', [(protocol.ATYP_DOMAIN, f'www.cdn.site{rng.randrange(domains)}.com')
+                        for _ in range(count)]),
+        ('domain_miss', [(protocol.ATYP_DOMAIN, f'host{i}.example.test') for i in range(count)]),
+        ('ipv4', [(protocol.ATYP_IPV4, '.'.join(str(rng.randrange(256)) for _ in range(4)))
+                  for _ in range(count)]),
+    ]
+
+
+def check_mapped():
+    """IPv4-mapped IPv6 targets must not get past IPv4 block rules; returns the mismatches"""
+    rules = routing.RuleSet(routing.parse_rules(['block 10.0.0.0/8', 'block 127.0.0.0/8', 'direct *']))
+    expected = [((protocol.ATYP_IPV4, '10.1.2.3'), routing.BLOCK),
+                ((protocol.ATYP_IPV6, '::ffff:10.1.2.3'), routing.BLOCK),
+                ((protocol.ATYP_IPV6, '::ffff:127.0.0.1'), routing.BLOCK),
+                ((protocol.ATYP_IPV6, '::ffff:8.8.8.8'), routing.DIRECT),
+                ((protocol.ATYP_IPV6, '2001:db8::1'), routing.DIRECT)]
+    return [(target, action, rules.match(*target)) for target, action in expected
+            if rules.match(*target) != action]
+
+
+def per_call_ns(func, targets, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for address_type, address in targets:
+            func(address_type, address)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(targets) * 1e9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Routing rule matcher microbenchmark')
+    parser.add_argument('--domains', type=int, default=10000, help='Domain rules (default: 10000)')
+    parser.add_argument('--cidrs', type=int, default=5000, help='CIDR rules (default: 5000)')
+    parser.add_argument('--lookups', type=int, default=20000, help='Lookups per measurement (default: 20000)')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Router decision cache (default: 1024)')
+    parser.add_argument('--repeat', type=int, default=5, help='Take the best of N runs (default: 5)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    mismatches = check_mapped()
+    for (address_type, address), want, got in mismatches:
+        print(f'{address}: expected {want}, got {got}', file=sys.stderr)
+    if mismatches:
+        sys.exit(1)
+
+    rng = random.Random(1)
+    lines = make_rules(args.domains, args.cidrs, rng)
+    with tempfile.NamedTemporaryFile('w', suffix='.rules', delete=False) as f:
+        f.write('\n'.join(lines) + '\n')
+    try:
+        started = time.perf_counter()
+        router = routing.Router(f.name, args.cache_size)
+        compile_ms = (time.perf_counter() - started) * 1000
+    finally:
+        os.unlink(f.name)
+
+    results = {'rules': len(router.rules), 'compile_ms': round(compile_ms, 1)}
+    for name, targets in make_targets(args.lookups, args.domains, rng):
+        results[f'{name}_match_ns'] = per_call_ns(router.rules.match, targets, args.repeat)
+        # Router.decide over destinations that fit in the decision cache, so every
+        # call after the first pass is a cache hit (--cache-size 0 measures the miss path)
+        hot = targets
+        if args.cache_size:
+            hot = targets[:args.cache_size] * max(1, len(targets) // args.cache_size)
+        results[f'{name}_decide_ns'] = per_call_ns(router.decide, hot, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>22}: {value}")
+
+
+if __name__ == '__main__':
+    main()
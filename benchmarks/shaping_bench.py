@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Bandwidth shaping check
+
+Starts Socks5Server with a bandwidth limit and a local target that streams
+data as fast as it can, then runs concurrent downloads through the proxy and
+measures each stream's throughput after a warm-up period. Reports the
+aggregate rate against the configured limit and Jain's fairness index across
+the streams (1.0 = perfectly even), and exits with status 1 when the
+aggregate exceeds the limit by more than --tolerance or the streams are
+shared unfairly.
+
+Usage:
+    python3 benchmarks/shaping_bench.py --mode thread --engine epoll --rate 2000000 --streams 4
+    python3 benchmarks/shaping_bench.py --mode asyncio --scope user --rate 500000
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+
+from test_socks5_client import Socks5Client  # noqa: E402
+
+CHUNK = b'x' * 65536
+
+# Config setting for each --scope
+SCOPES = {'global': 'BANDWIDTH_LIMIT', 'ip': 'BANDWIDTH_PER_IP', 'user': 'BANDWIDTH_PER_USER'}
+
+
+def run_source(ready):
+    async def stream(reader, writer):
+        try:
+            while True:
+                writer.write(CHUNK)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(stream, '127.0.0.1', 0, backlog=1024)
+        ready.send(server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def run_server(mode, engine, setting, rate, ready):
+    os.chdir(tempfile.mkdtemp(prefix='socks5-shaping-'))
+    import settings
+    import socks5_server
+
+    cfg = settings.load(overrides={'HOST': '127.0.0.1', 'PORT': 0, 'SERVER_MODE': mode, 'RELAY_ENGINE': engine,
+                                   'VERBOSE': False, setting: rate})
+    server = socks5_server.Socks5Server(settings=cfg)
+    ready.send((server.address[1], cfg.USERNAME, cfg.PASSWORD))
+    server.run()
+
+
+def start_process(target, *args):
+    ready_r, ready_w = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=target, args=args + (ready_w,), daemon=True)
+    process.start()
+    return process, ready_r.recv()
+
+
+def download(proxy, source_port, warmup, seconds, results, index):
+    """Counts the bytes received between warmup and warmup + seconds"""
+    port, username, password = proxy
+    client = Socks5Client('127.0.0.1', port, '127.0.0.1', source_port, username, password, verbose=False)
+    if not (client.connect() and client.handshake() and client.request_connection()):
+        raise RuntimeError('SOCKS5 session failed')
+    sock = client.sock
+    sock.settimeout(1)
+    started = time.monotonic()
+    window_start, window_end = started + warmup, started + warmup + seconds
+    counted = 0
+    try:
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                data = None  # throttled; keep checking the clock
+            if data == b'':
+                raise RuntimeError('source closed the tunnel')
+            now = time.monotonic()
+            if now >= window_end:
+                break
+            if data and now >= window_start:
+                counted += len(data)
+    finally:
+        client.close()
+    results[index] = counted / seconds
+
+
+def jain(values):
+    total = sum(values)
+    squares = sum(v * v for v in values)
+    return total * total / (len(values) * squares) if squares else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bandwidth shaping check')
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--engine', choices=('thread', 'epoll'), default='thread',
+                        help='Relay engine in thread mode (default: thread)')
+    parser.add_argument('--scope', choices=sorted(SCOPES), default='global',
+                        help='Which limit to configure (default: global)')
+    parser.add_argument('--rate', type=int, default=2_000_000, help='Limit in bytes/s (default: 2000000)')
+    parser.add_argument('--streams', type=int, default=4, help='Concurrent downloads (default: 4)')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Seconds before measuring (default: 1)')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Measurement window (default: 5)')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Allowed overshoot of the limit (default: 0.05)')
+    parser.add_argument('--min-fairness', type=float, default=0.9,
+                        help="Minimum Jain's fairness index (default: 0.9)")
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    _, source_port = start_process(run_source)
+    _, proxy = start_process(run_server, args.mode, args.engine, SCOPES[args.scope], args.rate)
+
+    rates = [0.0] * args.streams
+    threads = [threading.Thread(target=download,
+                                args=(proxy, source_port, args.warmup, args.seconds, rates, i))
+               for i in range(args.streams)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    aggregate = sum(rates)
+    results = {
+        'mode': args.mode if args.mode == 'asyncio' else f'thread-{args.engine}',
+        'scope': args.scope,
+        'limit_bps': args.rate,
+        'aggregate_bps': round(aggregate),
+        'ratio': round(aggregate / args.rate, 3),
+        'per_stream_bps': [round(r) for r in rates],
+        'fairness': round(jain(rates), 3),
+    }
+    results['ok'] = (results['ratio'] <= 1 + args.tolerance and results['fairness'] >= args.min_fairness)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>16}: {value}")
+    sys.exit(0 if results['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+SOCKS5 server load-generation and throughput benchmark
+
+Starts Socks5Server and a local echo/sink target in child processes, then
+drives concurrent Socks5Client sessions through the proxy and measures:
+
+  - handshake latency percentiles (TCP connect -> CONNECT reply)
+  - connections per second (handshake + one echo round trip + close)
+  - single-stream and aggregate upload throughput in MB/s
+  - server memory per idle tunnel (RSS delta / open tunnels, Linux only)
+
+Results are printed and optionally written as JSON so relay modes and
+releases can be compared on the same machine.
+
+Usage:
+    python3 benchmarks/socks5_bench.py --mode thread --engine epoll -o results.json
+    python3 benchmarks/socks5_bench.py --mode asyncio --idle 5000
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+
+from test_socks5_client import Socks5Client  # noqa: E402
+
+# The sink reads an 8-byte length prefix, consumes that many bytes and replies b'ok'
+SINK_ACK = b'ok'
+CHUNK = b'x' * 65536
+
+
+# ================= Target and server processes =================
+
+def run_targets(ready):
+    async def echo(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def sink(reader, writer):
+        try:
+            remaining = struct.unpack('!Q', await reader.readexactly(8))[0]
+            while remaining:
+                data = await reader.read(min(remaining, 1 << 20))
+                if not data:
+                    return
+                remaining -= len(data)
+            writer.write(SINK_ACK)
+            await writer.drain()
+            await reader.read()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        echo_server = await asyncio.start_server(echo, '127.0.0.1', 0, backlog=1024)
+        sink_server = await asyncio.start_server(sink, '127.0.0.1', 0, backlog=1024)
+        ready.send((echo_server.sockets[0].getsockname()[1], sink_server.sockets[0].getsockname()[1]))
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def run_server(mode, engine, ready):
+    # 在临时目录中运行，逐连接日志关闭，避免日志 I/O 影响测量结果（未配置日志，只有警告输出到 stderr）
+    os.chdir(tempfile.mkdtemp(prefix='socks5-bench-'))
+    import settings
+    import socks5_server
+
+    cfg = settings.load(overrides={'HOST': '127.0.0.1', 'PORT': 0, 'SERVER_MODE': mode, 'RELAY_ENGINE': engine,
+                                   'VERBOSE': False, 'MAX_CONNECTIONS': 1 << 20})
+    server = socks5_server.Socks5Server(settings=cfg)
+    ready.send((server.address[1], cfg.USERNAME, cfg.PASSWORD))
+    server.run()
+
+
+def start_process(target, *args):
+    ready_r, ready_w = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=target, args=args + (ready_w,), daemon=True)
+    process.start()
+    return process, ready_r.recv()
+
+
+def rss_bytes(pid):
+    """Resident set size of a process (Linux /proc), None elsewhere"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+# ================= Client sessions =================
+
+class Bench:
+    def __init__(self, proxy_port, username, password, echo_port, sink_port):
+        self.proxy_port = proxy_port
+        self.username = username
+        self.password = password
+        self.echo_port = echo_port
+        self.sink_port = sink_port
+
+    def open(self, target_port):
+        """Returns (socket, handshake seconds) for an established tunnel"""
+        client = Socks5Client('127.0.0.1', self.proxy_port, '127.0.0.1', target_port,
+                              self.username, self.password, verbose=False)
+        started = time.perf_counter()
+        if not (client.connect() and client.handshake() and client.request_connection()):
+            client.close()
+            raise RuntimeError('SOCKS5 session failed')
+        return client.sock, time.perf_counter() - started
+
+    def session(self, _):
+        sock, handshake = self.open(self.echo_port)
+        try:
+            sock.sendall(b'ping')
+            received = b''
+            while len(received) < 4:
+                data = sock.recv(4 - len(received))
+                if not data:
+                    raise RuntimeError('echo target closed the tunnel')
+                received += data
+        finally:
+            sock.close()
+        return handshake
+
+    def upload(self, size):
+        sock, _ = self.open(self.sink_port)
+        try:
+            started = time.perf_counter()
+            sock.sendall(struct.pack('!Q', size))
+            remaining = size
+            while remaining:
+                n = min(remaining, len(CHUNK))
+                sock.sendall(CHUNK[:n])
+                remaining -= n
+            if sock.recv(len(SINK_ACK)) != SINK_ACK:
+                raise RuntimeError('sink did not acknowledge the upload')
+            return time.perf_counter() - started
+        finally:
+            sock.close()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure_connections(bench, total, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = sorted(executor.map(bench.session, range(total)))
+    elapsed = time.perf_counter() - started
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    return {
+        'sessions': total,
+        'concurrency': concurrency,
+        'connections_per_sec': round(total / elapsed, 1),
+        'handshake_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]),
+            'mean': ms(sum(latencies) / len(latencies)),
+        },
+    }
+
+
+def measure_throughput(bench, size, streams):
+    single = bench.upload(size)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(streams) as executor:
+        list(executor.map(lambda _: bench.upload(size), range(streams)))
+    aggregate = time.perf_counter() - started
+    mb = size / (1024 * 1024)
+    return {
+        'stream_mb': round(mb, 1),
+        'single_stream_mb_per_sec': round(mb / single, 1),
+        'streams': streams,
+        'aggregate_mb_per_sec': round(mb * streams / aggregate, 1),
+    }
+
+
+def measure_idle_memory(bench, server_pid, count, concurrency):
+    before = rss_bytes(server_pid)
+    if before is None or count <= 0:
+        return None
+    with ThreadPoolExecutor(concurrency) as executor:
+        tunnels = [sock for sock, _ in executor.map(lambda _: bench.open(bench.echo_port), range(count))]
+    time.sleep(1)  # let the server settle (thread stacks, reactor registration)
+    after = rss_bytes(server_pid)
+    for sock in tunnels:
+        sock.close()
+    return {
+        'tunnels': count,
+        'rss_before_mb': round(before / (1024 * 1024), 1),
+        'rss_after_mb': round(after / (1024 * 1024), 1),
+        'bytes_per_tunnel': round((after - before) / count),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SOCKS5 server load and throughput benchmark')
+    parser.add_argument('--mode', default='thread', choices=['thread', 'asyncio'],
+                        help='SERVER_MODE to benchmark (default: thread)')
+    parser.add_argument('--engine', default='thread', choices=['thread', 'epoll'],
+                        help='RELAY_ENGINE for thread mode (default: thread)')
+    parser.add_argument('--sessions', type=int, default=2000,
+                        help='Short sessions for latency and conn/s (default: 2000)')
+    parser.add_argument('--concurrency', type=int, default=50, help='Concurrent clients (default: 50)')
+    parser.add_argument('--stream-mb', type=int, default=256, help='MB per throughput stream (default: 256)')
+    parser.add_argument('--streams', type=int, default=8, help='Parallel streams for aggregate MB/s (default: 8)')
+    parser.add_argument('--idle', type=int, default=1000, help='Idle tunnels for memory measurement (default: 1000)')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    # 每条空闲隧道在客户端和服务器各占两个文件描述符
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, args.idle * 4 + 1024))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    targets, (echo_port, sink_port) = start_process(run_targets)
+    server, (proxy_port, username, password) = start_process(run_server, args.mode, args.engine)
+    bench = Bench(proxy_port, username, password, echo_port, sink_port)
+    try:
+        results = {
+            'mode': args.mode,
+            'engine': args.engine if args.mode == 'thread' else None,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'connections': measure_connections(bench, args.sessions, args.concurrency),
+            'throughput': measure_throughput(bench, args.stream_mb * 1024 * 1024, args.streams),
+            'idle_memory': measure_idle_memory(bench, server.pid, args.idle, args.concurrency),
+        }
+    finally:
+        server.terminate()
+        targets.terminate()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
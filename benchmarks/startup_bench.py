@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Server startup time
+
+Starts a fresh server process --runs times and measures, for each run:
+  - import_ms:  importing socks5_server (inside the child)
+  - config_ms:  settings.load() with the server's config.py
+  - init_ms:    Socks5Server(...) including the bind
+  - ready_ms:   from spawning the process until a SOCKS5 greeting is answered
+and the bare interpreter startup (python -c pass) as a baseline. Reports
+the median and 95th percentile of each, and exits with status 1 when the
+median ready_ms exceeds --max-ready-ms.
+
+Usage:
+    python3 benchmarks/startup_bench.py --runs 20
+    python3 benchmarks/startup_bench.py --mode asyncio --max-ready-ms 300 --json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(ROOT, 'server')
+
+CHILD = r'''
+import sys, json, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import settings
+import socks5_server
+imported = time.perf_counter()
+cfg = settings.load(sys.argv[2] or None, overrides=json.loads(sys.argv[3]))
+loaded = time.perf_counter()
+server = socks5_server.Socks5Server(settings=cfg)
+bound = time.perf_counter()
+print(json.dumps({'port': server.address[1],
+                  'import_ms': (imported - started) * 1000,
+                  'config_ms': (loaded - imported) * 1000,
+                  'init_ms': (bound - loaded) * 1000}), flush=True)
+server.run()
+'''
+
+
+def greet(port, timeout=10):
+    """Completes a SOCKS5 method negotiation, proving the server is serving"""
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+        sock.sendall(b'\x05\x02\x00\x02')
+        reply = sock.recv(2)
+    if len(reply) != 2 or reply[0] != 5:
+        raise RuntimeError(f'unexpected greeting reply {reply!r}')
+
+
+def run_once(config, overrides, cwd):
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', CHILD, SERVER_DIR, config or '', json.dumps(overrides)],
+                               cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError('server exited before it was ready')
+        result = json.loads(line)
+        greet(result.pop('port'))
+        result['ready_ms'] = (time.perf_counter() - started) * 1000
+        return result
+    finally:
+        process.kill()
+        process.wait()
+
+
+def interpreter_ms():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def summarize(values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return {'median': round(statistics.median(values), 2), 'p95': round(p95, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server startup time')
+    parser.add_argument('--runs', type=int, default=20, help='Server processes to start (default: 20)')
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--engine', choices=('thread', 'epoll'), default='thread',
+                        help='Relay engine in thread mode (default: thread)')
+    parser.add_argument('--config', help="Configuration file (default: the server's config.py)")
+    parser.add_argument('--max-ready-ms', type=float, default=0,
+                        help='Fail when the median ready_ms is above this (default: no limit)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    # Ephemeral port, no hot-restart socket or side listeners, fail fast on bind errors
+    overrides = {'HOST': '127.0.0.1', 'PORT': 0, 'SERVER_MODE': args.mode, 'RELAY_ENGINE': args.engine,
+                 'METRICS_PORT': 0, 'MUX_PORT': 0, 'HANDOFF_SOCKET': None, 'BIND_RETRIES': 1,
+                 'VERBOSE': False}
+    cwd = tempfile.mkdtemp(prefix='socks5-startup-')
+    runs = [run_once(args.config, overrides, cwd) for _ in range(args.runs)]
+    baseline = [interpreter_ms() for _ in range(args.runs)]
+
+    results = {'mode': args.mode if args.mode == 'asyncio' else f'thread-{args.engine}', 'runs': args.runs}
+    for key in ('import_ms', 'config_ms', 'init_ms', 'ready_ms'):
+        results[key] = summarize([run[key] for run in runs])
+    results['interpreter_ms'] = summarize(baseline)
+    results['ok'] = not args.max_ready_ms or results['ready_ms']['median'] <= args.max_ready_ms
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>16}: {value}")
+    sys.exit(0 if results['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+UDP ASSOCIATE relay throughput benchmark
+
+Runs the server's UdpRelay in this process and drives it from two helper
+processes: a UDP echo target and a client that keeps a fixed window of
+datagrams in flight on every association. Every round trip crosses the
+relay twice (client -> target and target -> client), so relayed packets per
+second = 2 * echoed datagrams per second.
+
+Usage:
+    python3 benchmarks/udp_relay_bench.py --duration 5 --associations 4 --size 512
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import select
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import protocol  # noqa: E402
+import udp       # noqa: E402
+
+
+def echo_target(ready):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    ready.send(sock.getsockname()[1])
+    buf = bytearray(65535)
+    while True:
+        n, addr = sock.recvfrom_into(buf)
+        sock.sendto(memoryview(buf)[:n], addr)
+
+
+def client(relay_ports, target_port, size, window, duration, result):
+    packet = protocol.udp_header('127.0.0.1', target_port) + b'x' * size
+    socks = []
+    for port in relay_ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.connect(('127.0.0.1', port))
+        sock.setblocking(False)
+        socks.append(sock)
+
+    sent = received = 0
+    in_flight = {sock: 0 for sock in socks}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for sock in socks:
+            while in_flight[sock] < window:
+                try:
+                    sock.send(packet)
+                except BlockingIOError:
+                    break
+                in_flight[sock] += 1
+                sent += 1
+        readable, _, _ = select.select(socks, [], [], 0.2)
+        if not readable:
+            # Lost datagrams never free their window slot; start the window over
+            for sock in socks:
+                in_flight[sock] = 0
+            continue
+        for sock in readable:
+            while True:
+                try:
+                    sock.recv(65535)
+                except BlockingIOError:
+                    break
+                in_flight[sock] -= 1
+                received += 1
+    result.send((sent, received))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UDP ASSOCIATE relay throughput benchmark')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to run (default: 5)')
+    parser.add_argument('--associations', type=int, default=4, help='Concurrent associations (default: 4)')
+    parser.add_argument('--size', type=int, default=512, help='Payload bytes per datagram (default: 512)')
+    parser.add_argument('--window', type=int, default=32,
+                        help='Datagrams in flight per association (default: 32)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    ready_r, ready_w = multiprocessing.Pipe(duplex=False)
+    target = multiprocessing.Process(target=echo_target, args=(ready_w,), daemon=True)
+    target.start()
+    target_port = ready_r.recv()
+
+    relay = udp.UdpRelay(idle_timeout=args.duration + 60)
+    relay.start()
+    associations = [relay.associate('127.0.0.1') for _ in range(args.associations)]
+
+    result_r, result_w = multiprocessing.Pipe(duplex=False)
+    driver = multiprocessing.Process(
+        target=client,
+        args=([a.port for a in associations], target_port, args.size, args.window, args.duration, result_w))
+    started = time.monotonic()
+    driver.start()
+    sent, received = result_r.recv()
+    elapsed = time.monotonic() - started
+    driver.join()
+    target.terminate()
+
+    stats = relay.stats()
+    relayed = stats['packets_up'] + stats['packets_down']
+    results = {
+        'duration': round(elapsed, 2),
+        'associations': args.associations,
+        'payload_size': args.size,
+        'datagrams_sent': sent,
+        'datagrams_echoed': received,
+        'loss': round(1 - received / sent, 4) if sent else 0.0,
+        'relayed_pps': round(relayed / elapsed),
+        'relayed_mbps': round((stats['bytes_up'] + stats['bytes_down']) * 8 / elapsed / 1e6, 1),
+        'dropped_by_relay': stats['dropped'],
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Local SOCKS5 agent for high-latency links
+
+Listens for SOCKS5 connections from the browser on this machine and carries
+all of them as streams over one long-lived multiplexed connection to the
+server's MUX_PORT (see server/mux.py):
+
+  - the SOCKS5 greeting is answered locally and the CONNECT reply is sent
+    immediately, so a new browser connection costs no round trip to the
+    server before data starts flowing
+  - the server-side handshake (greeting, authentication and CONNECT) is
+    pipelined into the new stream; if the server rejects it, the browser
+    connection is closed (use --wait-connect to pass the real reply code
+    through at the cost of one round trip). With a username configured, the
+    first stream of each session waits for the server's method choice, since
+    a server without authentication answers with no-auth
+  - every stream has its own flow-control window, so a stalled download
+    does not hold up the other tabs
+  - with compression negotiated, compressible payloads (HTML, JSON, plain
+    HTTP) are zlib-compressed per frame; encrypted traffic is sent as is
+
+Usage:
+    python3 client/agent.py --server 203.0.113.1:10087 -u admin -p 123456
+    # then point the Chrome extension at 127.0.0.1:1080
+"""
+
+import os
+import sys
+import socket
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import mux       # noqa: E402
+import protocol  # noqa: E402
+
+logger = logging.getLogger('agent')
+
+# Bind address reported to the browser before the server has connected
+PLACEHOLDER_BIND = ('0.0.0.0', 0)
+
+
+class HandshakeFailed(Exception):
+    pass
+
+
+class HandshakeStream:
+    """Wraps a mux stream so that reading it first strips the server's handshake replies
+
+    The replies are the method choice, the authentication status (only when
+    the server chose username/password) and the CONNECT reply; whatever
+    follows them is target data for the browser.
+    """
+
+    def __init__(self, stream, target):
+        self.stream = stream
+        self.target = target
+        self.data = bytearray()
+        self.reply = None
+        self.pending = b''
+
+    async def method(self):
+        """Waits for the server's method choice and returns it; it is parsed again with the other replies"""
+        while len(self.data) < 2:
+            # The server sends nothing else before it has the next message
+            chunk = await self._receive()
+            self.stream.consumed(len(chunk))
+        return self.data[1]
+
+    async def handshake(self):
+        """Reads up to the CONNECT reply and returns it"""
+        while self.reply is None:
+            chunk = await self._receive()
+            self.reply = self._parse()
+            # Reply bytes are consumed here, the target data after them by the relay
+            self.stream.consumed(len(chunk) - len(self.pending))
+        return self.reply
+
+    async def _receive(self):
+        chunk = await self.stream.read()
+        if not chunk:
+            raise HandshakeFailed("server closed the stream during the handshake")
+        self.data += chunk
+        return chunk
+
+    def _parse(self):
+        data = self.data
+        if len(data) < 2:
+            return None
+        method = data[1]
+        if method == protocol.METHOD_NO_ACCEPTABLE:
+            raise HandshakeFailed("server rejected the authentication methods")
+        if method not in (protocol.METHOD_NO_AUTH, protocol.METHOD_USER_PASS):
+            raise HandshakeFailed(f"server chose unsupported method {method}")
+        pos = 2
+        if method == protocol.METHOD_USER_PASS:
+            if len(data) < pos + 2:
+                return None
+            if data[pos + 1] != 0:
+                raise HandshakeFailed("server rejected the username or password")
+            pos += 2
+        if len(data) < pos + 5:
+            return None
+        address_type = data[pos + 3]
+        if address_type == protocol.ATYP_IPV4:
+            end = pos + 4 + 4 + 2
+        elif address_type == protocol.ATYP_IPV6:
+            end = pos + 4 + 16 + 2
+        else:
+            end = pos + 4 + 1 + data[pos + 4] + 2
+        if len(data) < end:
+            return None
+        self.pending = bytes(data[end:])
+        return bytes(data[pos:end])
+
+    async def read(self):
+        if self.reply is None:
+            # Optimistic mode: the browser already has a success reply, so a
+            # failure here can only close its connection
+            try:
+                reply = await self.handshake()
+            except HandshakeFailed as e:
+                logger.warning("Stream to %s failed: %s", self.target, e)
+                raise
+            if reply[1] != protocol.REP_SUCCESS:
+                logger.info("Server refused %s (reply %s)", self.target, reply[1])
+                raise HandshakeFailed(f"server replied {reply[1]}")
+        if self.pending:
+            data, self.pending = self.pending, b''
+            return data
+        return await self.stream.read()
+
+    def consumed(self, n):
+        self.stream.consumed(n)
+
+    async def write(self, data):
+        await self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+
+
+class Agent:
+    def __init__(self, server_host, server_port, username=None, password=None, compress=True,
+                 window=mux.WINDOW_SIZE, wait_connect=False):
+        self.server_host = server_host
+        self.server_port = server_port
+        self.username = username
+        self.password = password
+        self.compress = compress
+        self.window = window
+        self.wait_connect = wait_connect
+        self.session = None
+        self.server_method = None  # authentication method the server chose on this session
+        self._session_task = None
+        self._lock = None
+
+    async def connect(self):
+        """Returns the open session, reconnecting if the previous one was lost"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.session is None or self.session.closed:
+                reader, writer = await asyncio.open_connection(self.server_host, self.server_port)
+                sock = writer.get_extra_info('socket')
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                try:
+                    flags, peer_window = await mux.hello(
+                        reader, writer, mux.FLAG_COMPRESS if self.compress else 0, self.window)
+                except BaseException:
+                    writer.close()
+                    raise
+                self.session = mux.Session(reader, writer, bool(flags & mux.FLAG_COMPRESS),
+                                           self.window, peer_window)
+                self.server_method = None
+                self._session_task = asyncio.ensure_future(self.session.run())
+                logger.info("Mux session to %s:%s established (compression: %s)",
+                            self.server_host, self.server_port, self.session.compress)
+            return self.session
+
+    async def server_handshake(self, stream, request):
+        """SOCKS5 greeting, authentication and request for the server, returning what is left to send
+
+        With a username, the first stream of a session offers both methods and
+        waits for the server's choice; later streams send the greeting, the
+        authentication the server expects and the request in one write.
+        """
+        if not self.username:
+            return protocol.greeting((protocol.METHOD_NO_AUTH,)) + request
+        method = self.server_method
+        if method is None:
+            await stream.write(protocol.greeting((protocol.METHOD_NO_AUTH, protocol.METHOD_USER_PASS)))
+            method = await stream.method()
+            if method not in (protocol.METHOD_NO_AUTH, protocol.METHOD_USER_PASS):
+                raise HandshakeFailed(f"server chose unsupported method {method}")
+            self.server_method = method
+            greeting = b''
+        else:
+            greeting = protocol.greeting((method,))
+        if method == protocol.METHOD_USER_PASS:
+            return greeting + protocol.auth_request(self.username, self.password or '') + request
+        return greeting + request
+
+    async def handle(self, reader, writer):
+        try:
+            await self._handle(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, mux.ProtocolError, OSError) as e:
+            logger.debug("Connection ended: %s", e)
+        finally:
+            writer.close()
+
+    async def _handle(self, reader, writer):
+        buf = protocol.HandshakeBuffer()
+        greeting = await read_message(reader, buf, buf.parse_greeting)
+        if greeting is None or greeting[0] != protocol.SOCKS_VERSION:
+            return
+        # Answered locally: the agent authenticates to the server with its own credentials
+        methods = greeting[1]
+        if protocol.METHOD_NO_AUTH in methods:
+            writer.write(protocol.method_reply(protocol.METHOD_NO_AUTH))
+        elif protocol.METHOD_USER_PASS in methods:
+            writer.write(protocol.method_reply(protocol.METHOD_USER_PASS))
+            if await read_message(reader, buf, buf.parse_auth) is None:
+                return
+            writer.write(protocol.auth_reply(0))
+        else:
+            writer.write(protocol.method_reply(protocol.METHOD_NO_ACCEPTABLE))
+            return
+
+        request = await read_message(reader, buf, buf.parse_request)
+        if request is None:
+            return
+        cmd, address_type, address, port = request
+        if address is None:
+            writer.write(protocol.failure_reply(protocol.REP_ADDRESS_TYPE_NOT_SUPPORTED))
+            return
+        if cmd != protocol.CMD_CONNECT:
+            writer.write(protocol.failure_reply(protocol.REP_COMMAND_NOT_SUPPORTED))
+            return
+
+        try:
+            session = await self.connect()
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, mux.ProtocolError) as e:
+            logger.warning("Cannot reach %s:%s: %s", self.server_host, self.server_port, e)
+            writer.write(protocol.failure_reply(protocol.REP_GENERAL_FAILURE))
+            return
+        stream = HandshakeStream(session.open(), f'{address}:{port}')
+        try:
+            handshake = await self.server_handshake(stream, protocol.connect_request(address_type, address, port))
+            await stream.write(handshake + buf.remaining())
+            if self.wait_connect:
+                reply = await stream.handshake()
+                writer.write(reply)
+                if reply[1] != protocol.REP_SUCCESS:
+                    stream.close()
+                    return
+            else:
+                # The browser's first data travels right behind the server handshake
+                writer.write(protocol.success_reply(PLACEHOLDER_BIND))
+        except HandshakeFailed as e:
+            logger.warning("Stream to %s:%s failed: %s", address, port, e)
+            stream.close()
+            writer.write(protocol.failure_reply(protocol.REP_GENERAL_FAILURE))
+            return
+        except BaseException:
+            stream.close()
+            raise
+        await mux.relay(stream, reader, writer)
+
+
+async def read_message(reader, buf, parse):
+    while True:
+        message = parse()
+        if message is not None:
+            return message
+        data = await reader.read(4096)
+        if not data:
+            return None
+        buf.feed(data)
+
+
+async def serve(agent, host, port):
+    server = await asyncio.start_server(agent.handle, host, port)
+    logger.info("SOCKS5 agent listening on %s:%s, forwarding to %s:%s",
+                host, port, agent.server_host, agent.server_port)
+    async with server:
+        await server.serve_forever()
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return host.strip('[]'), int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SOCKS5 agent multiplexing connections to the server')
+    parser.add_argument('--server', required=True, type=parse_address,
+                        help="Server mux endpoint, host:port (the server's MUX_PORT)")
+    parser.add_argument('--listen', default='127.0.0.1:1080', type=parse_address,
+                        help='Local SOCKS5 address (default: 127.0.0.1:1080)')
+    parser.add_argument('-u', '--username', help='Username for the server')
+    parser.add_argument('-p', '--password', help='Password for the server')
+    parser.add_argument('--no-compression', action='store_true', help='Never compress stream data')
+    parser.add_argument('--wait-connect', action='store_true',
+                        help="Wait for the server's CONNECT reply before answering the browser")
+    parser.add_argument('-v', '--verbose', action='store_true', help='Debug logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    agent = Agent(*args.server, args.username, args.password,
+                  compress=not args.no_compression, wait_connect=args.wait_connect)
+    try:
+        asyncio.run(serve(agent, *args.listen))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+连接准入控制
+
+达到 MAX_CONNECTIONS 时不再直接关闭新连接：
+- 新连接先进入一个有界的等待队列，在 ADMISSION_TIMEOUT 内有连接释放就按先来先得放行
+- 每个来源 IP 的并发数（PER_IP_MAX_CONNECTIONS）和新建连接速率（令牌桶）单独限制，
+  单个客户端的突发不会挤占其他客户端
+- 被拒绝的连接收到正常的 SOCKS5 拒绝回复，而不是被直接重置
+
+AdmissionController 只做计数和排队，不做 I/O，线程模式和 asyncio 模式共用；
+等待事件由调用方提供（threading.Event 或 asyncio.Event）。
+"""
+
+import os
+import time
+import logging
+import selectors
+import threading
+from collections import deque
+
+import protocol
+
+logger = logging.getLogger(__name__)
+
+ADMITTED = 'admitted'
+QUEUED = 'queued'
+REJECTED = 'rejected'
+
+# 拒绝原因
+REASON_FULL = 'full'          # 全局连接数已满且等待队列已满/等待超时
+REASON_PER_IP = 'per_ip'      # 该 IP 并发连接数超限
+REASON_RATE = 'rate'          # 该 IP 新建连接速率超限
+
+# 令牌桶数量超过该值时清理已回满（长时间无新连接）的桶
+_BUCKET_PRUNE_THRESHOLD = 10000
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Ticket:
+    """一次准入判定的结果；QUEUED 时通过 event 等待放行"""
+    __slots__ = ('ip', 'status', 'reason', 'event', 'granted')
+
+    def __init__(self, ip, status, reason=None, event=None):
+        self.ip = ip
+        self.status = status
+        self.reason = reason
+        self.event = event
+        self.granted = False
+
+    @property
+    def rep(self):
+        """拒绝时回复给客户端的 SOCKS5 回复码"""
+        if self.reason in (REASON_PER_IP, REASON_RATE):
+            return protocol.REP_NOT_ALLOWED
+        return protocol.REP_GENERAL_FAILURE
+
+
+class AdmissionController:
+    def __init__(self, max_connections, queue_size=0, queue_timeout=0,
+                 per_ip_max=0, per_ip_rate=0, per_ip_burst=0):
+        """per_ip_max / per_ip_rate 为 0 表示不限制"""
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.per_ip_max = per_ip_max
+        self.per_ip_rate = per_ip_rate
+        self.per_ip_burst = max(per_ip_burst, 1)
+        self.active = 0
+        self.admitted = 0        # 累计放行的连接数
+        self.queue = deque()     # 等待中的 Ticket，先来先得
+        self.per_ip = {}         # ip -> 已放行 + 等待中的连接数
+        self.buckets = {}        # ip -> TokenBucket
+        self._lock = threading.Lock()
+
+    def try_admit(self, ip, event_factory=threading.Event):
+        """立即判定，不阻塞：返回 ADMITTED、QUEUED（需等待 ticket.event）或 REJECTED 的 Ticket"""
+        with self._lock:
+            if self.per_ip_rate > 0 and not self._bucket(ip).take(time.monotonic()):
+                return Ticket(ip, REJECTED, REASON_RATE)
+            count = self.per_ip.get(ip, 0)
+            if self.per_ip_max > 0 and count >= self.per_ip_max:
+                return Ticket(ip, REJECTED, REASON_PER_IP)
+            if self.active < self.max_connections and not self.queue:
+                self.per_ip[ip] = count + 1
+                self.active += 1
+                self.admitted += 1
+                ticket = Ticket(ip, ADMITTED)
+                ticket.granted = True
+                return ticket
+            if len(self.queue) < self.queue_size:
+                self.per_ip[ip] = count + 1
+                ticket = Ticket(ip, QUEUED, event=event_factory())
+                self.queue.append(ticket)
+                return ticket
+            return Ticket(ip, REJECTED, REASON_FULL)
+
+    def wait(self, ticket):
+        """线程模式：阻塞等待放行，返回是否获得连接名额"""
+        ticket.event.wait(self.queue_timeout)
+        return self.settle(ticket)
+
+    def settle(self, ticket):
+        """等待结束（放行或超时）后调用，返回是否获得连接名额"""
+        with self._lock:
+            if ticket.granted:
+                return True
+            # 超时：退出队列，释放占用的每 IP 计数
+            try:
+                self.queue.remove(ticket)
+            except ValueError:
+                pass
+            self._forget(ticket.ip)
+            ticket.status = REJECTED
+            ticket.reason = REASON_FULL
+            return False
+
+    def release(self, ip):
+        """已放行的连接结束；有等待者时名额直接转交给队首"""
+        with self._lock:
+            self._forget(ip)
+            if self.queue:
+                ticket = self.queue.popleft()
+                ticket.granted = True
+                ticket.status = ADMITTED
+                self.admitted += 1
+                ticket.event.set()
+            else:
+                self.active -= 1
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': len(self.queue),
+            'tracked_ips': len(self.per_ip),
+        }
+
+    def _forget(self, ip):
+        """调用方需持有锁"""
+        count = self.per_ip.get(ip, 0) - 1
+        if count > 0:
+            self.per_ip[ip] = count
+        else:
+            self.per_ip.pop(ip, None)
+
+    def _bucket(self, ip):
+        """调用方需持有锁"""
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            if len(self.buckets) >= _BUCKET_PRUNE_THRESHOLD:
+                self._prune_buckets()
+            bucket = self.buckets[ip] = TokenBucket(self.per_ip_rate, self.per_ip_burst)
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for ip, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[ip]
+
+
+class Rejection:
+    """被拒绝连接的握手状态机（不做 I/O）
+
+    选择客户端提供的无认证或用户名/密码方法并读完请求，再用 rep 回复请求，
+    客户端看到的是 SOCKS5 请求失败而不是认证失败。用户名/密码不做校验、
+    一律回复成功：请求随后总是被拒绝，不会因此放行任何连接。
+    两种方法都没有提供时回复“无可接受的认证方法”（05 FF）。
+    """
+    __slots__ = ('buf', 'rep', 'method')
+
+    def __init__(self, rep):
+        self.buf = protocol.HandshakeBuffer()
+        self.rep = rep
+        self.method = None  # 已选择的认证方法；用户名/密码认证读完后置为无认证
+
+    def feed(self, data):
+        """返回 (要发送的数据, 是否结束)"""
+        self.buf.feed(data)
+        out = b''
+        if self.method is None:
+            greeting = self.buf.parse_greeting()
+            if greeting is None:
+                return out, False
+            version, methods = greeting
+            if version != protocol.SOCKS_VERSION:
+                return out, True
+            if protocol.METHOD_NO_AUTH in methods:
+                self.method = protocol.METHOD_NO_AUTH
+            elif protocol.METHOD_USER_PASS in methods:
+                self.method = protocol.METHOD_USER_PASS
+            else:
+                return protocol.method_reply(protocol.METHOD_NO_ACCEPTABLE), True
+            out = protocol.method_reply(self.method)
+        if self.method == protocol.METHOD_USER_PASS:
+            if self.buf.parse_auth() is None:
+                return out, False
+            self.method = protocol.METHOD_NO_AUTH
+            out += protocol.auth_reply(0)
+        if self.buf.parse_request() is None:
+            return out, False
+        return out + protocol.failure_reply(self.rep), True
+
+
+class _PendingRejection:
+    __slots__ = ('sock', 'state', 'deadline')
+
+    def __init__(self, sock, rep, deadline):
+        self.sock = sock
+        self.state = Rejection(rep)
+        self.deadline = deadline
+
+
+class Rejector:
+    """在单个后台线程里给被拒绝的连接发送 SOCKS5 拒绝回复
+
+    接受循环和连接线程都不会因为慢客户端阻塞；同时处理的连接数有上限，
+    超出时直接关闭。
+    """
+
+    def __init__(self, timeout=2, max_pending=1024):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.selector = selectors.DefaultSelector()
+        self.incoming = deque()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+    def start(self):
+        t = threading.Thread(target=self._run, name="rejector")
+        t.daemon = True
+        t.start()
+
+    def reject(self, sock, rep):
+        """接管 socket，回复后关闭（可在任意线程调用）"""
+        # 唤醒管道也注册在 selector 中，不计入
+        if len(self.incoming) + len(self.selector.get_map()) > self.max_pending:
+            sock.close()
+            return
+        self.incoming.append(_PendingRejection(sock, rep, time.monotonic() + self.timeout))
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    def _run(self):
+        while True:
+            for key, _ in self.selector.select(0.5):
+                if key.data is None:
+                    self._register()
+                else:
+                    self._read(key.data)
+            now = time.monotonic()
+            expired = [key.data for key in list(self.selector.get_map().values())
+                       if key.data is not None and key.data.deadline <= now]
+            for pending in expired:
+                self._close(pending)
+
+    def _register(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.incoming:
+            pending = self.incoming.popleft()
+            try:
+                pending.sock.setblocking(False)
+                self.selector.register(pending.sock, selectors.EVENT_READ, pending)
+            except (OSError, ValueError):
+                pending.sock.close()
+
+    def _read(self, pending):
+        try:
+            data = pending.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(pending)
+            return
+        out, done = pending.state.feed(data)
+        if out:
+            try:
+                # 回复只有几个字节，非阻塞 socket 的发送缓冲区一定放得下
+                pending.sock.send(out)
+            except OSError:
+                done = True
+        if done:
+            self._close(pending)
+
+    def _close(self, pending):
+        try:
+            self.selector.unregister(pending.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            pending.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,535 @@
+"""
+asyncio 版本的 SOCKS5 连接处理
+
+所有连接运行在同一个事件循环上：握手对应 Socks5Server.handle_client，
+数据转发对应 Socks5Server.exchange_loop，协议行为与线程模式逐字节一致。
+每条空闲隧道只占用两个协程和少量缓冲，单进程即可维持数万条长连接。
+"""
+
+import asyncio
+import time
+import socket
+import logging
+import threading
+
+import chain
+import profiling
+import protocol
+import relay
+import routing
+import timerwheel
+import tunnel
+import upstream
+from admission import ADMITTED, REJECTED, AdmissionController, Rejection
+from auth import StaticCredentials
+from logutil import ConnectionSampler
+from metrics import REJECTION_COUNTERS, Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSocks5Server:
+    def __init__(self, listener, username, password, socket_timeout, max_connections,
+                 buffer_size=4096, max_buffer_size=4096, socket_options=(True, 0, 0),
+                 resolver=None, happy_eyeballs_delay=0.25, warm_pool=None, metrics=None,
+                 log_sampler=None, udp_relay=None, admission=None, backlog=100, reject_timeout=2,
+                 credentials=None, tunnels=None, timers=None, handshake_timeout=None,
+                 connect_timeout=None, router=None, parents=None, default_route=routing.DIRECT,
+                 shaper=None, profiler=None):
+        """handshake_timeout / connect_timeout 未指定时使用 socket_timeout，为 0 时不限时；
+        空闲超时由 tunnels（TunnelRegistry）负责，默认也是 socket_timeout"""
+        self.listener = listener
+        self.username = username
+        self.password = password
+        self.credentials = credentials if credentials is not None else StaticCredentials(username, password)
+        self.timers = timers if timers is not None else timerwheel.TimerWheel()
+        self.tunnels = tunnels if tunnels is not None else tunnel.TunnelRegistry(self.timers, socket_timeout)
+        self.socket_timeout = socket_timeout
+        self.handshake_timeout = socket_timeout if handshake_timeout is None else handshake_timeout
+        self.connect_timeout = (socket_timeout if connect_timeout is None else connect_timeout) or None
+        self.max_connections = max_connections
+        self.buffer_size = buffer_size
+        self.max_buffer_size = max_buffer_size
+        self.socket_options = socket_options
+        self.resolver = resolver
+        self.router = router
+        self.parents = parents
+        self.default_route = default_route
+        self.shaper = shaper
+        self.profiler = profiler if profiler is not None else profiling.Profiler()
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.warm_pool = warm_pool
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.log_sampler = log_sampler if log_sampler is not None else ConnectionSampler()
+        self.udp_relay = udp_relay
+        self.admission = admission if admission is not None else AdmissionController(max_connections)
+        self.backlog = backlog
+        self.reject_timeout = reject_timeout
+        # stop() 可能在事件循环启动之前从其他线程调用
+        self._stop_lock = threading.Lock()
+        self._loop = None
+        self._stopping = None
+        self._drain_timeout = None
+        self._accepting = set()  # accept() 交来、尚未结束的连接任务
+
+    @property
+    def active_connections(self):
+        return self.admission.active
+
+    @property
+    def total_connections(self):
+        return self.admission.admitted
+
+    def run(self):
+        """服务直到 stop() 后现有连接结束"""
+        self.timers.start()
+        asyncio.run(self._serve())
+
+    def stop(self, drain_timeout=0):
+        """停止接受新连接，现有连接结束（最多等 drain_timeout 秒）后 run() 返回；可在任意线程调用"""
+        with self._stop_lock:
+            self._drain_timeout = drain_timeout
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._request_stop)
+
+    def _request_stop(self):
+        if not self._stopping.done():
+            self._stopping.set_result(None)
+
+    async def _serve(self):
+        with self._stop_lock:
+            self._loop = asyncio.get_running_loop()
+            self._stopping = self._loop.create_future()
+            if self._drain_timeout is not None:
+                self._request_stop()
+        # start_server 会对传入的 socket 重新调用 listen(backlog)
+        server = await asyncio.start_server(self._on_client, sock=self.listener, backlog=self.backlog)
+        try:
+            await self._stopping
+        finally:
+            server.close()
+        # 先让出一轮：刚被 accept、尚未进入 _on_client 的连接还没有计入活跃数
+        deadline = time.monotonic() + self._drain_timeout
+        await asyncio.sleep(0.5)
+        while self.active_connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        if self.active_connections:
+            logger.warning("Closing %s connection(s) still open after draining", self.active_connections)
+
+    def accept(self, sock, addr):
+        """其他线程交来的连接（多路复用会话上的一条流），与监听 socket 上的连接同样处理"""
+        loop = self._loop
+        if loop is None:
+            sock.close()  # 事件循环尚未启动
+            return
+        loop.call_soon_threadsafe(self._spawn, sock, addr)
+
+    def _spawn(self, sock, addr):
+        # 事件循环只弱引用任务，需自己持有直到完成
+        task = asyncio.ensure_future(self._accept(sock, addr))
+        self._accepting.add(task)
+        task.add_done_callback(self._accepting.discard)
+
+    async def _accept(self, sock, addr):
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await self._on_client(reader, writer, addr)
+
+    async def _on_client(self, reader, writer, peer=None):
+        """peer 为 None 时使用 socket 的对端地址"""
+        client_ip, client_port = peer or writer.get_extra_info('peername')[:2]
+
+        # 准入控制：并发数、每 IP 限制；名额已满时在等待队列中等待
+        ticket = self.admission.try_admit(client_ip, asyncio.Event)
+        if ticket.status != ADMITTED and ticket.status != REJECTED:
+            try:
+                await asyncio.wait_for(ticket.event.wait(), self.admission.queue_timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.admission.settle(ticket)
+        if ticket.status == REJECTED:
+            await self._reject(reader, writer, client_ip, client_port, ticket)
+            return
+        self.metrics.inc('accepted')
+        # 未被取样的连接只输出警告和错误
+        verbose = self.log_sampler()
+
+        try:
+            await self.handle_client(reader, writer, client_ip, client_port, verbose)
+        finally:
+            writer.close()
+            self.admission.release(client_ip)
+            if verbose:
+                logger.info("Client disconnected: %s:%s (active: %s)",
+                            client_ip, client_port, self.active_connections)
+
+    async def _reject(self, reader, writer, client_ip, client_port, ticket):
+        """回复 SOCKS5 拒绝后关闭连接"""
+        logger.warning("Rejecting %s:%s (%s)", client_ip, client_port, ticket.reason)
+        self.metrics.inc(REJECTION_COUNTERS[ticket.reason])
+        state = Rejection(ticket.rep)
+        try:
+            done = False
+            while not done:
+                data = await asyncio.wait_for(reader.read(4096), self.reject_timeout)
+                if not data:
+                    break
+                out, done = state.feed(data)
+                if out:
+                    writer.write(out)
+                    await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_message(self, reader, buf, parse):
+        """从握手缓冲区解析一条报文，数据不足时继续读取；客户端关闭时返回 None"""
+        while True:
+            message = parse()
+            if message is not None:
+                return message
+            data = await reader.read(4096)
+            if not data:
+                return None
+            buf.feed(data)
+
+    async def handle_client(self, reader, writer, client_ip, client_port, verbose=True):
+        loop = asyncio.get_running_loop()
+        accepted_at = loop.time()
+        profiler = self.profiler
+        handshake_started = profiler.clock()
+        sock = writer.get_extra_info('socket')
+        # 握手超时由时间轮 shutdown 客户端 socket，读取随即得到 EOF；不为每次读取创建超时
+        handshake_timer = None
+        if self.handshake_timeout:
+            handshake_timer = self.timers.schedule(self.handshake_timeout, _handshake_expired,
+                                                   sock, client_ip, client_port)
+        try:
+            relay.tune_socket(sock, *self.socket_options)
+            if verbose:
+                logger.info("Client connected: %s:%s", client_ip, client_port)
+
+            # 1. 握手阶段
+            buf = protocol.HandshakeBuffer()
+            greeting = await self._read_message(reader, buf, buf.parse_greeting)
+            if greeting is None:
+                logger.warning("Client %s:%s sent empty header", client_ip, client_port)
+                return
+
+            version, methods = greeting
+            if version != protocol.SOCKS_VERSION:
+                logger.warning("Invalid SOCKS version %s from %s:%s", version, client_ip, client_port)
+                return
+
+            # 认证逻辑
+            usr = None
+            if self.credentials.enabled:
+                if protocol.METHOD_USER_PASS not in methods:
+                    logger.warning("Client %s:%s does not support auth method", client_ip, client_port)
+                    writer.write(protocol.method_reply(protocol.METHOD_NO_ACCEPTABLE))
+                    await writer.drain()
+                    return
+                writer.write(protocol.method_reply(protocol.METHOD_USER_PASS))
+                await writer.drain()
+
+                # 格式: 版本(1) + 用户名长度(1) + 用户名 + 密码长度(1) + 密码
+                credentials = await self._read_message(reader, buf, buf.parse_auth)
+                if credentials is None:
+                    logger.warning("Client %s:%s closed during authentication", client_ip, client_port)
+                    return
+                usr, pwd = credentials
+
+                # 缓存未命中时 KDF 需要数十毫秒，放到线程池里执行，不阻塞事件循环
+                auth_started = profiler.clock()
+                authenticated = self.credentials.verify_cached(usr, pwd)
+                if authenticated is None:
+                    authenticated = await loop.run_in_executor(None, self.credentials.verify, usr, pwd)
+                if auth_started:
+                    profiler.record(profiling.PHASE_AUTH, auth_started)
+                if authenticated:
+                    if verbose:
+                        logger.info("Auth successful for %s:%s", client_ip, client_port)
+                    writer.write(protocol.auth_reply(0))
+                    await writer.drain()
+                else:
+                    logger.warning("Auth failed for %s:%s (user: %s)", client_ip, client_port, usr)
+                    self.metrics.inc('auth_failures')
+                    writer.write(protocol.auth_reply(1))
+                    await writer.drain()
+                    return
+            else:
+                writer.write(protocol.method_reply(protocol.METHOD_NO_AUTH))
+                await writer.drain()
+
+            # 2. 请求阶段
+            request = await self._read_message(reader, buf, buf.parse_request)
+            if request is None:
+                logger.warning("Client %s:%s closed before sending a request", client_ip, client_port)
+                return
+            if not self.timers.cancel(handshake_timer):
+                return  # 握手恰好超时，连接已被 shutdown
+
+            cmd, address_type, address, port = request
+            self.metrics.observe(self.metrics.handshake_latency, loop.time() - accepted_at)
+            if handshake_started:
+                profiler.record(profiling.PHASE_HANDSHAKE, handshake_started)
+            if address is None:
+                logger.warning("Unsupported address type %s from %s:%s", address_type, client_ip, client_port)
+                writer.write(protocol.failure_reply(protocol.REP_ADDRESS_TYPE_NOT_SUPPORTED))
+                await writer.drain()
+                return
+
+            # 请求之后提前到达的数据，连接成功后转发给目标
+            early_data = buf.remaining()
+
+            # 3. 连接目标服务器
+            try:
+                if cmd == protocol.CMD_CONNECT:
+                    if verbose:
+                        logger.info("CONNECT request from %s:%s to %s:%s",
+                                    client_ip, client_port, address, port)
+                    route_started = profiler.clock()
+                    route = self.router.decide(address_type, address) if self.router is not None else self.default_route
+                    if route_started:
+                        profiler.record(profiling.PHASE_ROUTE, route_started)
+                    if route == routing.BLOCK:
+                        logger.warning("Blocked CONNECT from %s:%s to %s:%s by routing rules",
+                                       client_ip, client_port, address, port)
+                        writer.write(protocol.failure_reply(protocol.REP_NOT_ALLOWED))
+                        await writer.drain()
+                        return
+                    connect_started = loop.time()
+                    connect_clock = profiler.clock()
+                    remote_reader, remote_writer = await asyncio.wait_for(
+                        self._open_remote(address_type, address, port, route), self.connect_timeout)
+                    self.metrics.observe(self.metrics.connect_latency, loop.time() - connect_started)
+                    if connect_clock:
+                        profiler.record(profiling.PHASE_CONNECT, connect_clock)
+                    bind_address = remote_writer.get_extra_info('sockname')
+                    writer.write(protocol.success_reply(bind_address))
+                    await writer.drain()
+
+                    if verbose:
+                        logger.info("Connected to %s:%s for %s:%s", address, port, client_ip, client_port)
+                    if early_data:
+                        remote_writer.write(early_data)
+                    record = self.tunnels.open(
+                        tunnel.KIND_CONNECT, client_ip, client_port, address, port,
+                        (sock, remote_writer.get_extra_info('socket')), usr)
+                    limits = self.shaper.attach(client_ip, usr) if self.shaper is not None else None
+
+                    # 4. 数据转发阶段
+                    await self.exchange_loop(reader, writer, remote_reader, remote_writer, record, verbose,
+                                             limits)
+                elif (cmd == protocol.CMD_UDP_ASSOCIATE and self.udp_relay is not None
+                      and sock.family in (socket.AF_INET, socket.AF_INET6)):
+                    await self.udp_associate(reader, writer, client_ip, client_port, port, verbose)
+                else:
+                    # 多路复用流（本地 socketpair）上没有可回复的 UDP 地址，不支持 UDP ASSOCIATE
+                    logger.warning("Unsupported command %s from %s:%s", cmd, client_ip, client_port)
+                    writer.write(protocol.failure_reply(protocol.REP_COMMAND_NOT_SUPPORTED))
+                    await writer.drain()
+
+            except asyncio.TimeoutError:
+                logger.warning("Connection timeout to %s:%s for %s:%s",
+                               address, port, client_ip, client_port)
+                writer.write(protocol.failure_reply(protocol.REP_GENERAL_FAILURE))
+            except chain.ParentProxyError as e:
+                logger.warning("Parent proxy failed for %s:%s from %s:%s: %s",
+                               address, port, client_ip, client_port, e)
+                writer.write(protocol.failure_reply(e.rep))
+            except ConnectionRefusedError:
+                logger.warning("Connection refused to %s:%s from %s:%s",
+                               address, port, client_ip, client_port)
+                writer.write(protocol.failure_reply(protocol.REP_CONNECTION_REFUSED))
+            except Exception as e:
+                logger.error("Error connecting to %s:%s: %s", address, port, e, exc_info=True)
+                writer.write(protocol.failure_reply(protocol.REP_GENERAL_FAILURE))
+
+        except asyncio.TimeoutError:
+            logger.warning("Socket timeout for %s:%s", client_ip, client_port)
+        except Exception as e:
+            logger.error("Handler error for %s:%s: %s", client_ip, client_port, e, exc_info=True)
+        finally:
+            self.timers.cancel(handshake_timer)
+
+    async def _target_addresses(self, address_type, address, port):
+        addrs = upstream.literal_addresses(address_type, address, port)
+        if addrs is not None:
+            return addrs
+        started = self.profiler.clock()
+        loop = asyncio.get_running_loop()
+        if self.resolver is None:
+            addrs = await loop.run_in_executor(None, upstream.resolve, address, port)
+        else:
+            # 缓存命中时不进入线程池
+            addrs = self.resolver.lookup(address, port)
+            if addrs is None:
+                addrs = await loop.run_in_executor(None, self.resolver.resolve, address, port)
+        if started:
+            self.profiler.record(profiling.PHASE_DNS, started)
+        return addrs
+
+    async def _open_remote(self, address_type, address, port, route=routing.DIRECT):
+        """经上级代理（route 为 PROXY）或直连：优先取热点目标的预连接，否则双栈竞速连接目标（Happy Eyeballs）"""
+        if route == routing.PROXY:
+            if self.parents is None:
+                raise chain.ParentProxyError(protocol.REP_GENERAL_FAILURE,
+                                             "routing rule 'proxy' matched but PARENT_PROXY is not set")
+            # 与上级代理的往返（池空时还有握手）是阻塞的，放到线程池里执行
+            future = asyncio.get_running_loop().run_in_executor(
+                None, self.parents.connect, address_type, address, port)
+            try:
+                sock = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 连接超时取消的只是等待，线程池里的连接仍会完成：完成后关闭它。
+                # 此时 socket 已连到目标，不能放回会话池
+                future.add_done_callback(_close_result)
+                raise
+            try:
+                sock.setblocking(False)
+                return await asyncio.open_connection(sock=sock)
+            except BaseException:
+                sock.close()
+                raise
+        if self.warm_pool is not None:
+            sock = self.warm_pool.acquire(address, port)
+            if sock is not None:
+                sock.setblocking(False)
+                return await asyncio.open_connection(sock=sock)
+        addrs = await self._target_addresses(address_type, address, port)
+        sock = await upstream.async_happy_eyeballs_connect(
+            addrs, self.happy_eyeballs_delay,
+            lambda s: relay.tune_socket(s, *self.socket_options))
+        return await asyncio.open_connection(sock=sock)
+
+    async def udp_associate(self, reader, writer, client_ip, client_port, udp_port, verbose=True):
+        """建立 UDP 关联并保持到控制连接关闭；数据报由 UdpRelay 线程转发"""
+        loop = asyncio.get_running_loop()
+        expired = loop.create_future()
+
+        def on_close():
+            # 由 UdpRelay 线程调用；事件循环可能已经关闭
+            try:
+                loop.call_soon_threadsafe(lambda: expired.done() or expired.set_result(None))
+            except RuntimeError:
+                pass
+
+        assoc = self.udp_relay.associate(client_ip, udp_port, on_close=on_close)
+        assoc.record = self.tunnels.open(tunnel.KIND_UDP, client_ip, client_port, 'udp', assoc.port,
+                                         (writer.get_extra_info('socket'),))
+        try:
+            sockname = writer.get_extra_info('sockname')
+            writer.write(protocol.success_reply((sockname[0], assoc.port)))
+            await writer.drain()
+            if verbose:
+                logger.info("UDP ASSOCIATE for %s:%s on port %s", client_ip, client_port, assoc.port)
+            # 关联的生命周期与控制连接一致，控制连接上的其他数据忽略
+            while True:
+                read = asyncio.ensure_future(reader.read(4096))
+                done, _ = await asyncio.wait([read, expired], return_when=asyncio.FIRST_COMPLETED)
+                if read not in done:
+                    read.cancel()
+                    break
+                try:
+                    if not read.result():
+                        break
+                except ConnectionError:
+                    break
+        finally:
+            self.udp_relay.release(assoc)
+            self.tunnels.close(assoc.record)
+            if verbose:
+                logger.info("UDP association closed for %s:%s", client_ip, client_port)
+
+    async def exchange_loop(self, client_reader, client_writer, remote_reader, remote_writer,
+                            record, verbose=True, limits=None):
+        """在客户端和远程服务器之间转发数据，字节数和活跃时间记在隧道记录 record 上
+
+        limits 为 shaping.Limits 时按限额授权每次读取，结束时释放
+        """
+        client_ip, client_port = record.client_ip, record.client_port
+        target_addr, target_port = record.target_addr, record.target_port
+        # 单线程事件循环内无需加锁，仍按秒批量合并以减少开销
+        meter = self.metrics.meter()
+        self.metrics.inc('tunnels_active')
+        profiler = self.profiler
+
+        async def pump(reader, writer, upload, peer_name, gate):
+            chunk = relay.AdaptiveChunk(self.buffer_size, self.max_buffer_size)
+            while True:
+                size = chunk.size
+                if gate is not None:
+                    size, delay = gate.grant(size)
+                    if not size:
+                        # 令牌不足：暂停读取，缓冲区满后传输层停止从 socket 读取
+                        await asyncio.sleep(delay)
+                        continue
+                data = await reader.read(size)
+                if gate is not None:
+                    gate.refund(size - len(data))
+                if not data:
+                    return
+                chunk.update(len(data))
+                # 事件循环内的读写由传输层完成，这里只能计入一块数据的写出（不含等待 drain）；
+                # 系统调用按每块一次读、一次写估算
+                started = profiler.clock()
+                try:
+                    writer.write(data)
+                    if started:
+                        profiler.record(profiling.PHASE_RELAY, started)
+                        record.syscalls += 2
+                    await writer.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    if verbose:
+                        logger.info("%s closed connection for %s:%s", peer_name, client_ip, client_port)
+                    return
+                if upload:
+                    record.bytes_up += len(data)
+                    meter.add(len(data), 0)
+                else:
+                    record.bytes_down += len(data)
+                    meter.add(0, len(data))
+                record.last_active = time.monotonic()
+
+        tasks = [
+            asyncio.ensure_future(pump(client_reader, remote_writer, True, "Remote",
+                                       limits.up if limits is not None else None)),
+            asyncio.ensure_future(pump(remote_reader, client_writer, False, "Client",
+                                       limits.down if limits is not None else None)),
+        ]
+        try:
+            # 任一方向结束即关闭整条隧道；空闲超时由隧道登记表的时间轮 shutdown 两端 socket
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                e = task.exception()
+                if e is not None:
+                    logger.error("Data exchange error for %s:%s: %s", client_ip, client_port, e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            meter.flush()
+            self.metrics.inc('tunnels_active', -1)
+            if limits is not None:
+                limits.close()
+            self.tunnels.close(record)
+            remote_writer.close()
+            if verbose:
+                logger.info("Connection closed: %s:%s -> %s:%s (sent: %s bytes, received: %s bytes)",
+                            client_ip, client_port, target_addr, target_port,
+                            record.bytes_up, record.bytes_down)
+
+
+def _close_result(future):
+    """已被放弃的线程池连接完成后关闭其 socket"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _handshake_expired(sock, client_ip, client_port):
+    """时间轮线程：握手超时，shutdown 后事件循环上的读取得到 EOF"""
+    logger.warning("Handshake timeout for %s:%s", client_ip, client_port)
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
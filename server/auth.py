@@ -0,0 +1,291 @@
+"""
+用户名/密码认证（RFC 1929）
+
+用户保存在 AUTH_FILE 中，每行一个 "用户名:密码哈希"，# 开头为注释：
+
+    alice:$scrypt$16384$8$1$<salt>$<hash>
+    bob:$pbkdf2-sha256$600000$<salt>$<hash>
+
+- 密码用 scrypt（不可用时 PBKDF2-SHA256）加盐哈希，比较使用 hmac.compare_digest
+- 文件修改后自动重新加载（按 mtime 检查，最多每 reload_interval 秒一次），无需重启；
+  新文件解析失败时保留旧的用户表
+- KDF 每次需要数十毫秒，最近验证成功的 (用户名, 密码) 记在有界 LRU 缓存中并带过期时间；
+  缓存键是进程内随机密钥的 HMAC 摘要，内存中不保存明文密码，
+  摘要包含存储的哈希，修改密码或删除用户后旧缓存自然失效
+
+未配置 AUTH_FILE 时使用 config.py 中的 USERNAME/PASSWORD（StaticCredentials）。
+
+管理用户（写入临时文件后原子替换，运行中的服务器自动加载）：
+    python3 auth.py add users.txt alice
+    python3 auth.py remove users.txt alice
+    python3 auth.py list users.txt
+"""
+
+import os
+import sys
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+_SALT_SIZE = 16
+_KEY_SIZE = 32
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem 要能容纳 128 * n * r 字节的工作内存
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r, dklen=_KEY_SIZE)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, _KEY_SIZE)
+
+
+def hash_password(password):
+    """返回可写入用户文件的密码哈希字符串"""
+    salt = os.urandom(_SALT_SIZE)
+    if hasattr(hashlib, 'scrypt'):
+        key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f'$scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}'
+    key = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+    return f'$pbkdf2-sha256${PBKDF2_ITERATIONS}${_b64encode(salt)}${_b64encode(key)}'
+
+
+def verify_password(password, encoded):
+    """常数时间比较密码与哈希；哈希格式不可识别时返回 False"""
+    try:
+        parts = encoded.split('$')
+        if parts[1] == 'scrypt':
+            n, r, p = int(parts[2]), int(parts[3]), int(parts[4])
+            salt, expected = _b64decode(parts[5]), _b64decode(parts[6])
+            key = _scrypt(password, salt, n, r, p)
+        elif parts[1] == 'pbkdf2-sha256':
+            salt, expected = _b64decode(parts[3]), _b64decode(parts[4])
+            key = _pbkdf2(password, salt, int(parts[2]))
+        else:
+            return False
+    except (IndexError, ValueError):
+        return False
+    return hmac.compare_digest(key, expected)
+
+
+def _check_hash(encoded):
+    parts = encoded.split('$')
+    if len(parts) < 2 or parts[0] or parts[1] not in ('scrypt', 'pbkdf2-sha256'):
+        raise ValueError("unsupported password hash")
+    if parts[1] == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+        raise ValueError("hashlib.scrypt is not available")
+
+
+def load_users(path):
+    """解析用户文件，返回 {用户名: 密码哈希}；格式错误抛出 ValueError"""
+    users = {}
+    with open(path, encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            username, sep, encoded = line.partition(':')
+            if not sep or not username:
+                raise ValueError(f"{path}:{lineno}: expected 'username:hash'")
+            try:
+                _check_hash(encoded)
+            except ValueError as e:
+                raise ValueError(f"{path}:{lineno}: {e}") from None
+            users[username] = encoded
+    return users
+
+
+def save_users(path, users):
+    """原子写入用户文件（先写临时文件再 rename）"""
+    tmp = f'{path}.tmp.{os.getpid()}'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for username, encoded in users.items():
+            f.write(f'{username}:{encoded}\n')
+    os.replace(tmp, path)
+
+
+class StaticCredentials:
+    """config.py 中的单个 USERNAME/PASSWORD"""
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+    @property
+    def enabled(self):
+        return bool(self.username and self.password)
+
+    def verify_cached(self, username, password):
+        return self.verify(username, password)
+
+    def verify(self, username, password):
+        # 分别比较，不因用户名不匹配而提前返回
+        user_ok = hmac.compare_digest(username.encode('utf-8'), self.username.encode('utf-8'))
+        password_ok = hmac.compare_digest(password.encode('utf-8'), self.password.encode('utf-8'))
+        return user_ok and password_ok
+
+    def stats(self):
+        return {'users': 1 if self.enabled else 0}
+
+
+class CredentialStore:
+    def __init__(self, path, cache_size=1024, cache_ttl=300, reload_interval=1):
+        """cache_size 为 0 时不缓存验证结果"""
+        self.path = path
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.reload_interval = reload_interval
+        self.users = {}
+        self.mtime = None
+        self.next_check = 0
+        self.reloads = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()  # HMAC 摘要 -> 过期时间
+        self._cache_key = os.urandom(32)
+        self._lock = threading.Lock()
+        # 未知用户也执行一次 KDF，响应时间不暴露用户名是否存在
+        self._dummy_hash = hash_password(_b64encode(os.urandom(_SALT_SIZE)))
+        self.reload()
+
+    @property
+    def enabled(self):
+        return True
+
+    def reload(self):
+        """重新读取用户文件；失败时保留当前用户表，返回是否加载成功"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            users = load_users(self.path)
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load credentials from %s: %s", self.path, e)
+            return False
+        with self._lock:
+            self.users = users
+            self.mtime = mtime
+            self.reloads += 1
+        logger.info("Loaded %s users from %s", len(users), self.path)
+        return True
+
+    def verify_cached(self, username, password):
+        """只查验证缓存：命中返回 True，未命中返回 None（需调用 verify）"""
+        self._maybe_reload()
+        encoded = self.users.get(username)
+        if encoded is None or not self.cache_size:
+            return None
+        digest = self._digest(username, password, encoded)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._cache.get(digest)
+            if expires is None or expires <= now:
+                return None
+            self._cache.move_to_end(digest)
+            self.cache_hits += 1
+        return True
+
+    def verify(self, username, password):
+        """验证用户名和密码，缓存未命中时执行 KDF（阻塞数十毫秒）"""
+        if self.verify_cached(username, password):
+            return True
+        encoded = self.users.get(username)
+        if encoded is None:
+            verify_password(password, self._dummy_hash)
+            return False
+        if self.cache_size:
+            self.cache_misses += 1
+        if not verify_password(password, encoded):
+            return False
+        if self.cache_size:
+            digest = self._digest(username, password, encoded)
+            with self._lock:
+                self._cache[digest] = time.monotonic() + self.cache_ttl
+                self._cache.move_to_end(digest)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return True
+
+    def stats(self):
+        return {
+            'users': len(self.users),
+            'reloads': self.reloads,
+            'cache_entries': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def _digest(self, username, password, encoded):
+        message = '\0'.join((username, password, encoded)).encode('utf-8')
+        return hmac.new(self._cache_key, message, hashlib.sha256).digest()
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.reload_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.mtime:
+            self.reload()
+
+
+def _main(argv):
+    import getpass
+
+    usage = "usage: auth.py add|remove|list USERS_FILE [USERNAME]"
+    if len(argv) < 2 or argv[0] not in ('add', 'remove', 'list'):
+        print(usage, file=sys.stderr)
+        return 2
+    command, path = argv[0], argv[1]
+    users = load_users(path) if os.path.exists(path) else {}
+    if command == 'list':
+        for username in users:
+            print(username)
+        return 0
+    if len(argv) < 3:
+        print(usage, file=sys.stderr)
+        return 2
+    username = argv[2]
+    if ':' in username or len(username.encode('utf-8')) > 255:
+        print("username must not contain ':' and must fit in 255 bytes", file=sys.stderr)
+        return 2
+    if command == 'remove':
+        if users.pop(username, None) is None:
+            print(f"no such user: {username}", file=sys.stderr)
+            return 1
+    else:
+        password = getpass.getpass(f"Password for {username}: ")
+        if password != getpass.getpass("Repeat password: "):
+            print("passwords do not match", file=sys.stderr)
+            return 1
+        if not password or len(password.encode('utf-8')) > 255:
+            print("password must be 1-255 bytes", file=sys.stderr)
+            return 2
+        users[username] = hash_password(password)
+    save_users(path, users)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))
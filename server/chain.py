@@ -0,0 +1,282 @@
+"""
+经上级 SOCKS5 代理转发（路由规则中的 proxy 动作，或未配置规则时的全部 CONNECT）
+
+上级代理写作 'host:port' 或 'username:password@host:port'。
+
+ParentPool 为每个上级预先建立已完成问候和认证的空闲会话，CONNECT 时取出一条
+只发送请求，每条隧道只需一个往返；池空时现场建立会话。多个上级按配置顺序使用，
+连接或握手失败的上级被标记为不可用并切换到下一个，之后按指数退避由后台线程重试，
+握手成功后恢复。上级对 CONNECT 的失败回复码原样回复给客户端，不触发切换。
+"""
+
+import time
+import socket
+import struct
+import logging
+import threading
+from collections import deque
+
+import protocol
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# 不可用的上级第一次在 RETRY_BASE 秒后重试，之后每次加倍，最长 RETRY_MAX 秒
+RETRY_BASE = 2
+RETRY_MAX = 60
+
+
+class ParentProxyError(OSError):
+    """上级代理拒绝了请求；rep 为应回复给客户端的回复码"""
+
+    def __init__(self, rep, message):
+        super().__init__(message)
+        self.rep = rep
+
+
+class ParentProxy:
+    __slots__ = ('host', 'port', 'username', 'password')
+
+    def __init__(self, host, port, username=None, password=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+
+    def __str__(self):
+        return f'[{self.host}]:{self.port}' if ':' in self.host else f'{self.host}:{self.port}'
+
+
+def parse_parent(value):
+    """'host:port' 或 'username:password@host:port' -> ParentProxy"""
+    userinfo, _, hostport = value.rpartition('@')
+    host, port = upstream.parse_destination(hostport)
+    username, _, password = userinfo.partition(':')
+    if not username:
+        return ParentProxy(host, port)
+    return ParentProxy(host, port, username, password)
+
+
+def open_session(parent, timeout, setup=None):
+    """连接上级代理并完成问候和认证，返回可发送请求的 socket（超时为 timeout）"""
+    sock = socket.create_connection((parent.host, parent.port), timeout)
+    try:
+        if setup is not None:
+            setup(sock)
+        if parent.username:
+            sock.sendall(protocol.greeting((protocol.METHOD_NO_AUTH, protocol.METHOD_USER_PASS)))
+        else:
+            sock.sendall(protocol.greeting((protocol.METHOD_NO_AUTH,)))
+        version, method = struct.unpack("!BB", _recv_exact(sock, 2))
+        if version != protocol.SOCKS_VERSION:
+            raise ConnectionError(f"parent proxy {parent} is not a SOCKS5 server")
+        if method == protocol.METHOD_USER_PASS and parent.username:
+            sock.sendall(protocol.auth_request(parent.username, parent.password))
+            if _recv_exact(sock, 2)[1] != 0:
+                raise ConnectionError(f"authentication to parent proxy {parent} failed")
+        elif method != protocol.METHOD_NO_AUTH:
+            raise ConnectionError(f"parent proxy {parent} requires an unsupported auth method {method}")
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+def request(sock, parent, address_type, address, port, timeout):
+    """在已认证的会话上请求 CONNECT；成功后 socket 不带超时，可直接转发数据
+
+    上级回复失败码时抛出 ParentProxyError，会话失效（对端已关闭）时抛出 OSError。
+    """
+    sock.settimeout(timeout)
+    sock.sendall(protocol.connect_request(address_type, address, port))
+    # 只读取回复本身：目标先发送的数据（如 SMTP 问候）紧随其后，需留给转发逻辑
+    header = _recv_exact(sock, 5)
+    if header[1] != protocol.REP_SUCCESS:
+        raise ParentProxyError(header[1], f"parent proxy {parent} replied {header[1]}")
+    if header[3] == protocol.ATYP_IPV4:
+        _recv_exact(sock, 4 + 2 - 1)
+    elif header[3] == protocol.ATYP_IPV6:
+        _recv_exact(sock, 16 + 2 - 1)
+    else:
+        _recv_exact(sock, header[4] + 2)
+    sock.settimeout(None)
+    return sock
+
+
+def _recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionResetError("parent proxy closed the connection")
+        data += chunk
+    return data
+
+
+class _Parent:
+    __slots__ = ('proxy', 'idle', 'healthy', 'failures', 'retry_at',
+                 'hits', 'misses', 'handshakes', 'handshake_time')
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.idle = deque()  # deque[(创建时间, socket)]
+        self.healthy = True
+        self.failures = 0    # 连续失败次数
+        self.retry_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.handshakes = 0
+        self.handshake_time = 0.0
+
+
+class ParentPool:
+    """上级代理的会话池与故障切换
+
+    后台线程为每个可用的上级保持 size 条空闲会话，空闲超过 idle_timeout 的会话在
+    被上级的握手超时关闭之前主动替换（idle_timeout 应小于上级的 HANDSHAKE_TIMEOUT）。
+    """
+
+    def __init__(self, parents, size, idle_timeout, timeout, setup=None, interval=1):
+        """timeout 为连接上级和等待其回复的超时（0 为不限时）；setup(sock) 在连接后调整 socket 选项"""
+        self.parents = [_Parent(proxy) for proxy in parents]
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout or None
+        self.setup = setup
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        t = threading.Thread(target=self._run, name="parent-pool")
+        t.daemon = True
+        t.start()
+        logger.info("Parent proxy pool started for %s", ', '.join(str(p.proxy) for p in self.parents))
+
+    def connect(self, address_type, address, port):
+        """经第一个可用的上级连接目标，返回已可转发数据的 socket"""
+        candidates = [p for p in self.parents if p.healthy]
+        if not candidates:
+            # 全部不可用时仍按顺序尝试，不等后台线程重试
+            candidates = self.parents
+        last_error = None
+        for parent in candidates:
+            sock = self._take(parent)
+            if sock is not None:
+                try:
+                    return request(sock, parent.proxy, address_type, address, port, self.timeout)
+                except (ParentProxyError, socket.timeout):
+                    sock.close()
+                    raise
+                except OSError:
+                    sock.close()  # 空闲会话已被上级关闭，改用新会话
+            try:
+                sock = self._open(parent)
+            except OSError as e:
+                self._fail(parent, e)
+                last_error = e
+                continue
+            try:
+                return request(sock, parent.proxy, address_type, address, port, self.timeout)
+            except (ParentProxyError, socket.timeout):
+                # 上级已正常握手：失败回复或等待回复超时取决于目标，不切换上级
+                sock.close()
+                raise
+            except OSError as e:
+                sock.close()
+                self._fail(parent, e)
+                last_error = e
+        raise ParentProxyError(protocol.REP_GENERAL_FAILURE, f"no parent proxy available: {last_error}")
+
+    def stats(self):
+        result = {}
+        for parent in self.parents:
+            total = parent.hits + parent.misses
+            result[str(parent.proxy)] = {
+                'healthy': parent.healthy,
+                'failures': parent.failures,
+                'idle': len(parent.idle),
+                'hits': parent.hits,
+                'misses': parent.misses,
+                'hit_rate': round(parent.hits / total, 3) if total else 0.0,
+                # 未命中时客户端需要额外等待的平均握手耗时
+                'avg_handshake_ms': (round(parent.handshake_time / parent.handshakes * 1000, 1)
+                                     if parent.handshakes else 0.0),
+            }
+        return result
+
+    def _take(self, parent):
+        """取出一条空闲会话，池空时返回 None"""
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            while parent.idle:
+                created, sock = parent.idle.popleft()
+                if created > deadline and upstream.idle_alive(sock):
+                    parent.hits += 1
+                    self._wakeup.set()
+                    return sock
+                sock.close()
+            parent.misses += 1
+        self._wakeup.set()
+        return None
+
+    def _open(self, parent):
+        started = time.monotonic()
+        sock = open_session(parent.proxy, self.timeout, self.setup)
+        parent.handshakes += 1
+        parent.handshake_time += time.monotonic() - started
+        return sock
+
+    def _fail(self, parent, error):
+        """标记上级不可用，丢弃其空闲会话"""
+        with self._lock:
+            parent.failures += 1
+            parent.retry_at = time.monotonic() + min(RETRY_MAX, RETRY_BASE * 2 ** (parent.failures - 1))
+            was_healthy, parent.healthy = parent.healthy, False
+            idle = list(parent.idle)
+            parent.idle.clear()
+        for _, sock in idle:
+            sock.close()
+        if was_healthy:
+            logger.warning("Parent proxy %s is down (%s), failing over", parent.proxy, error)
+
+    def _run(self):
+        while True:
+            for parent in self.parents:
+                try:
+                    self._maintain(parent)
+                except OSError as e:
+                    self._fail(parent, e)
+                except Exception as e:
+                    logger.warning("Parent pool refill failed for %s: %s", parent.proxy, e)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _maintain(self, parent):
+        if not parent.healthy:
+            if time.monotonic() < parent.retry_at:
+                return
+            # 重试：握手成功即恢复，这条会话直接放入池中
+            sock = self._open(parent)
+            with self._lock:
+                parent.healthy = True
+                parent.failures = 0
+                parent.idle.append((time.monotonic(), sock))
+            logger.info("Parent proxy %s is back", parent.proxy)
+        # 提前一个刷新周期替换即将过期的会话
+        deadline = time.monotonic() - self.idle_timeout + self.interval
+        with self._lock:
+            fresh = []
+            for created, sock in parent.idle:
+                if created > deadline and upstream.idle_alive(sock):
+                    fresh.append((created, sock))
+                else:
+                    sock.close()
+            parent.idle.clear()
+            parent.idle.extend(fresh)
+            missing = self.size - len(parent.idle)
+
+        for _ in range(missing):
+            sock = self._open(parent)
+            with self._lock:
+                parent.idle.append((time.monotonic(), sock))
@@ -1,5 +1,15 @@
 """
 SOCKS5 Server Configuration
+
+Every value here can be overridden without editing this file, either by an
+environment variable named SOCKS5_<NAME> (e.g. SOCKS5_PORT=1080) or on the
+command line with --set NAME=VALUE; use --config to read another file.
+All settings are validated at startup: a misspelled name or an invalid value
+stops the server with a list of every problem. Unknown SOCKS5_* environment
+variables are only logged as a warning, since wrappers or other programs on
+the host may set them (--strict rejects them too). Check a file without
+starting the server with: python3 socks5_server.py --check
+Names starting with an underscore are ignored and can be used for helpers.
 """
 
 # ================= Server Configuration =================
@@ -10,19 +20,223 @@ HOST = '0.0.0.0'
 # Server port (default: 9999)
 PORT = 9999
 
+# Attempts to bind the port before giving up, waiting BIND_RETRY_DELAY
+# seconds after the first failure and doubling the wait each time.
+# 1 fails at once (same as the --fail-fast option).
+BIND_RETRIES = 5
+BIND_RETRY_DELAY = 3
+
 # Authentication credentials
 # Set USERNAME and PASSWORD to None to disable authentication
 USERNAME = "admin"
 PASSWORD = "123456"
 
+# Multi-user credentials file ("username:hash" per line). When set it replaces
+# USERNAME/PASSWORD and is reloaded automatically when the file changes.
+# Manage users with: python3 auth.py add|remove|list users.txt [USERNAME]
+AUTH_FILE = None
+# Successful logins are cached so repeat connections skip the password hash
+# (about 50 ms each); entries expire after AUTH_CACHE_TTL seconds
+AUTH_CACHE_SIZE = 1024
+AUTH_CACHE_TTL = 300
+
 # ================= Network Configuration =================
 
-# Socket timeout in seconds (prevents dead connections)
+# Default timeout in seconds for the per-phase timeouts below when a config
+# file does not set them (and for the asyncio engine's internal defaults)
 SOCKET_TIMEOUT = 30
 
+# Per-phase deadlines (0 disables a phase). The handshake and idle deadlines
+# are tracked on a single timing wheel; the connect deadline is the socket
+# (or asyncio) timeout of the upstream connect.
+# Seconds from accept until the SOCKS5 request has been received
+HANDSHAKE_TIMEOUT = 10
+# Seconds to establish the upstream TCP connection (or the parent proxy session)
+CONNECT_TIMEOUT = 10
+# Seconds an established tunnel may go without any data in either direction.
+# Keep this long enough for quiet long-lived connections such as websockets.
+IDLE_TIMEOUT = 300
+
 # Maximum concurrent connections
 MAX_CONNECTIONS = 100
 
+# ================= Overload Handling =================
+
+# Kernel accept queue length for connection bursts (capped by net.core.somaxconn)
+LISTEN_BACKLOG = 1024
+
+# Connections arriving while MAX_CONNECTIONS are active wait in a FIFO queue
+# of this size for up to ADMISSION_TIMEOUT seconds; beyond that they receive a
+# SOCKS5 "general failure" reply instead of a reset (0 disables queueing)
+ADMISSION_QUEUE_SIZE = 64
+ADMISSION_TIMEOUT = 2
+
+# Per-client-IP fairness (0 disables). Clients over the limit receive a SOCKS5
+# "connection not allowed" reply.
+# Concurrent connections (active + queued) per IP
+PER_IP_MAX_CONNECTIONS = 0
+# New connections per second per IP, with bursts up to PER_IP_BURST
+PER_IP_RATE = 0
+PER_IP_BURST = 20
+
+# DNS cache for domain-name CONNECT requests. Concurrent lookups of the same
+# name share a single resolver call.
+# Maximum number of cached names (0 disables the cache)
+DNS_CACHE_SIZE = 1024
+
+# Seconds a successful lookup is cached
+DNS_CACHE_TTL = 60
+
+# Seconds a failed lookup (unknown host) is cached
+DNS_NEGATIVE_TTL = 10
+
+# Happy Eyeballs (RFC 8305): when a target resolves to several addresses,
+# IPv6 and IPv4 addresses are tried alternately and a new attempt is started
+# every HAPPY_EYEBALLS_DELAY seconds until one connects
+HAPPY_EYEBALLS_DELAY = 0.25
+
+# Upstream pre-warming for hot destinations. The server keeps
+# PREWARM_POOL_SIZE idle, already-connected sockets to each listed
+# destination and hands one out on CONNECT instead of doing a TCP handshake.
+# Entries are 'host:port' and must match the CONNECT target exactly,
+# e.g. ['www.google.com:443', '[2001:db8::1]:443']
+PREWARM_DESTINATIONS = []
+
+# Idle connections kept per destination
+PREWARM_POOL_SIZE = 2
+
+# Seconds an idle pre-connected socket is kept before it is replaced.
+# Keep this below the destination's own idle timeout.
+PREWARM_IDLE_TIMEOUT = 20
+
+# UDP ASSOCIATE (SOCKS5 command 3) for DNS, QUIC, games and other UDP
+# traffic. Each association gets its own UDP socket; a single background
+# thread relays datagrams for all of them.
+UDP_ASSOCIATE = True
+
+# Seconds without any datagram before an association is closed. An
+# association also ends when its TCP control connection closes.
+UDP_IDLE_TIMEOUT = 60
+
+# SO_RCVBUF / SO_SNDBUF for association sockets (in bytes); large buffers
+# absorb bursts while the relay thread is busy with other associations.
+UDP_SOCKET_BUFFER = 1024 * 1024
+
+# ================= Routing Configuration =================
+
+# Rules file deciding per CONNECT whether to connect directly, reject the
+# request, or forward it through PARENT_PROXY. One "action pattern" per line:
+#   block   ads.example.com     (the domain and all of its subdomains)
+#   proxy   google.com
+#   direct  10.0.0.0/8          (CIDR, IPv4 or IPv6; matched against IP targets)
+#   proxy   *                   (everything else; direct when omitted)
+# The longest matching domain suffix or network prefix wins. Domain targets
+# are matched by name only (no DNS lookup). The file is reloaded when it
+# changes. Blocked requests receive a SOCKS5 "connection not allowed" reply.
+# None sends every request direct.
+ROUTING_RULES = None
+
+# Recent routing decisions kept per destination (0 disables the cache)
+ROUTING_CACHE_SIZE = 1024
+
+# Parent SOCKS5 proxy for the 'proxy' action: 'host:port' or
+# 'username:password@host:port'. Without ROUTING_RULES every CONNECT is
+# forwarded to it (proxy chaining).
+PARENT_PROXY = None
+
+# Several parents in priority order (overrides PARENT_PROXY). A parent that
+# fails to connect or authenticate is skipped in favour of the next one and
+# retried in the background with exponential backoff.
+PARENT_PROXIES = []
+
+# Sessions kept open per parent that have already completed the greeting and
+# authentication, so a tunnel only pays for its CONNECT round trip
+# (0 disables pooling)
+PARENT_POOL_SIZE = 4
+
+# Seconds an idle pooled session is kept before it is replaced. Keep this
+# below the parent's own handshake timeout (HANDSHAKE_TIMEOUT on this server).
+PARENT_POOL_IDLE_TIMEOUT = 8
+
+# ================= Bandwidth Configuration =================
+
+# Token-bucket rate limits in bytes per second, enforced separately for each
+# direction (upload and download); 0 means unlimited. A tunnel is bound by
+# every limit that applies to it. Tunnels sharing a limit get an even share
+# of it, and a throttled tunnel stops reading from its socket until tokens
+# are available (TCP flow control then slows the sender down).
+BANDWIDTH_LIMIT = 0      # whole server
+BANDWIDTH_PER_IP = 0     # each client IP
+BANDWIDTH_PER_USER = 0   # each authenticated user
+
+# Per-user overrides of BANDWIDTH_PER_USER, e.g. {'alice': 10 * 1024 * 1024, 'backup': 0}
+BANDWIDTH_USERS = {}
+
+# Seconds of traffic a limit may send in one burst after being idle
+BANDWIDTH_BURST = 0.1
+
+# ================= Mux Configuration =================
+
+# Port for the local agent (client/agent.py), which carries all of a browser's
+# connections as streams over one long-lived connection: no TCP/SOCKS5 round
+# trips per new connection, per-stream flow control and optional compression.
+# Each stream is an ordinary SOCKS5 session (authentication, routing and
+# bandwidth limits apply as usual); UDP ASSOCIATE is not available over mux.
+# 0 disables the mux listener.
+MUX_PORT = 0
+
+# Compress stream payloads with zlib when both ends agree; frames that do not
+# shrink (TLS, media) are sent as is, so the cost on encrypted traffic is small
+MUX_COMPRESSION = True
+
+# Bytes a stream may have in flight before the receiver acknowledges them
+MUX_WINDOW = 256 * 1024
+
+# ================= Profiling Configuration =================
+
+# Profiling is off by default and toggled at runtime, so it can stay in
+# production builds (off, each probe is a single attribute check):
+#   kill -USR1 <pid>   phase timing on/off: count, total and max time spent in
+#                      handshake, auth, route, dns, connect, relay and log, plus
+#                      per-tunnel syscall counts in /tunnels; logged when switched off
+#   kill -USR2 <pid>   stack sampling on/off: samples every thread's stack and
+#                      writes collapsed stacks (flamegraph.pl / speedscope) to PROFILE_DIR
+# The same switches are on the metrics endpoint: GET /profile,
+# POST /profile/phases?enable=1|0 and POST /profile/stacks?enable=1|0
+# (all of them need METRICS_TOKEN, see below).
+# With WORKERS > 1, signal the supervisor and it forwards them to every worker.
+PROFILE_DIR = 'logs'
+
+# Seconds between stack samples
+PROFILE_INTERVAL = 0.005
+
+# ================= Metrics Configuration =================
+
+# Prometheus text-format endpoint at http://METRICS_HOST:METRICS_PORT/metrics
+# exposing active connections, accept rate, handshake/connect latency
+# histograms, throughput, auth failures and DNS/warm-pool statistics.
+# 0 disables the endpoint. With WORKERS > 1, worker N serves on METRICS_PORT + N.
+#
+# The same port serves the live tunnel registry:
+#   GET  /tunnels[?ip=CLIENT_IP]        tunnels as JSON, longest idle first
+#   POST /tunnels/kill?id=N             close one tunnel
+#   POST /tunnels/kill?ip=CLIENT_IP     close every tunnel from a client
+METRICS_PORT = 0
+
+# Interface the metrics endpoint binds to. Binding to 127.0.0.1 does not
+# make it private: the proxy does not refuse CONNECT to loopback, so every
+# authenticated proxy user can reach this port through the proxy and read
+# /metrics. /tunnels lists other users' client IPs and targets and /profile
+# their timings, so those need METRICS_TOKEN like the POST endpoints.
+METRICS_HOST = '127.0.0.1'
+
+# Admin token required by GET /tunnels, GET /profile and the POST endpoints
+# that change state, sent as "Authorization: Bearer <token>". None disables
+# them (403).
+# Example: curl -X POST -H "Authorization: Bearer $TOKEN" \
+#              "http://127.0.0.1:9100/tunnels/kill?ip=203.0.113.7"
+METRICS_TOKEN = None
+
 # ================= Logging Configuration =================
 
 # Log file path (relative to server directory)
@@ -37,13 +251,83 @@ MAX_LOG_SIZE = 10 * 1024 * 1024
 # Number of backup log files to keep
 LOG_BACKUP_COUNT = 5
 
+# Log records are handed to a background writer thread through a bounded
+# queue so relay threads never wait on disk or console I/O. When the queue
+# is full new records are dropped (the count is logged at shutdown).
+LOG_QUEUE_SIZE = 10000
+
+# Fraction of connections that get per-connection INFO logs (connect, auth,
+# CONNECT, close). 1.0 logs every connection, 0.01 logs one in 100.
+# Warnings and errors are always logged.
+LOG_SAMPLE_RATE = 1.0
+
 # ================= Advanced Configuration =================
 
-# Buffer size for data transfer (in bytes)
+# Buffer size for data transfer (in bytes). Each tunnel starts relaying with
+# chunks of this size and grows them towards RELAY_MAX_BUFFER_SIZE while a
+# direction keeps filling whole chunks (bulk transfer); interactive flows
+# shrink back to BUFFER_SIZE.
 BUFFER_SIZE = 4096
 
-# Enable detailed connection logging
+# Upper bound for the adaptive relay chunk size (in bytes)
+RELAY_MAX_BUFFER_SIZE = 256 * 1024
+
+# Disable Nagle's algorithm on client and remote sockets
+TCP_NODELAY = True
+
+# SO_RCVBUF / SO_SNDBUF for client and remote sockets (in bytes).
+# 0 keeps the kernel's automatic buffer tuning, which is usually best.
+SOCKET_RCVBUF = 0
+SOCKET_SNDBUF = 0
+
+# Enable detailed connection logging (False turns off per-connection INFO
+# logs regardless of LOG_SAMPLE_RATE)
 VERBOSE = True
 
+# Relay data with os.splice() through a kernel pipe on Linux (zero-copy).
+# When splice is unavailable the relay reuses a preallocated buffer instead.
+RELAY_SPLICE = True
+
 # PID file location (for systemd/supervisor integration)
 PID_FILE = 'socks5.pid'
+
+# Hot restart: a running server listens on this Unix socket. Starting a new
+# one with `python3 socks5_server.py --takeover` passes the listening sockets
+# to it, so the port never stops accepting; the old process then stops
+# accepting and exits once its open tunnels have closed, waiting at most
+# DRAIN_TIMEOUT seconds. None (the default) disables it. Only used with
+# WORKERS = 1. Use an absolute path private to this instance, e.g.
+# '/run/simplevpn/handoff.sock': instances sharing a path race for it and
+# the later one runs without hot restart.
+HANDOFF_SOCKET = None
+DRAIN_TIMEOUT = 60
+
+# ================= Engine Configuration =================
+
+# Connection engine:
+#   'thread'  - one thread per connection (default)
+#   'asyncio' - all connections on a single event loop; holds tens of
+#               thousands of idle keep-alive tunnels in one process.
+#               Raise MAX_CONNECTIONS and `ulimit -n` to match.
+SERVER_MODE = 'thread'
+
+# Relay engine for SERVER_MODE = 'thread':
+#   'thread' - each tunnel is relayed by its own connection thread
+#   'epoll'  - after the CONNECT reply, tunnels are handed to a shared
+#              edge-triggered epoll reactor (Linux only), so a few threads
+#              forward traffic for thousands of connections
+RELAY_ENGINE = 'thread'
+
+# Number of reactor threads used by RELAY_ENGINE = 'epoll'
+RELAY_THREADS = 2
+
+# Number of worker processes. Each worker binds its own listener on
+# HOST:PORT with SO_REUSEPORT and the kernel balances accepts across them.
+# Crashed workers are restarted automatically.
+#   1 - single process (default)
+#   0 - one worker per CPU core
+WORKERS = 1
+
+# Interval (seconds) at which the supervisor logs aggregated per-worker
+# connection counts
+WORKER_STATS_INTERVAL = 60
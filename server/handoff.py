@@ -0,0 +1,171 @@
+"""
+热重启：经 Unix socket（SCM_RIGHTS）把监听 socket 交给新进程
+
+    python3 socks5_server.py --takeover
+
+1. 新进程连接旧进程的 HANDOFF_SOCKET，旧进程把监听 socket（以及指标端口的监听 socket）
+   的文件描述符发给新进程；两个进程共享同一个内核监听队列，不需要重新 bind，不丢连接
+2. 新进程开始接受连接后回复 READY
+3. 旧进程停止接受新连接，关闭自己的 HANDOFF_SOCKET 并回复 BYE，之后等待现有隧道
+   结束（最多 DRAIN_TIMEOUT 秒）再退出；新进程收到 BYE 后接管 HANDOFF_SOCKET，
+   以便下一次热重启
+
+新进程在 READY 之前失败（连接断开）时，旧进程照常服务。
+"""
+
+import os
+import json
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_REQUEST = b'TAKEOVER\n'
+_READY = b'READY\n'
+_BYE = b'BYE\n'
+_MAX_FDS = 8
+_TIMEOUT = 10
+
+
+class Takeover:
+    """新进程一侧：从旧进程取得的监听 socket"""
+
+    def __init__(self, conn, sockets, pid):
+        self.conn = conn
+        self.sockets = sockets  # 名称 -> socket
+        self.pid = pid
+
+    def complete(self):
+        """已开始接受连接：通知旧进程停止接受，等它让出 HANDOFF_SOCKET"""
+        try:
+            self.conn.sendall(_READY)
+            if _recv_line(self.conn) != _BYE:
+                logger.warning("Previous server (pid %s) did not confirm the handoff", self.pid)
+        except OSError as e:
+            logger.warning("Handoff confirmation failed: %s", e)
+        finally:
+            self.conn.close()
+
+
+def request(path, timeout=_TIMEOUT):
+    """向旧进程请求监听 socket；没有可接管的旧进程时返回 None"""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(path)
+        conn.sendall(_REQUEST)
+        message, fds, _, _ = socket.recv_fds(conn, 4096, _MAX_FDS)
+    except OSError as e:
+        conn.close()
+        logger.warning("No server to take over at %s (%s), binding normally", path, e)
+        return None
+    try:
+        header = json.loads(message.decode('utf-8'))
+        names, pid = header['names'], header['pid']
+    except (ValueError, KeyError, TypeError) as e:
+        # 旧进程在发送途中退出时可能收到空的或不完整的消息
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        logger.warning("Invalid handoff message from %s (%s), binding normally", path, e)
+        return None
+    sockets = {name: socket.socket(fileno=fd) for name, fd in zip(names, fds)}
+    logger.info("Took over %s from pid %s", ', '.join(sockets), pid)
+    return Takeover(conn, sockets, pid)
+
+
+class HandoffServer:
+    """旧进程一侧：在后台线程等待新进程接管
+
+    provide() 返回 {名称: 监听 socket}；新进程回复 READY 后调用 on_handoff()，
+    由它停止接受连接并开始排空。
+    """
+
+    def __init__(self, path, provide, on_handoff):
+        self.path = path
+        self.provide = provide
+        self.on_handoff = on_handoff
+        self.sock = None
+
+    def start(self):
+        """绑定 HANDOFF_SOCKET 并启动后台线程；无法绑定或路径正被另一个运行中的服务器使用时返回 False"""
+        if _alive(self.path):
+            logger.warning("Handoff socket %s belongs to another running server, hot restart disabled",
+                           self.path)
+            return False
+        try:
+            os.unlink(self.path)  # 上次异常退出留下的文件
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 以 0600 创建：bind 之后再 chmod，中间有一段时间其他用户可以连接
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+            self.sock.listen(1)
+        except OSError as e:
+            logger.warning("Cannot listen on handoff socket %s, hot restart disabled: %s", self.path, e)
+            self.sock.close()
+            return False
+        finally:
+            os.umask(umask)
+        t = threading.Thread(target=self._run, name="handoff")
+        t.daemon = True
+        t.start()
+        return True
+
+    def _run(self):
+        while True:
+            conn, _ = self.sock.accept()
+            conn.settimeout(_TIMEOUT)
+            try:
+                if self._serve(conn):
+                    return
+            except OSError as e:
+                logger.warning("Hot restart handoff failed, still serving: %s", e)
+            finally:
+                conn.close()
+
+    def _serve(self, conn):
+        """返回 True 表示已交接完成"""
+        if _recv_line(conn) != _REQUEST:
+            return False
+        sockets = self.provide()
+        header = json.dumps({'pid': os.getpid(), 'names': list(sockets)}).encode('utf-8')
+        socket.send_fds(conn, [header], [sock.fileno() for sock in sockets.values()])
+        # 新进程要完成初始化才回复，不设超时
+        conn.settimeout(None)
+        if _recv_line(conn) != _READY:
+            logger.warning("New server exited before taking over, still serving")
+            return False
+        logger.info("New server took over the listening sockets, draining")
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        conn.sendall(_BYE)
+        self.on_handoff()
+        return True
+
+
+def _alive(path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def _recv_line(conn):
+    data = b''
+    while not data.endswith(b'\n') and len(data) < 64:
+        chunk = conn.recv(64 - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
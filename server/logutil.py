@@ -0,0 +1,145 @@
+"""
+异步日志管道
+
+业务线程只把日志记录放进有界队列（QueueHandler），由后台线程（QueueListener）
+统一写文件和控制台，转发线程不再因为磁盘/终端 I/O 在 handler 锁上互相等待。
+- 日志文件按 MAX_LOG_SIZE 轮转，保留 LOG_BACKUP_COUNT 个备份
+- 队列满时直接丢弃并计数，宁可少记日志也不阻塞转发
+- fork 出的工作进程里重新创建队列并启动写线程
+- 打开分阶段计时（profiling）时记录业务线程提交每条日志的耗时（含格式化）
+
+ConnectionSampler 用于高流量部署：只为每 N 个连接输出一次逐连接的 INFO 日志，
+警告和错误始终输出。
+"""
+
+import os
+import queue
+import atexit
+import logging
+import itertools
+import logging.handlers
+
+from profiling import PHASE_LOG
+
+LOG_FORMAT = '[%(asctime)s] [%(levelname)s] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_pipeline = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志记录而不是阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.profiler = None  # profiling.Profiler
+
+    def handle(self, record):
+        profiler = self.profiler
+        started = profiler.clock() if profiler is not None else 0
+        if not started:
+            return super().handle(record)
+        try:
+            return super().handle(record)
+        finally:
+            profiler.record(PHASE_LOG, started)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(self, handlers, queue_size=10000):
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.listener = None
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(
+            self.handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """写完队列中剩余的日志后停止后台线程"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self.handler.dropped:
+            # 此时写线程已停止，直接交给目标 handler
+            record = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                       "%d log records dropped (log queue full)",
+                                       (self.handler.dropped,), None)
+            for handler in self.handlers:
+                handler.handle(record)
+        for handler in self.handlers:
+            handler.flush()
+
+    def _after_fork(self):
+        # 子进程中只有调用 fork 的线程存活，父进程的写线程和队列状态都不可用
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        if self.listener is not None:
+            self.start()
+
+
+def setup_logging(log_file, level='INFO', max_bytes=10 * 1024 * 1024, backup_count=5,
+                  queue_size=10000):
+    """把根 logger 接到异步管道上，返回 LogPipeline"""
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+    handlers = [
+        logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                             backupCount=backup_count, encoding='utf-8'),
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    global _pipeline
+    pipeline = _pipeline = LogPipeline(handlers, queue_size)
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level, logging.INFO))
+    root.addHandler(pipeline.handler)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=pipeline._after_fork)
+    return pipeline
+
+
+def set_profiler(profiler):
+    """让日志管道向 profiler（profiling.Profiler）报告提交日志的耗时"""
+    if _pipeline is not None:
+        _pipeline.handler.profiler = profiler
+
+
+def shutdown():
+    """写完缓冲的日志；以 os._exit 退出的进程不会执行 atexit，需要显式调用"""
+    if _pipeline is not None:
+        _pipeline.stop()
+
+
+class ConnectionSampler:
+    """决定某个连接是否输出逐连接的 INFO 日志
+
+    rate=1 记录全部连接，rate=0.01 每 100 个连接记录一个，rate=0 全部不记录。
+    按计数而不是随机数取样，保证输出均匀、开销固定。
+    """
+
+    def __init__(self, rate=1.0):
+        self.every = round(1 / rate) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def __call__(self):
+        if self.every <= 1:
+            return self.every == 1
+        # itertools.count 的 next() 在 GIL 下是原子操作，无需加锁
+        return next(self._counter) % self.every == 0
@@ -108,8 +108,7 @@ install() {
     
     # 4. 复制文件
     print_info "复制文件..."
-    cp "$SCRIPT_DIR/socks5_server.py" "$INSTALL_DIR/"
-    cp "$SCRIPT_DIR/config.py" "$INSTALL_DIR/"
+    cp "$SCRIPT_DIR"/*.py "$INSTALL_DIR/"
     cp "$SCRIPT_DIR/requirements.txt" "$INSTALL_DIR/" 2>/dev/null || true
     print_success "文件已复制"
     
@@ -0,0 +1,193 @@
+"""
+运行指标，按 Prometheus 文本格式输出（HTTP 端点见 metrics_http.MetricsServer）
+
+计数器只在连接级事件（接受、拒绝、认证失败、握手完成）时加锁更新一次；
+转发热路径上的字节数先累加在每条隧道自己的 ByteMeter 里，
+最多每秒合并一次到全局计数，数据块级别不加锁。
+"""
+
+import time
+import threading
+
+# 延迟直方图的桶边界（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# 准入拒绝原因（admission.REASON_*）对应的计数器
+REJECTION_COUNTERS = {
+    'full': 'rejected_max_connections',
+    'per_ip': 'rejected_per_ip',
+    'rate': 'rejected_rate_limited',
+}
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """调用方需持有 Metrics 的锁"""
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ByteMeter:
+    """单条隧道的字节计数，批量合并到全局指标"""
+    __slots__ = ('metrics', 'up', 'down', 'flushed_at')
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.up = 0
+        self.down = 0
+        self.flushed_at = time.monotonic()
+
+    def add(self, up, down):
+        self.up += up
+        self.down += down
+        now = time.monotonic()
+        if now - self.flushed_at >= self.FLUSH_INTERVAL:
+            self.flushed_at = now
+            self.flush()
+
+    def flush(self):
+        if self.up or self.down:
+            self.metrics.add_bytes(self.up, self.down)
+            self.up = self.down = 0
+
+
+class _Rate:
+    """两次抓取之间的平均速率"""
+    __slots__ = ('value', 'at')
+
+    def __init__(self):
+        self.value = 0
+        self.at = time.monotonic()
+
+    def update(self, value):
+        now = time.monotonic()
+        elapsed = now - self.at
+        rate = (value - self.value) / elapsed if elapsed > 0 else 0.0
+        self.value, self.at = value, now
+        return rate
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected_max_connections = 0
+        self.rejected_per_ip = 0
+        self.rejected_rate_limited = 0
+        self.auth_failures = 0
+        self.tunnels_active = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.handshake_latency = Histogram()
+        self.connect_latency = Histogram()
+        self._rates = {'accept': _Rate(), 'up': _Rate(), 'down': _Rate()}
+        # 额外的指标来源：返回 [(name, type, help, value), ...] 的可调用对象，
+        # name 可以带 Prometheus 标签，例如 'x_total{destination="a:443"}'
+        self.collectors = []
+        self.active_connections = lambda: 0
+
+    def inc(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def observe(self, histogram, value):
+        with self._lock:
+            histogram.observe(value)
+
+    def add_bytes(self, up, down):
+        with self._lock:
+            self.bytes_up += up
+            self.bytes_down += down
+
+    def meter(self):
+        return ByteMeter(self)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            samples = [
+                ('socks5_connections_active', 'gauge', 'Client connections being served',
+                 self.active_connections()),
+                ('socks5_tunnels_active', 'gauge', 'Established tunnels being relayed',
+                 self.tunnels_active),
+                ('socks5_accepted_total', 'counter', 'Accepted client connections', self.accepted),
+                ('socks5_accept_rate', 'gauge', 'Accepted connections per second since last scrape',
+                 self._rates['accept'].update(self.accepted)),
+                ('socks5_rejected_max_connections_total', 'counter',
+                 'Connections rejected by MAX_CONNECTIONS after the admission queue was full or timed out',
+                 self.rejected_max_connections),
+                ('socks5_rejected_per_ip_total', 'counter',
+                 'Connections rejected by PER_IP_MAX_CONNECTIONS', self.rejected_per_ip),
+                ('socks5_rejected_rate_limited_total', 'counter',
+                 'Connections rejected by the per-IP connection rate limit', self.rejected_rate_limited),
+                ('socks5_auth_failures_total', 'counter', 'Failed username/password authentications',
+                 self.auth_failures),
+                ('socks5_bytes_upstream_total', 'counter', 'Bytes relayed from clients to targets',
+                 self.bytes_up),
+                ('socks5_bytes_downstream_total', 'counter', 'Bytes relayed from targets to clients',
+                 self.bytes_down),
+                ('socks5_bytes_upstream_per_second', 'gauge', 'Upstream throughput since last scrape',
+                 self._rates['up'].update(self.bytes_up)),
+                ('socks5_bytes_downstream_per_second', 'gauge', 'Downstream throughput since last scrape',
+                 self._rates['down'].update(self.bytes_down)),
+            ]
+            histograms = [
+                ('socks5_handshake_seconds', 'Time from accept to a parsed SOCKS5 request',
+                 self._copy(self.handshake_latency)),
+                ('socks5_upstream_connect_seconds', 'Time to resolve and connect to the target',
+                 self._copy(self.connect_latency)),
+            ]
+        for collector in self.collectors:
+            samples.extend(collector())
+
+        lines = []
+        described = set()
+        for name, kind, help_text, value in samples:
+            # 带标签的样本（name{label="..."}）只输出一次 HELP/TYPE
+            base = name.split('{', 1)[0]
+            if base not in described:
+                described.add(base)
+                lines.append(f"# HELP {base} {help_text}")
+                lines.append(f"# TYPE {base} {kind}")
+            lines.append(f"{name} {_format(value)}")
+        for name, help_text, hist in histograms:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {hist.count}')
+            lines.append(f"{name}_sum {_format(hist.sum)}")
+            lines.append(f"{name}_count {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _copy(hist):
+        copy = Histogram(hist.bounds)
+        copy.counts = list(hist.counts)
+        copy.sum = hist.sum
+        copy.count = hist.count
+        return copy
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
@@ -0,0 +1,147 @@
+"""
+指标端点：Prometheus 文本格式的 /metrics，另提供活跃隧道的查询和关闭接口、性能剖析开关
+
+只在配置了 METRICS_PORT 时导入，不使用指标端点的进程不加载 http.server。
+"""
+
+import hmac
+import json
+import logging
+import threading
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """GET /metrics
+    GET /tunnels[?ip=客户端IP]            活跃隧道列表（JSON，按空闲时间从长到短，需要管理令牌）
+    POST /tunnels/kill?id=N | ?ip=客户端IP  关闭隧道（需要管理令牌）
+    GET /profile                          性能剖析状态和分阶段耗时（JSON，需要管理令牌）
+    POST /profile/phases?enable=1|0       开关分阶段计时（需要管理令牌）
+    POST /profile/stacks?enable=1|0       开关栈采样，关闭时返回结果文件路径（需要管理令牌）
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            body = self.server.metrics.render().encode('utf-8')
+            self._send(200, 'text/plain; version=0.0.4; charset=utf-8', body)
+        elif url.path == '/tunnels' and self.server.tunnels is not None:
+            # 列表里有其他用户的客户端IP、用户名和目标地址，和 kill 一样要令牌
+            if not self._authorized():
+                return
+            query = parse_qs(url.query)
+            registry = self.server.tunnels
+            result = registry.stats()
+            result['list'] = registry.snapshot(query['ip'][0] if 'ip' in query else None)
+            self._send_json(200, result)
+        elif url.path == '/profile' and self.server.profiler is not None:
+            if self._authorized():
+                self._send_json(200, self.server.profiler.stats())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path in ('/profile/phases', '/profile/stacks') and self.server.profiler is not None:
+            if self._authorized():
+                self._toggle_profile(url)
+            return
+        if url.path != '/tunnels/kill' or self.server.tunnels is None:
+            self.send_error(404)
+            return
+        if not self._authorized():
+            return
+        query = parse_qs(url.query)
+        registry = self.server.tunnels
+        if 'id' in query:
+            try:
+                killed = int(registry.kill(int(query['id'][0])))
+            except ValueError:
+                self.send_error(400, "id must be an integer")
+                return
+        elif 'ip' in query:
+            killed = registry.kill_ip(query['ip'][0])
+        else:
+            self.send_error(400, "expected id or ip")
+            return
+        logger.warning("Killed %s tunnel(s) via %s", killed, self.path)
+        self._send_json(200, {'killed': killed})
+
+    def _toggle_profile(self, url):
+        query = parse_qs(url.query)
+        enable = query.get('enable', ['1'])[0]
+        if enable not in ('0', '1'):
+            self.send_error(400, "enable must be 0 or 1")
+            return
+        profiler = self.server.profiler
+        result = {}
+        if url.path == '/profile/phases':
+            profiler.set_phases(enable == '1')
+        else:
+            result['dump'] = profiler.set_sampling(enable == '1')
+        result.update(profiler.stats())
+        self._send_json(200, result)
+
+    def _authorized(self):
+        """校验 Authorization: Bearer <METRICS_TOKEN>，失败时已回复错误
+
+        指标端点只监听回环地址也不够：代理不拒绝到 127.0.0.1 的 CONNECT，
+        任何通过认证的代理用户都能访问到它。未配置令牌时隧道列表、剖析结果和改变状态的接口一律禁用。
+        """
+        token = self.server.token
+        if not token:
+            self.send_error(403, "set METRICS_TOKEN to enable this endpoint")
+            return False
+        scheme, _, value = self.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(value.strip().encode(), token.encode()):
+            self.send_error(401, "invalid or missing bearer token")
+            return False
+        return True
+
+    def _send_json(self, status, result):
+        self._send(status, 'application/json', json.dumps(result).encode('utf-8'))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """在独立线程中提供 GET /metrics、/tunnels（tunnels 为 TunnelRegistry 时）
+    和 /profile（profiler 为 profiling.Profiler 时）"""
+
+    def __init__(self, metrics, host, port, tunnels=None, sock=None, profiler=None, token=None):
+        """sock 为热重启时从旧进程接管的监听 socket，此时不再绑定 host:port；
+        token 为 POST 接口要求的管理令牌，None 时这些接口被禁用"""
+        self.httpd = ThreadingHTTPServer((host, port), _Handler, bind_and_activate=sock is None)
+        if sock is not None:
+            self.httpd.socket.close()
+            self.httpd.socket = sock
+            self.httpd.server_address = sock.getsockname()
+            # 交接期间两个进程都在 accept，非阻塞时被对方抢走的连接不会让 accept 卡住
+            sock.setblocking(False)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self.httpd.tunnels = tunnels
+        self.httpd.profiler = profiler
+        self.httpd.token = token
+
+    def start(self):
+        t = threading.Thread(target=self.httpd.serve_forever, name="metrics-http")
+        t.daemon = True
+        t.start()
+        host, port = self.httpd.server_address[:2]
+        logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,366 @@
+"""
+多路复用传输：本地代理（client/agent.py）与服务器之间的一条长连接承载多条流
+
+浏览器的每个连接在本地代理上完成 SOCKS5 问候，之后只需在已建立的长连接上打开一条流，
+不再为每个连接单独建立 TCP 连接、经历慢启动和握手往返。
+
+流中承载的就是完整的 SOCKS5 字节流（问候 + 认证 + 请求 + 数据）：服务器为每条流创建
+一对本地 socket（socketpair），把其中一端交给与普通连接相同的处理路径，准入控制、
+认证、路由、限速和隧道登记表全部照常生效，本地 socket 上的握手没有网络往返。
+
+帧格式：类型(1) + 标志(1) + 流 ID(4) + 负载长度(4) + 负载
+
+    HELLO   会话开始时双方各发送一次，标志为支持的选项（FLAG_COMPRESS），
+            负载为 4 字节的每流接收窗口
+    OPEN    本地代理打开一条流（流 ID 由本地代理分配）
+    DATA    流数据；带 FLAG_COMPRESSED 时负载经 zlib 压缩
+    WINDOW  归还发送窗口，负载为 4 字节的增量
+    CLOSE   关闭一条流（任一方向结束即关闭整条流，与普通隧道相同）
+
+- 流量控制：每条流初始可发送对端窗口大小的字节数（未压缩的字节数），接收方把数据写入本地
+  socket 后归还窗口；慢的流只会暂停自己，不会阻塞同一会话上的其他流
+- 压缩：双方都启用时逐帧压缩，压缩后没有明显变小的帧原样发送；同一条流连续
+  _GIVE_UP 帧压缩无效（TLS 等已加密的流量）后，该流不再尝试压缩
+"""
+
+import zlib
+import struct
+import socket
+import asyncio
+import logging
+import itertools
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PREFACE = b'SVMUX/1\n'
+
+HELLO = 0
+OPEN = 1
+DATA = 2
+WINDOW = 3
+CLOSE = 4
+
+FLAG_COMPRESS = 0x01    # HELLO：支持压缩
+FLAG_COMPRESSED = 0x01  # DATA：负载已压缩
+
+HEADER = struct.Struct('!BBII')
+MAX_FRAME = 64 * 1024   # 单帧负载上限（压缩前）
+WINDOW_SIZE = 256 * 1024
+
+# 小于此长度的数据不压缩；压缩后不小于原长度 _MIN_RATIO 的帧原样发送
+_MIN_COMPRESS = 256
+_MIN_RATIO = 0.9
+_GIVE_UP = 4
+_HELLO_TIMEOUT = 10
+
+
+class ProtocolError(Exception):
+    pass
+
+
+_HELLO = struct.Struct('!I')
+
+
+async def hello(reader, writer, flags, window=WINDOW_SIZE, timeout=_HELLO_TIMEOUT):
+    """交换前导和 HELLO，返回 (双方都支持的选项, 对端的每流接收窗口)"""
+    writer.write(PREFACE + HEADER.pack(HELLO, flags, 0, _HELLO.size) + _HELLO.pack(window))
+    await writer.drain()
+    size = len(PREFACE) + HEADER.size + _HELLO.size
+    preface = await asyncio.wait_for(reader.readexactly(size), timeout)
+    kind, peer_flags, _, length = HEADER.unpack_from(preface, len(PREFACE))
+    if preface[:len(PREFACE)] != PREFACE or kind != HELLO or length != _HELLO.size:
+        raise ProtocolError("peer is not a mux endpoint")
+    peer_window = _HELLO.unpack_from(preface, size - _HELLO.size)[0]
+    if not peer_window:
+        raise ProtocolError("peer advertised an empty window")
+    return flags & peer_flags, peer_window
+
+
+class Stream:
+    """会话上的一条流"""
+
+    def __init__(self, session, stream_id):
+        self.session = session
+        self.id = stream_id
+        self.credit = session.peer_window  # 还可以发给对端的字节数
+        self.received = 0             # 已收到、尚未归还窗口的字节数
+        self.unacked = 0              # 已写入本地 socket、尚未归还窗口的字节数
+        self.inbox = deque()
+        self.closed = False
+        self.incompressible = 0
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+
+    async def read(self):
+        """返回下一块数据，流已关闭时返回 b''"""
+        while not self.inbox:
+            if self.closed:
+                return b''
+            self._readable.clear()
+            await self._readable.wait()
+        return self.inbox.popleft()
+
+    def consumed(self, n):
+        """read() 得到的 n 字节已交付给本地 socket，积累到窗口的四分之一时归还"""
+        self.unacked += n
+        if self.unacked >= self.session.window // 4 and not self.closed:
+            self.received -= self.unacked
+            self.session.send(WINDOW, 0, self.id, struct.pack('!I', self.unacked))
+            self.unacked = 0
+
+    async def write(self, data):
+        """按发送窗口分帧发送，窗口用完时等待对端归还"""
+        view = memoryview(data)
+        while view:
+            while self.credit <= 0 and not self.closed:
+                self._writable.clear()
+                await self._writable.wait()
+            if self.closed:
+                raise ConnectionResetError("mux stream closed")
+            n = min(len(view), self.credit, MAX_FRAME)
+            self.credit -= n
+            self.session.send_data(self, bytes(view[:n]))
+            view = view[n:]
+        await self.session.drain()
+
+    def close(self):
+        if not self.closed:
+            self.session.send(CLOSE, 0, self.id, b'')
+            self._closed()
+
+    def _closed(self):
+        self.closed = True
+        self.session.streams.pop(self.id, None)
+        self._readable.set()
+        self._writable.set()
+
+
+class Session:
+    """一条长连接上的多路复用会话（两端共用）
+
+    本地代理调用 open() 打开流；服务器传入 on_stream(stream)，收到 OPEN 时调用。
+    """
+
+    def __init__(self, reader, writer, compress=False, window=WINDOW_SIZE, peer_window=WINDOW_SIZE,
+                 on_stream=None):
+        """window 为本端每条流的接收窗口，peer_window 为对端在 HELLO 中通告的窗口"""
+        self.reader = reader
+        self.writer = writer
+        self.compress = compress
+        self.window = window
+        self.peer_window = peer_window
+        self.on_stream = on_stream
+        self.streams = {}
+        self.closed = False
+        # 压缩效果统计：DATA 负载压缩前/实际发送的字节数
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._ids = itertools.count(1)
+
+    def open(self):
+        if self.closed:
+            raise ConnectionResetError("mux session closed")
+        stream = Stream(self, next(self._ids))
+        self.streams[stream.id] = stream
+        self.send(OPEN, 0, stream.id, b'')
+        return stream
+
+    def send(self, kind, flags, stream_id, payload):
+        if not self.closed:
+            self.writer.write(HEADER.pack(kind, flags, stream_id, len(payload)) + payload)
+
+    def send_data(self, stream, data):
+        flags = 0
+        self.raw_bytes += len(data)
+        if self.compress and stream.incompressible < _GIVE_UP and len(data) >= _MIN_COMPRESS:
+            packed = zlib.compress(data, 1)
+            if len(packed) < len(data) * _MIN_RATIO:
+                data, flags = packed, FLAG_COMPRESSED
+                stream.incompressible = 0
+            else:
+                stream.incompressible += 1
+        self.wire_bytes += len(data)
+        self.send(DATA, flags, stream.id, data)
+
+    async def drain(self):
+        if self.closed:
+            raise ConnectionResetError("mux session closed")
+        await self.writer.drain()
+
+    async def run(self):
+        """读取并分发帧，直到连接断开；返回前关闭所有流"""
+        try:
+            while True:
+                kind, flags, stream_id, length = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+                if length > MAX_FRAME + 1024:
+                    raise ProtocolError(f"frame of {length} bytes")
+                payload = await self.reader.readexactly(length) if length else b''
+                self._dispatch(kind, flags, stream_id, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ProtocolError, zlib.error, struct.error) as e:
+            logger.warning("Closing mux session: %s", e)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for stream in list(self.streams.values()):
+            stream._closed()
+        self.writer.close()
+
+    def _dispatch(self, kind, flags, stream_id, payload):
+        if kind == DATA:
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                return  # 本端刚关闭的流，对端尚未收到 CLOSE
+            if flags & FLAG_COMPRESSED:
+                inflater = zlib.decompressobj()
+                payload = inflater.decompress(payload, MAX_FRAME)
+                if inflater.unconsumed_tail:
+                    raise ProtocolError("compressed frame exceeds the frame limit")
+            stream.received += len(payload)
+            if stream.received > self.window:
+                raise ProtocolError(f"stream {stream_id} overran its flow-control window")
+            stream.inbox.append(payload)
+            stream._readable.set()
+        elif kind == WINDOW:
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                stream.credit += struct.unpack('!I', payload)[0]
+                stream._writable.set()
+        elif kind == OPEN:
+            if self.on_stream is None or stream_id in self.streams:
+                raise ProtocolError(f"unexpected OPEN for stream {stream_id}")
+            stream = self.streams[stream_id] = Stream(self, stream_id)
+            self.on_stream(stream)
+        elif kind == CLOSE:
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                stream._closed()
+        else:
+            raise ProtocolError(f"unknown frame type {kind}")
+
+
+async def relay(stream, reader, writer, chunk_size=MAX_FRAME):
+    """在流和本地连接之间双向转发，任一方向结束即关闭两端"""
+
+    async def outbound():
+        while True:
+            data = await reader.read(chunk_size)
+            if not data:
+                return
+            await stream.write(data)
+
+    async def inbound():
+        while True:
+            data = await stream.read()
+            if not data:
+                return
+            writer.write(data)
+            await writer.drain()
+            stream.consumed(len(data))
+
+    tasks = [asyncio.ensure_future(outbound()), asyncio.ensure_future(inbound())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stream.close()
+        writer.close()
+
+
+class MuxServer:
+    """服务器一侧：在独立线程的事件循环中接受会话
+
+    每条流创建一对本地 socket，一端经 dispatch(sock, addr) 交给普通连接的处理路径
+    （addr 为会话的对端地址，准入控制和每 IP 限制按本地代理的地址计算），
+    另一端与流双向转发。
+    """
+
+    def __init__(self, host, port, dispatch, compress=True, window=WINDOW_SIZE, sock=None):
+        self.dispatch = dispatch
+        self.flags = FLAG_COMPRESS if compress else 0
+        self.window = window
+        if sock is None:
+            # 与 SOCKS5 监听端口相同，多个工作进程共用端口
+            sock = socket.create_server((host, port), family=socket.AF_INET6 if ':' in host else socket.AF_INET,
+                                        reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+        self.sock = sock
+        self.sessions = set()
+        self._tasks = set()  # 事件循环只弱引用任务，需自己持有直到完成
+        # 已关闭会话的压缩统计
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._loop = None
+        self._server = None
+
+    def start(self):
+        t = threading.Thread(target=asyncio.run, args=(self._serve(),), name="mux")
+        t.daemon = True
+        t.start()
+        logger.info("Mux listener on %s", self.sock.getsockname()[:2])
+
+    def stop(self):
+        """停止接受新会话（热重启交接后），现有会话照常转发"""
+        loop, server = self._loop, self._server
+        if loop is not None and server is not None:
+            loop.call_soon_threadsafe(server.close)
+
+    def stats(self):
+        sessions = list(self.sessions)
+        return {
+            'sessions': len(sessions),
+            'streams': sum(len(s.streams) for s in sessions),
+            'raw_bytes': self.raw_bytes + sum(s.raw_bytes for s in sessions),
+            'wire_bytes': self.wire_bytes + sum(s.wire_bytes for s in sessions),
+        }
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._session, sock=self.sock)
+        await asyncio.Event().wait()
+
+    async def _session(self, reader, writer):
+        addr = writer.get_extra_info('peername')[:2]
+        try:
+            flags, peer_window = await hello(reader, writer, self.flags, self.window)
+        except (ProtocolError, asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as e:
+            logger.warning("Rejected mux session from %s:%s: %s", addr[0], addr[1], e)
+            writer.close()
+            return
+        session = Session(reader, writer, bool(flags & FLAG_COMPRESS), self.window, peer_window,
+                          lambda stream: self._spawn(self._stream(stream, addr)))
+        logger.info("Mux session from %s:%s (compression: %s)", addr[0], addr[1], session.compress)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+            self.raw_bytes += session.raw_bytes
+            self.wire_bytes += session.wire_bytes
+            logger.info("Mux session from %s:%s closed", addr[0], addr[1])
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _stream(self, stream, addr):
+        local, peer = socket.socketpair()
+        try:
+            self.dispatch(peer, addr)
+        except Exception as e:
+            logger.error("Cannot dispatch mux stream from %s:%s: %s", addr[0], addr[1], e)
+            peer.close()
+            local.close()
+            stream.close()
+            return
+        reader, writer = await asyncio.open_connection(sock=local)
+        await relay(stream, reader, writer)
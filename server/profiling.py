@@ -0,0 +1,209 @@
+"""
+运行时开关的性能剖析：分阶段耗时、调用栈采样、逐隧道的系统调用计数
+
+默认关闭，可在生产环境中随时打开（kill -USR1 / -USR2 <pid>，或指标端点的 /profile 接口）：
+- 分阶段计时（SIGUSR1 开关）：握手、认证、路由、DNS、连接目标、转发、日志各阶段的
+  次数、累计和最大耗时，同时统计每条隧道的系统调用数（/tunnels 中的 syscalls）；
+  每次打开时清零，关闭时把这段时间的结果写入日志
+- 调用栈采样（SIGUSR2 开关）：后台线程每 interval 秒抓取一次所有线程的调用栈，
+  关闭时按折叠栈格式（flamegraph.pl、speedscope 可直接读取）写入 dump_dir，
+  并在日志中输出采样最多的函数。cProfile 只跟踪调用它的线程，看不到转发线程和
+  反应器线程，因此采用采样；采样的是挂钟时间，阻塞在 poll/recv 上的线程同样计入
+- 关闭时每个埋点只有一次属性判断（clock() 返回 0），不取时间、不加锁
+"""
+
+import os
+import re
+import sys
+import time
+import signal
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+PHASE_HANDSHAKE = 'handshake'  # 接受连接到收到请求（含认证）
+PHASE_AUTH = 'auth'            # 校验用户名密码
+PHASE_ROUTE = 'route'          # 路由规则匹配
+PHASE_DNS = 'dns'              # 解析目标域名（含缓存查询）
+PHASE_CONNECT = 'connect'      # 连接目标或上级代理（含 DNS）
+PHASE_RELAY = 'relay'          # 转发一块数据（读 + 写）
+PHASE_LOG = 'log'              # 业务线程中格式化并提交一条日志
+
+# 栈采样的默认间隔（秒）
+SAMPLE_INTERVAL = 0.005
+
+
+class _Phase:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': round(self.total, 6),
+            'avg': round(self.total / self.count, 6) if self.count else 0,
+            'max': round(self.max, 6),
+        }
+
+
+class StackSampler(threading.Thread):
+    """定时抓取所有线程的调用栈，按折叠栈计数"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(name="profile-sampler")
+        self.daemon = True
+        self.interval = interval
+        self.stacks = Counter()  # 'thread;outer;...;inner' -> 采样次数
+        self.samples = 0
+        self.started = time.time()
+        self._stopped = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        names = {}
+        next_refresh = 0
+        while not self._stopped.wait(self.interval):
+            now = time.monotonic()
+            if now >= next_refresh:
+                # 线程名中的序号去掉，同类线程（每连接一个的转发线程）合并到一起
+                names = {t.ident: _THREAD_NUMBER.sub('', t.name) for t in threading.enumerate()}
+                next_refresh = now + 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def top(self, n=10):
+        """采样最多的 n 个函数（栈顶），返回 [(函数, 次数), ...]"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+_THREAD_NUMBER = re.compile(r'[-_]?\d+')
+
+
+class Profiler:
+    def __init__(self, dump_dir='logs', interval=SAMPLE_INTERVAL):
+        """dump_dir 为栈采样结果的目录，interval 为采样间隔（秒）"""
+        self.enabled = False  # 分阶段计时和系统调用计数是否打开
+        self.dump_dir = dump_dir
+        self.interval = interval
+        self.phases = {}  # 阶段名 -> _Phase
+        self.enabled_at = None
+        self.sampler = None
+        self._lock = threading.Lock()
+
+    def clock(self):
+        """埋点起点：打开时返回当前时间，关闭时返回 0（调用方据此跳过 record）"""
+        return time.perf_counter() if self.enabled else 0
+
+    def record(self, phase, started):
+        """记录从 started（clock() 的返回值）到现在的耗时"""
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = _Phase()
+            stats.count += 1
+            stats.total += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+
+    def set_phases(self, enable):
+        """打开或关闭分阶段计时；打开时清零，关闭时把结果写入日志"""
+        if enable == self.enabled:
+            return
+        if enable:
+            with self._lock:
+                self.phases = {}
+            self.enabled_at = time.monotonic()
+            self.enabled = True
+            logger.warning("Profiling: phase timing enabled")
+        else:
+            self.enabled = False
+            logger.warning("Profiling: phase timing disabled after %.1fs: %s",
+                           time.monotonic() - self.enabled_at, self.phase_stats())
+
+    def set_sampling(self, enable):
+        """开始或结束栈采样，结束时返回结果文件路径"""
+        if enable:
+            if self.sampler is None:
+                self.sampler = StackSampler(self.interval)
+                self.sampler.start()
+                logger.warning("Profiling: stack sampling every %ss", self.interval)
+            return None
+        sampler, self.sampler = self.sampler, None
+        if sampler is None:
+            return None
+        sampler.stop()
+        os.makedirs(self.dump_dir or '.', exist_ok=True)
+        path = os.path.join(self.dump_dir, 'stacks-%s-%s.txt' % (
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S', time.localtime(sampler.started))))
+        sampler.dump(path)
+        total = sum(sampler.stacks.values()) or 1
+        logger.warning("Profiling: %s stack samples written to %s, top: %s", sampler.samples, path,
+                       ', '.join(f'{func} {count * 100 / total:.1f}%' for func, count in sampler.top()))
+        return path
+
+    def install_signals(self):
+        """SIGUSR1 开关分阶段计时，SIGUSR2 开关栈采样；只能在主线程调用
+
+        处理函数只启动一个线程，日志和文件写入不在信号处理函数里执行
+        """
+        if not hasattr(signal, 'SIGUSR1') or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self._toggle(self.set_phases, not self.enabled))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self._toggle(self.set_sampling, self.sampler is None))
+        return True
+
+    @staticmethod
+    def _toggle(action, enable):
+        threading.Thread(target=action, args=(enable,), name="profile-toggle", daemon=True).start()
+
+    def phase_stats(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.phases.items()}
+
+    def stats(self):
+        return {
+            'phases_enabled': self.enabled,
+            'sampling': self.sampler is not None,
+            'phases': self.phase_stats(),
+        }
+
+    def collect(self):
+        """各阶段的累计次数和耗时，供 /metrics 输出"""
+        samples = []
+        for name, stats in self.phase_stats().items():
+            label = f'{{phase="{name}"}}'
+            samples += [
+                ('socks5_profile_phase_total' + label, 'counter',
+                 'Timed operations per phase since profiling was enabled', stats['count']),
+                ('socks5_profile_phase_seconds_total' + label, 'counter',
+                 'Seconds spent per phase since profiling was enabled', stats['total']),
+            ]
+        return samples
@@ -0,0 +1,209 @@
+"""
+SOCKS5 协议常量与报文构造（RFC 1928 / RFC 1929）
+
+线程模式与 asyncio 模式共用，保证两种模式的回复逐字节一致。
+"""
+
+import socket
+import struct
+
+SOCKS_VERSION = 5
+AUTH_VERSION = 1
+
+# 认证方法
+METHOD_NO_AUTH = 0x00
+METHOD_USER_PASS = 0x02
+METHOD_NO_ACCEPTABLE = 0xFF
+
+# 命令
+CMD_CONNECT = 1
+CMD_BIND = 2
+CMD_UDP_ASSOCIATE = 3
+
+# 地址类型
+ATYP_IPV4 = 1
+ATYP_DOMAIN = 3
+ATYP_IPV6 = 4
+
+# 回复码
+REP_SUCCESS = 0
+REP_GENERAL_FAILURE = 1
+REP_NOT_ALLOWED = 2
+REP_NETWORK_UNREACHABLE = 3
+REP_HOST_UNREACHABLE = 4
+REP_CONNECTION_REFUSED = 5
+REP_TTL_EXPIRED = 6
+REP_COMMAND_NOT_SUPPORTED = 7
+REP_ADDRESS_TYPE_NOT_SUPPORTED = 8
+
+
+def method_reply(method):
+    """方法选择回复: Ver(5) + Method(1)"""
+    return struct.pack("!BB", SOCKS_VERSION, method)
+
+
+def auth_reply(status):
+    """用户名/密码认证回复: Ver(1) + Status(0=成功)"""
+    return struct.pack("!BB", AUTH_VERSION, status)
+
+
+def failure_reply(rep):
+    """失败回复，绑定地址固定为 0.0.0.0:0"""
+    return struct.pack("!BBBBIH", SOCKS_VERSION, rep, 0, ATYP_IPV4, 0, 0)
+
+
+def success_reply(bind_address):
+    """成功回复: Ver(5) + Rep(0) + Rsv(0) + Atyp + BndAddr(4 或 16) + BndPort(2)"""
+    host, port = bind_address[:2]
+    if ':' in host:
+        return (struct.pack("!BBBB", SOCKS_VERSION, REP_SUCCESS, 0, ATYP_IPV6)
+                + socket.inet_pton(socket.AF_INET6, host) + struct.pack("!H", port))
+    addr_ip = struct.unpack("!I", socket.inet_aton(host))[0]
+    return struct.pack("!BBBBIH", SOCKS_VERSION, REP_SUCCESS, 0, ATYP_IPV4, addr_ip, port)
+
+
+def greeting(methods):
+    """客户端问候（连接上级代理时使用）: Ver(5) + NMethods(1) + Methods(n)"""
+    return struct.pack("!BB", SOCKS_VERSION, len(methods)) + bytes(methods)
+
+
+def auth_request(username, password):
+    """客户端用户名/密码认证: Ver(1) + ULen(1) + UName + PLen(1) + Passwd"""
+    usr, pwd = username.encode('utf-8'), password.encode('utf-8')
+    return struct.pack("!BB", AUTH_VERSION, len(usr)) + usr + struct.pack("!B", len(pwd)) + pwd
+
+
+def connect_request(address_type, address, port):
+    """客户端 CONNECT 请求: Ver(5) + Cmd(1) + Rsv(0) + Atyp + DstAddr + DstPort(2)"""
+    if address_type == ATYP_IPV4:
+        addr = socket.inet_aton(address)
+    elif address_type == ATYP_IPV6:
+        addr = socket.inet_pton(socket.AF_INET6, address)
+    else:
+        name = address.encode('utf-8')
+        addr = struct.pack("!B", len(name)) + name
+    return struct.pack("!BBBB", SOCKS_VERSION, CMD_CONNECT, 0, address_type) + addr + struct.pack("!H", port)
+
+
+def udp_header(host, port):
+    """UDP 转发报文头: Rsv(2) + Frag(1) + Atyp + Addr + Port(2)，host 为 IP 字面量"""
+    if ':' in host:
+        return (struct.pack("!HBB", 0, 0, ATYP_IPV6)
+                + socket.inet_pton(socket.AF_INET6, host) + struct.pack("!H", port))
+    return struct.pack("!HBB", 0, 0, ATYP_IPV4) + socket.inet_aton(host) + struct.pack("!H", port)
+
+
+def udp_header_length(data, size):
+    """返回 UDP 报文头长度；分片报文（Frag != 0）或格式错误时返回 0"""
+    if size < 4 or data[2] != 0:
+        return 0
+    address_type = data[3]
+    if address_type == ATYP_IPV4:
+        length = 4 + 4 + 2
+    elif address_type == ATYP_IPV6:
+        length = 4 + 16 + 2
+    elif address_type == ATYP_DOMAIN and size > 4:
+        length = 4 + 1 + data[4] + 2
+    else:
+        return 0
+    return length if length <= size else 0
+
+
+def parse_udp_address(header):
+    """解析 udp_header 格式的地址部分 -> (address_type, address, port)"""
+    address_type = header[3]
+    if address_type == ATYP_IPV4:
+        address = socket.inet_ntoa(header[4:8])
+    elif address_type == ATYP_IPV6:
+        address = socket.inet_ntop(socket.AF_INET6, header[4:20])
+    else:
+        address = header[5:-2].decode('utf-8', errors='ignore')
+    return address_type, address, struct.unpack("!H", header[-2:])[0]
+
+
+class HandshakeBuffer:
+    """增量握手解析器
+
+    连接上读到的数据统一追加到一个缓冲区，再从中依次解析问候、认证和请求报文。
+    数据不足时解析函数返回 None 且不消耗任何字节，调用方继续读取后重试；
+    客户端把问候+认证+请求合并在一个包里发送时，一次 recv 即可完成全部解析。
+    """
+    __slots__ = ('data', 'pos')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.pos = 0
+
+    def feed(self, chunk):
+        self.data += chunk
+
+    def remaining(self):
+        """请求之后客户端提前发送的数据，应原样转发给目标"""
+        return bytes(self.data[self.pos:])
+
+    def _available(self):
+        return len(self.data) - self.pos
+
+    def parse_greeting(self):
+        """Ver(1) + NMethods(1) + Methods(n) -> (version, methods)"""
+        if self._available() < 2:
+            return None
+        version, nmethods = self.data[self.pos], self.data[self.pos + 1]
+        if version != SOCKS_VERSION:
+            self.pos += 2
+            return version, b''
+        if self._available() < 2 + nmethods:
+            return None
+        methods = bytes(self.data[self.pos + 2:self.pos + 2 + nmethods])
+        self.pos += 2 + nmethods
+        return version, methods
+
+    def parse_auth(self):
+        """Ver(1) + ULen(1) + UName + PLen(1) + Passwd -> (username, password)"""
+        pos = self.pos
+        if self._available() < 2:
+            return None
+        usr_len = self.data[pos + 1]
+        if self._available() < 3 + usr_len:
+            return None
+        pwd_len = self.data[pos + 2 + usr_len]
+        end = pos + 3 + usr_len + pwd_len
+        if len(self.data) < end:
+            return None
+        usr = self.data[pos + 2:pos + 2 + usr_len].decode('utf-8', errors='ignore')
+        pwd = self.data[pos + 3 + usr_len:end].decode('utf-8', errors='ignore')
+        self.pos = end
+        return usr, pwd
+
+    def parse_request(self):
+        """Ver(1) + Cmd(1) + Rsv(1) + Atyp(1) + DstAddr + DstPort(2)
+
+        返回 (cmd, address_type, address, port)；地址类型不支持时 address 为 None。
+        """
+        pos = self.pos
+        if self._available() < 5:
+            return None
+        cmd, address_type = self.data[pos + 1], self.data[pos + 3]
+        if address_type == ATYP_IPV4:
+            addr_len = 4
+        elif address_type == ATYP_DOMAIN:
+            addr_len = 1 + self.data[pos + 4]
+        elif address_type == ATYP_IPV6:
+            addr_len = 16
+        else:
+            self.pos += 4
+            return cmd, address_type, None, None
+
+        end = pos + 4 + addr_len + 2
+        if len(self.data) < end:
+            return None
+        raw = bytes(self.data[pos + 4:end - 2])
+        if address_type == ATYP_IPV4:
+            address = socket.inet_ntoa(raw)
+        elif address_type == ATYP_DOMAIN:
+            address = raw[1:].decode('utf-8', errors='ignore')
+        else:
+            address = socket.inet_ntop(socket.AF_INET6, raw)
+        port = struct.unpack('!H', self.data[end - 2:end])[0]
+        self.pos = end
+        return cmd, address_type, address, port
@@ -0,0 +1,323 @@
+"""
+基于 epoll 的共享转发反应器
+
+握手完成后，handle_client 把隧道交给反应器，由少量线程统一转发所有隧道的数据，
+不再为每条隧道占用一个阻塞线程，也不受 select 的 1024 文件描述符限制。
+
+- 边沿触发（EPOLLET）：每个 fd 只在状态变化时通知一次，自行记录可读/可写状态
+- 写背压：目标 socket 写不下时保留未发送数据，暂停读取源端，等 EPOLLOUT 后继续
+- 限速：令牌不足时该隧道放进定时队列，到时间后再继续读取（shaping）
+- 剖析：打开分阶段计时时，每次处理一条就绪隧道计为一次转发，并统计其 recv/send 次数
+"""
+
+import os
+import time
+import heapq
+import select
+import logging
+import threading
+import itertools
+from collections import deque
+
+import profiling
+import relay
+
+logger = logging.getLogger(__name__)
+
+if hasattr(select, 'epoll'):
+    _EVENTS = select.EPOLLIN | select.EPOLLOUT | select.EPOLLRDHUP | select.EPOLLET
+    _READ_EVENTS = select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLHUP | select.EPOLLERR
+
+# 单个方向每轮最多读取的块数，超出后让出给其他隧道
+_READ_BUDGET = 16
+
+
+def available():
+    return hasattr(select, 'epoll')
+
+
+class _Direction:
+    """单方向转发状态"""
+    __slots__ = ('src', 'dst', 'chunk', 'buffer', 'view', 'pending_start', 'pending_end', 'bytes', 'gate')
+
+    def __init__(self, src, dst, min_size, max_size, gate=None):
+        self.src = src
+        self.dst = dst
+        self.chunk = relay.AdaptiveChunk(min_size, max_size)
+        self.buffer = bytearray(min_size)
+        self.view = memoryview(self.buffer)
+        self.pending_start = 0
+        self.pending_end = 0
+        self.bytes = 0
+        self.gate = gate  # shaping.Gate，不限速时为 None
+
+    def release(self):
+        self.view.release()
+
+
+class _Tunnel:
+    __slots__ = ('client', 'remote', 'up', 'down', 'readable', 'writable', 'record', 'closed',
+                 'reported_up', 'reported_down', 'verbose', 'limits')
+
+    def __init__(self, client, remote, record, min_size, max_size, verbose=True, limits=None):
+        self.client = client
+        self.remote = remote
+        self.limits = limits
+        self.up = _Direction(client, remote, min_size, max_size, limits.up if limits is not None else None)
+        self.down = _Direction(remote, client, min_size, max_size, limits.down if limits is not None else None)
+        # 边沿触发下需要自己记住 fd 的就绪状态
+        self.readable = {client.fileno(): True, remote.fileno(): True}
+        self.writable = {client.fileno(): True, remote.fileno(): True}
+        # 地址和最后活跃时间保存在隧道登记表的记录（tunnel.Tunnel）中
+        self.record = record
+        self.closed = False
+        # 已合并到全局指标的字节数
+        self.reported_up = 0
+        self.reported_down = 0
+        self.verbose = verbose
+
+
+class _Shard(threading.Thread):
+    def __init__(self, index, reactor):
+        super().__init__(name=f"relay-reactor-{index}")
+        self.daemon = True
+        self.reactor = reactor
+        self.epoll = select.epoll()
+        self.tunnels = {}   # fd -> _Tunnel，只由本线程访问
+        self.ready = set()  # 读预算用完、仍需继续处理的隧道
+        self.deferred = []  # [(恢复时间, 序号, 隧道)] 限速暂停读取的隧道（最小堆）
+        self._seq = itertools.count()
+        # 其他线程交来的新隧道，经唤醒管道通知本线程注册
+        self.incoming = deque()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.epoll.register(self.wakeup_r, select.EPOLLIN)
+
+    def add(self, tunnel):
+        # 在反应器线程中注册：否则隧道可能在两个 fd 都注册完之前就被关闭
+        self.incoming.append(tunnel)
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # 管道已满，反应器线程必定会被唤醒
+
+    def _register(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.incoming:
+            tunnel = self.incoming.popleft()
+            # 注册时 epoll 会立即上报当前就绪状态，由下一轮 poll 开始转发
+            for sock in (tunnel.client, tunnel.remote):
+                self.tunnels[sock.fileno()] = tunnel
+                self.epoll.register(sock.fileno(), _EVENTS)
+
+    def run(self):
+        next_sweep = time.monotonic() + 1
+        while True:
+            timeout = 0 if self.ready else 1
+            if self.deferred and not self.ready:
+                timeout = min(1, max(0, self.deferred[0][0] - time.monotonic()))
+            try:
+                events = self.epoll.poll(timeout)
+            except InterruptedError:
+                continue
+
+            for fd, mask in events:
+                if fd == self.wakeup_r:
+                    self._register()
+                    continue
+                tunnel = self.tunnels.get(fd)
+                if tunnel is None or tunnel.closed:
+                    continue
+                if mask & _READ_EVENTS:
+                    tunnel.readable[fd] = True
+                if mask & select.EPOLLOUT:
+                    tunnel.writable[fd] = True
+                self.ready.add(tunnel)
+
+            if self.deferred:
+                now = time.monotonic()
+                while self.deferred and self.deferred[0][0] <= now:
+                    self.ready.add(heapq.heappop(self.deferred)[2])
+
+            ready, self.ready = self.ready, set()
+            for tunnel in ready:
+                if not tunnel.closed:
+                    self._pump(tunnel)
+
+            now = time.monotonic()
+            if now >= next_sweep:
+                self._sweep(now)
+                next_sweep = now + 1
+
+    def _sweep(self, now):
+        """把各隧道的字节数增量合并到全局指标（空闲超时由隧道登记表的时间轮负责）"""
+        self._report(set(self.tunnels.values()))
+
+    def _pump(self, tunnel):
+        profiler = self.reactor.profiler
+        started = profiler.clock()
+        try:
+            for direction, peer_name in ((tunnel.up, "Remote"), (tunnel.down, "Client")):
+                try:
+                    state = self._forward(tunnel, direction)
+                except BrokenPipeError:
+                    if tunnel.verbose:
+                        logger.info("%s closed connection for %s:%s",
+                                    peer_name, tunnel.record.client_ip, tunnel.record.client_port)
+                    state = None
+                if state is None:
+                    self._close(tunnel)
+                    return
+        except Exception as e:
+            logger.error("Data exchange error for %s:%s: %s",
+                         tunnel.record.client_ip, tunnel.record.client_port, e)
+            self._close(tunnel)
+        finally:
+            if started:
+                profiler.record(profiling.PHASE_RELAY, started)
+
+    def _forward(self, tunnel, d):
+        """转发一个方向，返回 None 表示隧道应关闭"""
+        src_fd = d.src.fileno()
+        dst_fd = d.dst.fileno()
+
+        # 先尝试发完积压数据
+        if d.pending_end and not self._flush(tunnel, d, dst_fd):
+            return True
+
+        budget = _READ_BUDGET
+        while tunnel.readable[src_fd]:
+            if budget == 0:
+                self.ready.add(tunnel)
+                return True
+            budget -= 1
+
+            size = d.chunk.size
+            if d.gate is not None:
+                size, delay = d.gate.grant(size)
+                if not size:
+                    # 令牌不足：暂停读取这个方向，到时间后由 run 放回就绪集合
+                    heapq.heappush(self.deferred, (time.monotonic() + delay, next(self._seq), tunnel))
+                    return True
+            if size > len(d.buffer):
+                d.view.release()
+                d.buffer = bytearray(size)
+                d.view = memoryview(d.buffer)
+            if self.reactor.profiler.enabled:
+                tunnel.record.syscalls += 1
+            try:
+                n = d.src.recv_into(d.view, size)
+            except BlockingIOError:
+                tunnel.readable[src_fd] = False
+                if d.gate is not None:
+                    d.gate.refund(size)
+                return True
+            if d.gate is not None:
+                d.gate.refund(size - n)
+            if n == 0:
+                return None
+
+            d.chunk.update(n)
+            tunnel.record.last_active = time.monotonic()
+            d.pending_start = 0
+            d.pending_end = n
+            if not self._flush(tunnel, d, dst_fd):
+                # 写背压：等待目标可写后再继续读取
+                return True
+        return True
+
+    def _flush(self, tunnel, d, dst_fd):
+        """发送积压数据，全部发完返回 True"""
+        if not tunnel.writable[dst_fd]:
+            return False
+        if self.reactor.profiler.enabled:
+            tunnel.record.syscalls += 1
+        try:
+            sent = d.dst.send(d.view[d.pending_start:d.pending_end])
+        except BlockingIOError:
+            sent = 0
+        d.pending_start += sent
+        d.bytes += sent
+        if d.pending_start < d.pending_end:
+            tunnel.writable[dst_fd] = False
+            return False
+        d.pending_start = d.pending_end = 0
+        return True
+
+    def _report(self, tunnels):
+        """把字节数同步到隧道记录，增量合并到全局指标"""
+        up = down = 0
+        for tunnel in tunnels:
+            up += tunnel.up.bytes - tunnel.reported_up
+            down += tunnel.down.bytes - tunnel.reported_down
+            tunnel.reported_up = tunnel.record.bytes_up = tunnel.up.bytes
+            tunnel.reported_down = tunnel.record.bytes_down = tunnel.down.bytes
+        metrics = self.reactor.metrics
+        if metrics is not None and (up or down):
+            metrics.add_bytes(up, down)
+
+    def _close(self, tunnel):
+        if tunnel.closed:
+            return
+        tunnel.closed = True
+        self.ready.discard(tunnel)
+        for sock in (tunnel.client, tunnel.remote):
+            fd = sock.fileno()
+            self.tunnels.pop(fd, None)
+            try:
+                self.epoll.unregister(fd)
+            except (OSError, ValueError):
+                pass
+            try:
+                sock.close()
+            except OSError:
+                pass
+        tunnel.up.release()
+        tunnel.down.release()
+        if tunnel.limits is not None:
+            tunnel.limits.close()
+        self._report((tunnel,))
+        if self.reactor.metrics is not None:
+            self.reactor.metrics.inc('tunnels_active', -1)
+        record = tunnel.record
+        if tunnel.verbose:
+            logger.info("Connection closed: %s:%s -> %s:%s (sent: %s bytes, received: %s bytes)",
+                        record.client_ip, record.client_port, record.target_addr, record.target_port,
+                        record.bytes_up, record.bytes_down)
+        self.reactor.on_close(record, tunnel.verbose)
+
+
+class RelayReactor:
+    def __init__(self, threads, buffer_size, max_buffer_size, on_close, metrics=None, profiler=None):
+        """on_close(record, verbose) 在隧道关闭后由反应器线程调用"""
+        self.buffer_size = buffer_size
+        self.max_buffer_size = max_buffer_size
+        self.on_close = on_close
+        self.metrics = metrics
+        self.profiler = profiler if profiler is not None else profiling.Profiler()
+        self.shards = [_Shard(i, self) for i in range(max(1, threads))]
+        self._next = itertools.cycle(self.shards)
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+        logger.info("epoll relay reactor started with %s thread(s)", len(self.shards))
+
+    def add(self, client, remote, record, verbose=True, limits=None):
+        """接管一条已建立的隧道，之后由反应器负责关闭两端 socket
+
+        record 为隧道登记表中的记录（tunnel.Tunnel）；
+        verbose 为 False 时不输出该隧道的 INFO 日志（日志取样）；
+        limits 为 shaping.Limits 时按限额转发，隧道关闭时释放
+        """
+        client.setblocking(False)
+        remote.setblocking(False)
+        tunnel = _Tunnel(client, remote, record, self.buffer_size, self.max_buffer_size, verbose, limits)
+        if self.metrics is not None:
+            self.metrics.inc('tunnels_active')
+        next(self._next).add(tunnel)
@@ -0,0 +1,178 @@
+"""
+数据转发原语
+
+Linux 上优先使用 os.splice 经内核管道在两个 socket 之间搬运数据，数据不进入用户态；
+不支持 splice 时退回到预分配 bytearray + recv_into + memoryview 切片，
+稳定转发阶段每个数据块不再产生新的 bytes 对象。
+"""
+
+import os
+import sys
+import fcntl
+import select
+import socket
+
+SPLICE_AVAILABLE = hasattr(os, 'splice') and sys.platform.startswith('linux')
+
+if SPLICE_AVAILABLE:
+    _SPLICE_FLAGS = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+
+
+def tune_socket(sock, nodelay=True, rcvbuf=0, sndbuf=0):
+    """设置隧道 socket 的 TCP_NODELAY 和收发缓冲区（0 表示保留内核自动调节）"""
+    try:
+        if nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        if sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    except OSError:
+        pass
+
+
+class AdaptiveChunk:
+    """单方向的自适应块大小
+
+    读满一整块说明是批量传输，块大小翻倍直到上限；
+    连续多次只读到很少数据说明是交互式流量，块大小减半直到下限。
+    """
+    __slots__ = ('size', 'min_size', 'max_size', 'small_reads')
+
+    SHRINK_AFTER = 4
+
+    def __init__(self, min_size, max_size):
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.size = min_size
+        self.small_reads = 0
+
+    def update(self, n):
+        if n >= self.size:
+            if self.size < self.max_size:
+                self.size = min(self.size * 2, self.max_size)
+            self.small_reads = 0
+        elif n < self.size // 4 and self.size > self.min_size:
+            self.small_reads += 1
+            if self.small_reads >= self.SHRINK_AFTER:
+                self.size = max(self.size // 2, self.min_size)
+                self.small_reads = 0
+        else:
+            self.small_reads = 0
+
+
+class CopyPump:
+    """单方向转发：复用同一块缓冲区，块大小增长时才重新分配"""
+    __slots__ = ('buffer', 'view')
+
+    def __init__(self, chunk_size):
+        self.buffer = bytearray(chunk_size)
+        self.view = memoryview(self.buffer)
+
+    def transfer(self, src, dst, chunk_size):
+        """从 src 读取一块并全部写入 dst，返回字节数，0 表示 src 已关闭"""
+        if chunk_size > len(self.buffer):
+            self.view.release()
+            self.buffer = bytearray(chunk_size)
+            self.view = memoryview(self.buffer)
+        n = src.recv_into(self.view, chunk_size)
+        if n:
+            dst.sendall(self.view[:n])
+        return n
+
+    def close(self):
+        self.view.release()
+
+
+class SplicePump:
+    """单方向转发：src -> 内核管道 -> dst，零拷贝"""
+    __slots__ = ('pipe_r', 'pipe_w', 'timeout')
+
+    def __init__(self, timeout, pipe_size=0):
+        self.pipe_r, self.pipe_w = os.pipe()
+        self.timeout = timeout
+        # 管道容量决定单次 splice 的上限（默认 64KB）
+        if pipe_size > 65536 and hasattr(fcntl, 'F_SETPIPE_SZ'):
+            try:
+                fcntl.fcntl(self.pipe_w, fcntl.F_SETPIPE_SZ, pipe_size)
+            except OSError:
+                pass
+
+    def transfer(self, src, dst, chunk_size):
+        """返回搬运的字节数，0 表示 src 已关闭，None 表示暂无数据"""
+        try:
+            n = os.splice(src.fileno(), self.pipe_w, chunk_size, flags=_SPLICE_FLAGS)
+        except BlockingIOError:
+            return None
+        left = n
+        while left:
+            try:
+                left -= os.splice(self.pipe_r, dst.fileno(), left, flags=_SPLICE_FLAGS)
+            except BlockingIOError:
+                # 目标 socket 发送缓冲区已满，等待可写
+                if not wait_writable(dst, self.timeout):
+                    raise socket.timeout("timed out")
+        return n
+
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+class Readiness:
+    """等待一组 socket 可读
+
+    优先使用 poll：select 只能处理小于 FD_SETSIZE（1024）的文件描述符，
+    每条 splice 隧道另占两个管道，数百条隧道后描述符编号就会超出。
+    """
+
+    def __init__(self, socks):
+        self.socks = {sock.fileno(): sock for sock in socks}
+        self.poller = None
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+            for fd in self.socks:
+                self.poller.register(fd, select.POLLIN)
+        self.paused = set()
+
+    def pause(self, sock):
+        """暂停等待 sock 可读（限速），直到 resume"""
+        self.paused.add(sock.fileno())
+        if self.poller is not None:
+            self.poller.unregister(sock.fileno())
+
+    def resume(self, sock):
+        self.paused.discard(sock.fileno())
+        if self.poller is not None:
+            self.poller.register(sock.fileno(), select.POLLIN)
+
+    def wait(self, timeout=None):
+        """返回可读（或已关闭/出错）的 socket 列表，超时返回空列表；timeout 为 None 时一直等待"""
+        if self.poller is None:
+            socks = [sock for fd, sock in self.socks.items() if fd not in self.paused]
+            r, _, _ = select.select(socks, [], [], timeout)
+            return r
+        return [self.socks[fd] for fd, _ in self.poller.poll(_poll_timeout(timeout))]
+
+
+def _poll_timeout(timeout):
+    return None if timeout is None else timeout * 1000
+
+
+def wait_writable(sock, timeout):
+    """timeout 为 None 时一直等待"""
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT)
+        return bool(poller.poll(_poll_timeout(timeout)))
+    _, w, _ = select.select([], [sock], [], timeout)
+    return bool(w)
+
+
+def make_pump(chunk_size, timeout, use_splice=True, max_chunk_size=0):
+    if use_splice and SPLICE_AVAILABLE:
+        try:
+            return SplicePump(timeout, max_chunk_size)
+        except OSError:
+            pass
+    return CopyPump(chunk_size)
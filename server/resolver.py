@@ -0,0 +1,124 @@
+"""
+进程内 DNS 解析缓存
+
+CONNECT 请求中的域名（地址类型 3）先查缓存，命中时不再调用阻塞的 getaddrinfo。
+- 正向结果按 TTL 缓存，超出容量时按 LRU 淘汰
+- 解析失败（gaierror）按较短的 TTL 做负缓存
+- 同一域名的并发查询合并为一次 getaddrinfo，其余线程等待结果
+"""
+
+import time
+import socket
+import threading
+from collections import OrderedDict
+
+
+class _Lookup:
+    """正在进行中的一次解析，供并发查询等待"""
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DnsCache:
+    def __init__(self, max_size=1024, ttl=60, negative_ttl=10):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # (host, family) -> (过期时间, 地址列表或异常)
+        self._inflight = {}            # (host, family) -> _Lookup
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+
+    def lookup(self, host, port, family=socket.AF_UNSPEC):
+        """只查缓存不解析：命中返回地址列表，未命中返回 None，负缓存命中抛出 gaierror"""
+        key = (host.lower(), family)
+        with self._lock:
+            cached = self._get(key)
+        if cached is None:
+            return None
+        return self._result(cached, port)
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        """返回 [(family, sockaddr), ...]，解析失败抛出 socket.gaierror"""
+        key = (host.lower(), family)
+        leader = False
+        with self._lock:
+            cached = self._get(key)
+            if cached is None:
+                pending = self._inflight.get(key)
+                if pending is None:
+                    pending = self._inflight[key] = _Lookup()
+                    self.misses += 1
+                    leader = True
+                else:
+                    self.coalesced += 1
+
+        if cached is not None:
+            return self._result(cached, port)
+
+        if leader:
+            try:
+                infos = socket.getaddrinfo(host, None, family, socket.SOCK_STREAM)
+                pending.result = [(info[0], info[4]) for info in infos]
+                ttl = self.ttl
+            except socket.gaierror as e:
+                pending.error = e
+                ttl = self.negative_ttl
+            except Exception as e:
+                # 其他异常不缓存，只通知等待中的线程
+                pending.error = e
+                ttl = 0
+            finally:
+                with self._lock:
+                    if ttl > 0:
+                        self._store(key, time.monotonic() + ttl, pending.error or pending.result)
+                    del self._inflight[key]
+                pending.event.set()
+        else:
+            pending.event.wait()
+
+        return self._result(pending.error or pending.result, port)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'coalesced': self.coalesced,
+        }
+
+    def _get(self, key):
+        """调用方需持有锁"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if isinstance(value, Exception):
+            self.negative_hits += 1
+        return value
+
+    def _store(self, key, expires, value):
+        """调用方需持有锁"""
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _result(value, port):
+        if isinstance(value, Exception):
+            raise type(value)(*value.args)
+        return [(family, (sockaddr[0], port) + tuple(sockaddr[2:])) for family, sockaddr in value]
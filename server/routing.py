@@ -0,0 +1,224 @@
+"""
+按规则决定 CONNECT 请求的去向：直连、拒绝或经上级 SOCKS5 代理（PARENT_PROXY）转发
+
+规则文件（ROUTING_RULES）每行 "动作 匹配项"，# 开头为注释：
+
+    block   ads.example.com      # 域名：匹配该域名及其所有子域名
+    proxy   google.com
+    direct  10.0.0.0/8           # CIDR（IPv4/IPv6），单个地址视为 /32 或 /128
+    proxy   *                    # 其他请求的默认动作（未写时为 direct）
+
+- 域名规则编译为按标签倒序的后缀字典树（com -> google -> www），取最长匹配的后缀，
+  匹配代价只与域名的标签数有关，与规则数无关
+- CIDR 规则按前缀长度分表（{前缀长度: {网络号: 动作}}），从长到短逐表查找，最长前缀优先
+- 域名请求只按域名规则匹配（不为路由决策做 DNS 解析），IP 请求只按 CIDR 规则匹配；
+  IPv4 映射的 IPv6 地址（::ffff:a.b.c.d）按 IPv4 规则匹配，不能借此绕过 IPv4 的 block 规则
+- 同一匹配项出现多次时以第一条为准
+- 最近的决策记在有界缓存中（先进先出淘汰），命中时不加锁，重复访问的目标只需一次字典查找
+- 文件修改后自动重新加载（按 mtime 检查，最多每 reload_interval 秒一次），
+  新文件解析失败时保留旧规则
+"""
+
+import os
+import time
+import logging
+import socket
+import ipaddress
+import threading
+
+import protocol
+
+logger = logging.getLogger(__name__)
+
+DIRECT = 'direct'
+BLOCK = 'block'
+PROXY = 'proxy'
+ACTIONS = (DIRECT, BLOCK, PROXY)
+
+# 字典树节点中保存动作的键（域名标签都是字符串，不会与之冲突）
+_ACTION = None
+
+_FAMILIES = ((4, socket.AF_INET, 32), (6, socket.AF_INET6, 128))
+
+# ::ffff:0:0/96 的前 12 字节，后 4 字节即 IPv4 地址
+_V4_MAPPED_PREFIX = bytes(10) + b'\xff\xff'
+
+
+def parse_rules(lines):
+    """解析规则文本 -> [(动作, 匹配项), ...]，格式错误时抛出 ValueError（带行号）"""
+    rules = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        if len(fields) != 2 or fields[0].lower() not in ACTIONS:
+            raise ValueError(f"line {lineno}: expected '<{'|'.join(ACTIONS)}> <domain|cidr|*>'")
+        action, pattern = fields[0].lower(), fields[1]
+        if _is_ip_pattern(pattern):
+            try:
+                ipaddress.ip_network(pattern, strict=False)
+            except ValueError as e:
+                raise ValueError(f"line {lineno}: {e}") from None
+        rules.append((action, pattern))
+    return rules
+
+
+def load_rules(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_rules(f)
+
+
+def _is_ip_pattern(pattern):
+    return ':' in pattern or '/' in pattern or pattern[-1:].isdigit()
+
+
+def _domain_labels(domain):
+    return domain.lower().rstrip('.').split('.')
+
+
+class RuleSet:
+    """编译后的规则表（只读，重新加载时整体替换）"""
+
+    def __init__(self, rules):
+        self.default = DIRECT
+        self.domains = {}      # 标签倒序的字典树
+        self.networks = {4: {}, 6: {}}  # IP 版本 -> {前缀长度: {网络号: 动作}}
+        self.prefixes = {4: (), 6: ()}  # IP 版本 -> 从长到短的前缀长度
+        self.size = 0
+        default_seen = False
+        for action, pattern in rules:
+            self.size += 1
+            if pattern == '*':
+                if not default_seen:
+                    self.default, default_seen = action, True
+            elif _is_ip_pattern(pattern):
+                network = ipaddress.ip_network(pattern, strict=False)
+                if network.version == 6 and network.prefixlen >= 96 and network.network_address.ipv4_mapped:
+                    # 映射地址按 IPv4 匹配，写成 ::ffff:a.b.c.d/N 的规则也放进 IPv4 表
+                    network = ipaddress.ip_network((network.network_address.ipv4_mapped, network.prefixlen - 96))
+                table = self.networks[network.version].setdefault(network.prefixlen, {})
+                key = int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
+                table.setdefault(key, action)
+            else:
+                node = self.domains
+                for label in reversed(_domain_labels(pattern.lstrip('*').lstrip('.'))):
+                    node = node.setdefault(label, {})
+                node.setdefault(_ACTION, action)
+        for version, tables in self.networks.items():
+            self.prefixes[version] = tuple(sorted(tables, reverse=True))
+
+    def __len__(self):
+        return self.size
+
+    def match(self, address_type, address):
+        if address_type != protocol.ATYP_DOMAIN or _is_ip_pattern(address):
+            # inet_pton 比 ipaddress.ip_address 快一个数量级
+            for version, family, bits in _FAMILIES:
+                try:
+                    packed = socket.inet_pton(family, address)
+                except OSError:
+                    continue
+                if version == 6 and packed[:12] == _V4_MAPPED_PREFIX:
+                    # 与 ipaddress.IPv6Address(address).ipv4_mapped 相同，但不必构造对象
+                    return self.match_ip(4, int.from_bytes(packed[12:], 'big'), 32)
+                return self.match_ip(version, int.from_bytes(packed, 'big'), bits)
+            # 以数字结尾的域名
+        return self.match_domain(address)
+
+    def match_domain(self, domain):
+        action = self.default
+        node = self.domains
+        for label in reversed(_domain_labels(domain)):
+            node = node.get(label)
+            if node is None:
+                break
+            action = node.get(_ACTION, action)
+        return action
+
+    def match_ip(self, version, value, bits):
+        tables = self.networks[version]
+        for prefixlen in self.prefixes[version]:
+            action = tables[prefixlen].get(value >> (bits - prefixlen))
+            if action is not None:
+                return action
+        return self.default
+
+
+class Router:
+    def __init__(self, path, cache_size=1024, reload_interval=1):
+        """cache_size 为 0 时不缓存决策"""
+        self.path = path
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self.rules = RuleSet(())
+        self.mtime = None
+        self.next_check = 0
+        self.reloads = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.decisions = dict.fromkeys(ACTIONS, 0)
+        self._cache = {}  # (address_type, address) -> 动作，按插入顺序淘汰
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """重新读取规则文件；失败时保留当前规则，返回是否加载成功"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            rules = RuleSet(load_rules(self.path))
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load routing rules from %s: %s", self.path, e)
+            return False
+        with self._lock:
+            self.rules = rules
+            self.mtime = mtime
+            self.reloads += 1
+            self._cache.clear()
+        logger.info("Loaded %s routing rules from %s (default: %s)", len(rules), self.path, rules.default)
+        return True
+
+    def decide(self, address_type, address):
+        """返回 DIRECT / BLOCK / PROXY"""
+        self._maybe_reload()
+        key = (address_type, address)
+        # 命中路径不加锁：dict.get 本身是原子的，统计计数允许少量误差
+        action = self._cache.get(key)
+        if action is not None:
+            self.cache_hits += 1
+            self.decisions[action] += 1
+            return action
+        rules = self.rules
+        action = rules.match(address_type, address)
+        with self._lock:
+            self.cache_misses += 1
+            self.decisions[action] += 1
+            # 匹配期间规则被重新加载时，旧规则的结果不写入缓存
+            if self.cache_size and self.rules is rules:
+                self._cache[key] = action
+                while len(self._cache) > self.cache_size:
+                    del self._cache[next(iter(self._cache))]
+        return action
+
+    def stats(self):
+        return {
+            'rules': len(self.rules),
+            'reloads': self.reloads,
+            'cache_entries': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'decisions': dict(self.decisions),
+        }
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.reload_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.mtime:
+            self.reload()
+
@@ -0,0 +1,317 @@
+"""
+服务器配置：默认值、配置文件、环境变量和命令行合并为一个经过校验的 Settings 对象
+
+- 优先级从低到高：OPTIONS 中的默认值、配置文件（config.py 格式的 Python 文件）、
+  环境变量 SOCKS5_<名称>、调用方传入的 overrides（命令行 --set 名称=值）
+- 配置文件中全大写的名称都视为配置项，以下划线开头的名称可用作辅助变量
+- 未知名称（拼写错误）、类型不符或取值超出范围时抛出 ConfigError，一次列出全部问题，
+  不再悄悄沿用默认值；例外是未知的 SOCKS5_* 环境变量：可能由包装脚本或同机的其他程序设置，
+  默认只记入 Settings.ignored（strict=True 时同样报错）
+- 导入本模块没有副作用：不读取文件、不修改 sys.path、不配置日志；load() 才读取配置
+"""
+
+import os
+import runpy
+
+# 服务器目录下的默认配置文件
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.py')
+
+ENV_PREFIX = 'SOCKS5_'
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+
+class ConfigError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("invalid configuration:\n  " + "\n  ".join(problems))
+
+
+class Option:
+    __slots__ = ('name', 'default', 'kind', 'nullable', 'minimum', 'maximum', 'choices', 'check')
+
+    def __init__(self, name, default, kind, nullable=False, minimum=None, maximum=None, choices=None,
+                 check=None):
+        """kind 为 int / float / bool / str / list / dict；nullable 表示允许 None；
+        check(value) 在值不合法时抛出 ValueError"""
+        self.name = name
+        self.default = default
+        self.kind = kind
+        self.nullable = nullable
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        self.check = check
+
+    def validate(self, value):
+        """返回 None 表示合法，否则返回问题描述"""
+        if value is None:
+            return None if self.nullable else "must not be None"
+        kind = self.kind
+        if kind is float:
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        elif kind is int:
+            ok = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            ok = isinstance(value, kind)
+        if not ok:
+            return f"expected {kind.__name__}, got {type(value).__name__} {value!r}"
+        if self.minimum is not None and value < self.minimum:
+            return f"must be >= {self.minimum}, got {value!r}"
+        if self.maximum is not None and value > self.maximum:
+            return f"must be <= {self.maximum}, got {value!r}"
+        if self.choices is not None and value not in self.choices:
+            return f"must be one of {', '.join(map(repr, self.choices))}, got {value!r}"
+        if self.check is not None:
+            try:
+                self.check(value)
+            except (ValueError, TypeError) as e:
+                return str(e)
+        return None
+
+    def parse(self, text):
+        """环境变量或命令行中的字符串 -> 值"""
+        kind = self.kind
+        if self.nullable and text.strip().lower() in ('', 'none', 'null'):
+            return None
+        if kind is bool:
+            lowered = text.strip().lower()
+            if lowered in ('1', 'true', 'yes', 'on'):
+                return True
+            if lowered in ('0', 'false', 'no', 'off'):
+                return False
+            raise ValueError(f"expected a boolean (true/false), got {text!r}")
+        if kind is str:
+            return text
+        if kind is int:
+            # 只接受整数字面量（含 1_000_000、0x...），不对 256*1024 之类的表达式求值
+            return int(text, 0)
+        if kind is float:
+            return float(text)
+        import ast
+
+        try:
+            # 列表和字典使用 Python 字面量：['a:443', 'b:443']、{'alice': 1000000}
+            return ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            raise ValueError(f"expected a Python {kind.__name__} literal, got {text!r}")
+
+
+def _destinations(values):
+    import upstream
+
+    for value in values:
+        if not isinstance(value, str):
+            raise ValueError(f"expected 'host:port' strings, got {value!r}")
+        host, port = upstream.parse_destination(value)
+        if not host or not 0 < port < 65536:
+            raise ValueError(f"expected 'host:port', got {value!r}")
+
+
+def _parents(values):
+    _destinations([value.rpartition('@')[2] if isinstance(value, str) else value for value in values])
+
+
+def _parent(value):
+    _parents([value])
+
+
+def _user_rates(users):
+    for user, rate in users.items():
+        if not isinstance(user, str) or isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate < 0:
+            raise ValueError(f"expected {{username: bytes per second}}, got {user!r}: {rate!r}")
+
+
+_PORT = dict(minimum=0, maximum=65535)
+
+OPTIONS = {option.name: option for option in (
+    # 基本配置
+    Option('HOST', '0.0.0.0', str),
+    Option('PORT', 9999, int, **_PORT),
+    Option('USERNAME', 'admin', str, nullable=True),
+    Option('PASSWORD', '123456', str, nullable=True),
+    Option('AUTH_FILE', None, str, nullable=True),
+    Option('AUTH_CACHE_SIZE', 1024, int, minimum=0),
+    Option('AUTH_CACHE_TTL', 300, float, minimum=0),
+    # 网络和超时；分阶段超时为 None 时沿用 SOCKET_TIMEOUT
+    Option('SOCKET_TIMEOUT', 30, float, minimum=0),
+    Option('HANDSHAKE_TIMEOUT', None, float, nullable=True, minimum=0),
+    Option('CONNECT_TIMEOUT', None, float, nullable=True, minimum=0),
+    Option('IDLE_TIMEOUT', None, float, nullable=True, minimum=0),
+    Option('MAX_CONNECTIONS', 100, int, minimum=1),
+    Option('LISTEN_BACKLOG', 1024, int, minimum=1),
+    Option('BIND_RETRIES', 5, int, minimum=1),
+    Option('BIND_RETRY_DELAY', 3, float, minimum=0),
+    Option('ADMISSION_QUEUE_SIZE', 64, int, minimum=0),
+    Option('ADMISSION_TIMEOUT', 2, float, minimum=0),
+    Option('PER_IP_MAX_CONNECTIONS', 0, int, minimum=0),
+    Option('PER_IP_RATE', 0, float, minimum=0),
+    Option('PER_IP_BURST', 20, int, minimum=0),
+    Option('DNS_CACHE_SIZE', 1024, int, minimum=0),
+    Option('DNS_CACHE_TTL', 60, float, minimum=0),
+    Option('DNS_NEGATIVE_TTL', 10, float, minimum=0),
+    Option('HAPPY_EYEBALLS_DELAY', 0.25, float, minimum=0),
+    Option('PREWARM_DESTINATIONS', [], list, check=_destinations),
+    Option('PREWARM_POOL_SIZE', 2, int, minimum=0),
+    Option('PREWARM_IDLE_TIMEOUT', 20, float, minimum=0),
+    Option('UDP_ASSOCIATE', True, bool),
+    Option('UDP_IDLE_TIMEOUT', 60, float, minimum=0),
+    Option('UDP_SOCKET_BUFFER', 1024 * 1024, int, minimum=0),
+    # 路由和代理链
+    Option('ROUTING_RULES', None, str, nullable=True),
+    Option('ROUTING_CACHE_SIZE', 1024, int, minimum=0),
+    Option('PARENT_PROXY', None, str, nullable=True, check=_parent),
+    Option('PARENT_PROXIES', [], list, check=_parents),
+    Option('PARENT_POOL_SIZE', 4, int, minimum=0),
+    Option('PARENT_POOL_IDLE_TIMEOUT', 8, float, minimum=0),
+    # 带宽限速
+    Option('BANDWIDTH_LIMIT', 0, float, minimum=0),
+    Option('BANDWIDTH_PER_IP', 0, float, minimum=0),
+    Option('BANDWIDTH_PER_USER', 0, float, minimum=0),
+    Option('BANDWIDTH_USERS', {}, dict, check=_user_rates),
+    Option('BANDWIDTH_BURST', 0.1, float, minimum=0),
+    # 多路复用
+    Option('MUX_PORT', 0, int, **_PORT),
+    Option('MUX_COMPRESSION', True, bool),
+    Option('MUX_WINDOW', 256 * 1024, int, minimum=1024),
+    # 性能剖析；PROFILE_DIR 为 None 时使用日志文件所在目录
+    Option('PROFILE_DIR', None, str, nullable=True),
+    Option('PROFILE_INTERVAL', 0.005, float, minimum=0.0001),
+    # 指标
+    Option('METRICS_PORT', 0, int, **_PORT),
+    Option('METRICS_HOST', '127.0.0.1', str),
+    Option('METRICS_TOKEN', None, str, nullable=True),
+    # 日志
+    Option('LOG_FILE', 'logs/socks5_server.log', str),
+    Option('LOG_LEVEL', 'INFO', str, choices=LOG_LEVELS),
+    Option('MAX_LOG_SIZE', 10 * 1024 * 1024, int, minimum=0),
+    Option('LOG_BACKUP_COUNT', 5, int, minimum=0),
+    Option('LOG_QUEUE_SIZE', 10000, int, minimum=0),
+    Option('LOG_SAMPLE_RATE', 1.0, float, minimum=0, maximum=1),
+    Option('VERBOSE', True, bool),
+    # 转发
+    Option('BUFFER_SIZE', 4096, int, minimum=1),
+    Option('RELAY_MAX_BUFFER_SIZE', 256 * 1024, int, minimum=1),
+    Option('TCP_NODELAY', True, bool),
+    Option('SOCKET_RCVBUF', 0, int, minimum=0),
+    Option('SOCKET_SNDBUF', 0, int, minimum=0),
+    Option('RELAY_SPLICE', True, bool),
+    # 进程管理
+    Option('PID_FILE', 'socks5.pid', str, nullable=True),
+    Option('HANDOFF_SOCKET', None, str, nullable=True),
+    Option('DRAIN_TIMEOUT', 60, float, minimum=0),
+    Option('SERVER_MODE', 'thread', str, choices=('thread', 'asyncio')),
+    Option('RELAY_ENGINE', 'thread', str, choices=('thread', 'epoll')),
+    Option('RELAY_THREADS', 2, int, minimum=1),
+    Option('WORKERS', 1, int, minimum=0),
+    Option('WORKER_STATS_INTERVAL', 60, float, minimum=1),
+)}
+
+
+class Settings:
+    """校验过的配置，按名称访问（settings.PORT）；用 replace() 得到修改后的副本"""
+
+    def __init__(self, values=None, sources=(), ignored=()):
+        """values 中未给出的名称取默认值；sources 记录配置来自哪里（用于启动日志），
+        ignored 为被忽略的未知环境变量名"""
+        merged = {name: option.default for name, option in OPTIONS.items()}
+        problems = []
+        for name, value in (values or {}).items():
+            if name not in OPTIONS:
+                problems.append(f"{name}: unknown setting")
+            else:
+                merged[name] = value
+        for name, value in merged.items():
+            problem = OPTIONS[name].validate(value)
+            if problem:
+                problems.append(f"{name}: {problem}")
+        if problems:
+            raise ConfigError(problems)
+        # 派生的默认值
+        for name in ('HANDSHAKE_TIMEOUT', 'CONNECT_TIMEOUT', 'IDLE_TIMEOUT'):
+            if merged[name] is None:
+                merged[name] = merged['SOCKET_TIMEOUT']
+        if merged['PROFILE_DIR'] is None:
+            merged['PROFILE_DIR'] = os.path.dirname(merged['LOG_FILE']) or '.'
+        self.__dict__.update(merged)
+        self._values = dict(values or {})
+        self.sources = tuple(sources)
+        self.ignored = tuple(ignored)
+
+    def replace(self, **overrides):
+        values = dict(self._values)
+        values.update(overrides)
+        return Settings(values, self.sources + ('overrides',) if overrides else self.sources, self.ignored)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in OPTIONS}
+
+    def __repr__(self):
+        return f"Settings(sources={self.sources!r})"
+
+
+def read_file(path):
+    """执行配置文件，返回其中全大写的名称"""
+    namespace = runpy.run_path(path)
+    return {name: value for name, value in namespace.items() if name.isupper() and not name.startswith('_')}
+
+
+def read_environ(environ, strict=False):
+    """SOCKS5_<名称> 环境变量 -> ({名称: 值}, [被忽略的未知变量名])
+
+    值无法解析时抛出 ConfigError；未知名称只在 strict 时报错，否则跳过
+    """
+    values, ignored, problems = {}, [], []
+    for key, text in environ.items():
+        if not key.startswith(ENV_PREFIX):
+            continue
+        name = key[len(ENV_PREFIX):]
+        if name not in OPTIONS and not strict:
+            ignored.append(key)
+            continue
+        try:
+            values[name] = parse(name, text)
+        except ValueError as e:
+            problems.append(f"{key}: {e}")
+    if problems:
+        raise ConfigError(problems)
+    return values, sorted(ignored)
+
+
+def parse(name, text):
+    """把字符串按配置项的类型解析为值（环境变量、命令行 --set）"""
+    option = OPTIONS.get(name)
+    if option is None:
+        raise ValueError("unknown setting")
+    return option.parse(text)
+
+
+def load(path=None, environ=None, overrides=None, strict=False):
+    """按优先级合并配置并校验
+
+    path 为 None 时读取服务器目录下的 config.py（不存在时只用默认值，sources 中可见）；
+    显式指定的文件不存在时抛出 ConfigError。environ 默认为 os.environ，
+    传入 {} 可忽略环境变量。overrides 为 {名称: 值}，优先级最高。
+    strict 为 True 时未知的 SOCKS5_* 环境变量也视为错误。
+    """
+    values, sources = {}, []
+    if path is None and os.path.exists(DEFAULT_CONFIG):
+        path = DEFAULT_CONFIG
+    if path is not None:
+        if not os.path.exists(path):
+            raise ConfigError([f"config file {path} does not exist"])
+        try:
+            values.update(read_file(path))
+        except Exception as e:
+            raise ConfigError([f"{path}: {type(e).__name__}: {e}"])
+        sources.append(path)
+    else:
+        sources.append('defaults')
+    env_values, ignored = read_environ(os.environ if environ is None else environ, strict)
+    if env_values:
+        values.update(env_values)
+        sources.append('environment')
+    if overrides:
+        values.update(overrides)
+        sources.append('overrides')
+    return Settings(values, sources, ignored)
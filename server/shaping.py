@@ -0,0 +1,190 @@
+"""
+带宽限速：全局、每客户端 IP、每用户的令牌桶，在转发路径上按块授权
+
+- 每个限额按方向（上传/下载）各有一个令牌桶，速率单位为字节/秒，
+  桶容量为 burst 秒的流量（至少 MIN_GRANT 字节）
+- 令牌桶以虚拟调度（GCRA）的形式保存：只记一个"理论到达时间"，授权 n 字节就把它
+  推后 n / 速率，比它早于 burst 秒以上时表示令牌不足，不需要定时补充令牌
+- 一条隧道同时受它所属的全部桶约束（全局 + 客户端 IP + 用户），每次读取前向这些桶
+  申请，读取的字节数不超过授权量，没读到的部分退回
+- 令牌不足时直接为这条隧道预约下一批令牌并返回需要等待的秒数，转发逻辑在此期间
+  暂停读取该方向而不占住线程：epoll 反应器把隧道放进定时队列，线程模式把 socket
+  从 poll 中移除，asyncio 模式 await；到时间后再次申请即取得预约的令牌
+- 公平：预约按申请的先后排队，单次授权不超过桶容量按桶内活跃隧道数平分的份额，
+  批量下载无法一次取走整桶令牌，隧道增减时份额随之重新分配
+- 不受任何限额约束的隧道不创建限速对象（attach 返回 None），转发路径只多一次 None 判断
+"""
+
+import time
+import threading
+
+# 单次授权的下限，避免大量零碎的小读取
+MIN_GRANT = 4096
+
+
+class _Bucket:
+    __slots__ = ('rate', 'capacity', 'tolerance', 'tat', 'users')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(MIN_GRANT, int(rate * burst))
+        self.tolerance = self.capacity / rate  # 桶满时可提前的秒数
+        self.tat = time.monotonic()             # 理论到达时间：令牌用到了哪个时刻
+        self.users = 0  # 使用该桶的隧道数
+
+
+class Gate:
+    """一条隧道一个方向的限速入口"""
+    __slots__ = ('buckets', 'shaper', 'reserved', 'ready_at')
+
+    def __init__(self, buckets, shaper):
+        self.buckets = buckets
+        self.shaper = shaper
+        self.reserved = 0   # 已预约、尚未到时间的字节数
+        self.ready_at = 0
+
+    def grant(self, size):
+        """申请读取至多 size 字节
+
+        返回 (授权字节数, 0)，令牌不足时返回 (0, 需要暂停读取的秒数)。
+        """
+        now = time.monotonic()
+        if self.reserved:
+            if now < self.ready_at:
+                return 0, self.ready_at - now
+            n, self.reserved = self.reserved, 0
+            if n > size:
+                self.refund(n - size)
+                n = size
+            return n, 0
+        with self.shaper.lock:
+            n = size
+            start = now
+            for bucket in self.buckets:
+                n = min(n, max(MIN_GRANT, bucket.capacity // bucket.users))
+                start = max(start, bucket.tat - bucket.tolerance)
+            for bucket in self.buckets:
+                bucket.tat = max(bucket.tat, start) + n / bucket.rate
+            if start > now:
+                self.shaper.throttled += 1
+        if start > now:
+            self.reserved, self.ready_at = n, start
+            return 0, start - now
+        return n, 0
+
+    def refund(self, n):
+        """退回已授权但没有读到的字节数"""
+        if n > 0:
+            with self.shaper.lock:
+                for bucket in self.buckets:
+                    bucket.tat -= n / bucket.rate
+
+
+class Limits:
+    """一条隧道的限速：up 为客户端到目标，down 为目标到客户端"""
+    __slots__ = ('up', 'down', 'keys', 'shaper')
+
+    def __init__(self, up, down, keys, shaper):
+        self.up = up
+        self.down = down
+        self.keys = keys
+        self.shaper = shaper
+
+    def close(self):
+        """隧道关闭时调用，可重复调用"""
+        keys, self.keys = self.keys, ()
+        if keys:
+            self.shaper._detach(keys)
+
+
+class Shaper:
+    def __init__(self, rate=0, per_ip=0, per_user=0, users=None, burst=0.1):
+        """rate 为全局限额，per_ip / per_user 为每个客户端 IP / 每个用户的限额，
+        users 为 {用户名: 限额}，覆盖 per_user；单位均为字节/秒，0 表示不限制
+        """
+        self.rate = rate
+        self.per_ip = per_ip
+        self.per_user = per_user
+        self.users = dict(users or {})
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.active = 0     # 受限速的隧道数
+        self.throttled = 0  # 令牌不足而暂停读取的次数
+        self._buckets = {}  # (范围, 键) -> (上传桶, 下载桶)
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.per_ip or self.per_user or any(self.users.values()))
+
+    def attach(self, client_ip, user=None):
+        """为新隧道取得限速对象；不受任何限额约束时返回 None"""
+        keys = []
+        if self.rate:
+            keys.append((('global', None), self.rate))
+        if self.per_ip:
+            keys.append((('ip', client_ip), self.per_ip))
+        if user is not None:
+            rate = self.users.get(user, self.per_user)
+            if rate:
+                keys.append((('user', user), rate))
+        if not keys:
+            return None
+        up, down = [], []
+        with self.lock:
+            self.active += 1
+            for key, rate in keys:
+                pair = self._buckets.get(key)
+                if pair is None:
+                    pair = self._buckets[key] = (_Bucket(rate, self.burst), _Bucket(rate, self.burst))
+                for bucket in pair:
+                    bucket.users += 1
+                up.append(pair[0])
+                down.append(pair[1])
+        return Limits(Gate(up, self), Gate(down, self), [key for key, _ in keys], self)
+
+    def _detach(self, keys):
+        with self.lock:
+            self.active -= 1
+            for key in keys:
+                pair = self._buckets[key]
+                for bucket in pair:
+                    bucket.users -= 1
+                if not pair[0].users:
+                    del self._buckets[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tunnels': self.active,
+                'buckets': len(self._buckets),
+                'throttled': self.throttled,
+            }
+
+
+class PausedReads:
+    """线程模式的转发循环：令牌不足时把 socket 从 relay.Readiness 中移除，到时间再恢复"""
+
+    def __init__(self, readiness):
+        self.readiness = readiness
+        self.resume_at = {}  # socket -> 恢复读取的时间
+
+    def grant(self, gate, sock, size):
+        """返回本次可从 sock 读取的字节数，为 0 时已暂停读取"""
+        n, delay = gate.grant(size)
+        if not n:
+            self.readiness.pause(sock)
+            self.resume_at[sock] = time.monotonic() + delay
+        return n
+
+    def timeout(self):
+        """恢复到期的 socket，返回距下一次恢复的秒数（没有暂停的 socket 时为 None）"""
+        if not self.resume_at:
+            return None
+        now = time.monotonic()
+        for sock, at in list(self.resume_at.items()):
+            if at <= now:
+                del self.resume_at[sock]
+                self.readiness.resume(sock)
+        if not self.resume_at:
+            return None
+        return min(self.resume_at.values()) - now
@@ -1,299 +1,942 @@
-﻿import socket
+﻿"""
+SOCKS5 代理服务器
+
+导入本模块不读取配置、不修改 sys.path、不配置日志。同目录的模块按顶层模块导入
+（import admission 等），服务器目录必须在 sys.path 上：作为脚本运行或安装到
+/opt/simplevpn 时自动满足，其他程序嵌入时需自行加入。嵌入时传入 settings.load()
+得到的 Settings（或由构造函数自动加载 config.py、环境变量）；作为脚本运行时
+由 main() 解析命令行、加载配置、配置日志后启动。
+"""
+
+import socket
 import threading
-import select
-import struct
 import logging
+import argparse
 import time
 import sys
 import os
-from datetime import datetime
-
-# ================= 配置导入 =================
-try:
-    # 尝试从 config.py 导入配置
-    sys.path.insert(0, os.path.dirname(__file__))
-    from config import (
-        HOST, PORT, USERNAME, PASSWORD, 
-        SOCKET_TIMEOUT, MAX_CONNECTIONS,
-        LOG_FILE, LOG_LEVEL, BUFFER_SIZE, VERBOSE
-    )
-except ImportError:
-    # 如果 config.py 不存在，使用默认配置
-    HOST = '0.0.0.0'
-    PORT = 9999
-    USERNAME = "admin"
-    PASSWORD = "123456"
-    SOCKET_TIMEOUT = 30
-    MAX_CONNECTIONS = 100
-    LOG_FILE = 'logs/socks5_server.log'
-    LOG_LEVEL = 'INFO'
-    BUFFER_SIZE = 4096
-    VERBOSE = True
-
-# ================= 日志配置 =================
-# 确保日志目录存在
-log_dir = os.path.dirname(LOG_FILE)
-if log_dir and not os.path.exists(log_dir):
-    os.makedirs(log_dir, exist_ok=True)
-
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL, logging.INFO),
-    format='[%(asctime)s] [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+
+import admission
+import auth
+import chain
+import handoff
+import logutil
+import metrics
+import profiling
+import protocol
+import relay
+import resolver
+import routing
+import shaping
+import timerwheel
+import tunnel
+import udp
+import upstream
+from settings import ConfigError, load as load_settings, parse as parse_setting
+
 logger = logging.getLogger(__name__)
 
 class Socks5Server:
-    def __init__(self, host, port, retry_count=5, retry_delay=3):
-        self.host = host
-        self.port = port
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def __init__(self, host=None, port=None, retry_count=None, retry_delay=None, mode=None,
+                 relay_engine=None, metrics_port=None, takeover=None, mux_port=None, settings=None):
+        """settings 为 settings.Settings，未指定时按 settings.load() 加载 config.py 和环境变量；
+        其余参数为 None 时取 settings 中的对应项（HOST、PORT、BIND_RETRIES、BIND_RETRY_DELAY、
+        SERVER_MODE、RELAY_ENGINE、METRICS_PORT、MUX_PORT）。
+        takeover 为 handoff.request() 的结果：沿用旧进程的监听 socket，不再 bind；
+        HANDOFF_SOCKET 为 None 时本进程不接受热重启接管"""
+        cfg = self.settings = settings if settings is not None else load_settings()
+        self.host = cfg.HOST if host is None else host
+        self.port = cfg.PORT if port is None else port
+        self.mode = cfg.SERVER_MODE if mode is None else mode
+        self.relay_engine = cfg.RELAY_ENGINE if relay_engine is None else relay_engine
+        self.metrics_port = cfg.METRICS_PORT if metrics_port is None else metrics_port
+        mux_port = cfg.MUX_PORT if mux_port is None else mux_port
+        self.takeover = takeover
+        self.handoff_path = cfg.HANDOFF_SOCKET
+        self.accepting = True
+        self.engine = None
+        self.reactor = None
+        self.metrics_server = None
+        self.mux_server = None
+        self.admission = admission.AdmissionController(
+            cfg.MAX_CONNECTIONS, cfg.ADMISSION_QUEUE_SIZE, cfg.ADMISSION_TIMEOUT,
+            cfg.PER_IP_MAX_CONNECTIONS, cfg.PER_IP_RATE, cfg.PER_IP_BURST)
+        self.rejector = admission.Rejector()
+        # 配置了 AUTH_FILE 时使用多用户文件，否则使用 USERNAME/PASSWORD
+        if cfg.AUTH_FILE:
+            self.credentials = auth.CredentialStore(cfg.AUTH_FILE, cfg.AUTH_CACHE_SIZE, cfg.AUTH_CACHE_TTL)
+        else:
+            self.credentials = auth.StaticCredentials(cfg.USERNAME, cfg.PASSWORD)
+        self.metrics = metrics.Metrics()
+        # 握手超时和隧道空闲超时都登记在同一个时间轮上
+        self.timers = timerwheel.TimerWheel()
+        self.tunnels = tunnel.TunnelRegistry(self.timers, cfg.IDLE_TIMEOUT)
+        self.metrics.active_connections = lambda: self.connection_counts()[0]
+        self.metrics.collectors.append(self._collect_metrics)
+        # 运行时开关的性能剖析（SIGUSR1 / SIGUSR2 或 /profile），关闭时埋点几乎没有开销
+        self.profiler = profiling.Profiler(cfg.PROFILE_DIR, cfg.PROFILE_INTERVAL)
+        self.metrics.collectors.append(self.profiler.collect)
+        logutil.set_profiler(self.profiler)
+        # VERBOSE = False 时不输出逐连接的 INFO 日志
+        self.log_sampler = logutil.ConnectionSampler(cfg.LOG_SAMPLE_RATE if cfg.VERBOSE else 0)
+        self.resolver = None
+        if cfg.DNS_CACHE_SIZE:
+            self.resolver = resolver.DnsCache(cfg.DNS_CACHE_SIZE, cfg.DNS_CACHE_TTL, cfg.DNS_NEGATIVE_TTL)
+        # 按规则决定直连、拒绝或经上级代理转发；未配置规则文件时，
+        # 配置了上级代理就全部经上级转发（代理链），否则全部直连
+        self.router = routing.Router(cfg.ROUTING_RULES, cfg.ROUTING_CACHE_SIZE) if cfg.ROUTING_RULES else None
+        self.parents = None
+        parents = cfg.PARENT_PROXIES or ([cfg.PARENT_PROXY] if cfg.PARENT_PROXY else [])
+        if parents:
+            self.parents = chain.ParentPool([chain.parse_parent(p) for p in parents],
+                                            cfg.PARENT_POOL_SIZE, cfg.PARENT_POOL_IDLE_TIMEOUT,
+                                            cfg.CONNECT_TIMEOUT, self._setup_remote)
+        self.default_route = routing.PROXY if self.parents is not None else routing.DIRECT
+        # 带宽限速（全局 / 每客户端 IP / 每用户）；未配置任何限额时转发路径不做检查
+        self.shaper = shaping.Shaper(cfg.BANDWIDTH_LIMIT, cfg.BANDWIDTH_PER_IP, cfg.BANDWIDTH_PER_USER,
+                                     cfg.BANDWIDTH_USERS, cfg.BANDWIDTH_BURST)
+        if not self.shaper.enabled:
+            self.shaper = None
+        self.warm_pool = None
+        if cfg.PREWARM_DESTINATIONS and cfg.PREWARM_POOL_SIZE:
+            self.warm_pool = upstream.WarmPool(
+                [upstream.parse_destination(d) for d in cfg.PREWARM_DESTINATIONS],
+                cfg.PREWARM_POOL_SIZE, cfg.PREWARM_IDLE_TIMEOUT,
+                lambda host, port: self._connect_remote(protocol.ATYP_DOMAIN, host, port))
+        self.udp_relay = None
+        if cfg.UDP_ASSOCIATE:
+            self.udp_relay = udp.UdpRelay(
+                cfg.UDP_IDLE_TIMEOUT,
+                resolve=lambda host, port: self._target_addresses(protocol.ATYP_DOMAIN, host, port),
+                lookup=self.resolver.lookup if self.resolver is not None else None,
+                socket_buffer=cfg.UDP_SOCKET_BUFFER)
+        self.server = self._inherited('listener', (self.host, self.port))
+        if self.server is not None:
+            logger.info("SOCKS5 Server listening on %s:%s (inherited from pid %s)",
+                        self.host, self.port, takeover.pid)
+        else:
+            self.server = self._bind(cfg.BIND_RETRIES if retry_count is None else retry_count,
+                                     cfg.BIND_RETRY_DELAY if retry_delay is None else retry_delay)
+        if mux_port:
+            import mux
+
+            # 本地代理（client/agent.py）的多路复用连接，每条流按普通连接处理
+            self.mux_server = mux.MuxServer(self.host, mux_port, self._dispatch, cfg.MUX_COMPRESSION,
+                                            cfg.MUX_WINDOW, sock=self._inherited('mux', (self.host, mux_port)))
+        logger.info("Max connections: %s, Timeouts: handshake %ss, connect %ss, idle %ss",
+                    cfg.MAX_CONNECTIONS, cfg.HANDSHAKE_TIMEOUT, cfg.CONNECT_TIMEOUT, cfg.IDLE_TIMEOUT)
+
+    @property
+    def address(self):
+        """监听地址 (host, port)；PORT = 0 时为系统分配的端口"""
+        return self.server.getsockname()[:2]
+
+    def _inherited(self, name, address):
+        """从旧进程接管的监听 socket；地址与当前配置不一致（配置已修改）时关闭它并返回 None"""
+        if self.takeover is None:
+            return None
+        sock = self.takeover.sockets.pop(name, None)
+        if sock is None:
+            return None
+        if sock.getsockname()[:2] != address:
+            logger.warning("Inherited %s socket is bound to %s:%s, binding %s:%s instead",
+                           name, *sock.getsockname()[:2], *address)
+            sock.close()
+            return None
+        return sock
+
+    def _bind(self, retry_count, retry_delay):
+        """绑定并监听；失败时按指数退避重试，retry_count = 1 时立即失败（BIND_RETRIES）"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         
         # 设置多个 socket 选项以支持快速重启
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
         # 在支持的系统上，也设置 SO_REUSEPORT
         try:
-            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except (AttributeError, OSError):
             pass  # SO_REUSEPORT 不可用
         
         # 设置 TCP 保活选项
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         
         # 尝试绑定，支持重试机制和指数退避
         for attempt in range(1, retry_count + 1):
             try:
-                self.server.bind((self.host, self.port))
-                logger.info(f"Successfully bound to {self.host}:{self.port}")
+                server.bind((self.host, self.port))
+                logger.info("Successfully bound to %s:%s", self.host, self.port)
                 break
             except OSError as e:
                 if attempt < retry_count:
                     wait_time = retry_delay * (2 ** (attempt - 1))  # 指数退避
-                    logger.warning(f"Bind failed (attempt {attempt}/{retry_count}): {e}")
-                    logger.info(f"Waiting {wait_time} seconds before retry...")
+                    logger.warning("Bind failed (attempt %s/%s): %s", attempt, retry_count, e)
+                    logger.info("Waiting %s seconds before retry...", wait_time)
                     time.sleep(wait_time)
                 else:
-                    logger.error(f"Failed to bind after {retry_count} attempts")
-                    logger.error(f"Port {self.port} is still in use. Please try one of:")
-                    logger.error(f"  1. sudo fuser -k {self.port}/tcp")
-                    logger.error(f"  2. sudo pkill -9 -f socks5_server.py")
-                    logger.error(f"  3. Wait a few minutes for TIME_WAIT sockets to clear")
+                    logger.error("Failed to bind after %s attempts", retry_count)
+                    logger.error("Port %s is still in use. Please try one of:", self.port)
+                    logger.error("  1. sudo fuser -k %s/tcp", self.port)
+                    logger.error("  2. sudo pkill -9 -f socks5_server.py")
+                    logger.error("  3. Wait a few minutes for TIME_WAIT sockets to clear")
+                    server.close()
                     raise
         
-        self.server.listen(100)
-        self.active_connections = 0
-        self.connection_lock = threading.Lock()
-        logger.info(f"SOCKS5 Server listening on {self.host}:{self.port}")
-        logger.info(f"Max connections: {MAX_CONNECTIONS}, Socket timeout: {SOCKET_TIMEOUT}s")
+        # 突发连接先在内核的 accept 队列中排队（实际上限还受 net.core.somaxconn 限制）
+        server.listen(self.settings.LISTEN_BACKLOG)
+        logger.info("SOCKS5 Server listening on %s:%s", self.host, self.port)
+        return server
 
     def run(self):
+        if self.mode == 'asyncio':
+            return self.run_asyncio()
+        if self.relay_engine == 'epoll':
+            self.start_reactor()
+        self.rejector.start()
+        self._start_background()
+        self.profiler.install_signals()
+        # 每秒检查一次 accepting：热重启交接后停止接受，排空现有连接后退出
+        self.server.settimeout(1)
         try:
-            while True:
+            while self.accepting:
                 try:
                     client, addr = self.server.accept()
-                    
-                    # 检查并发连接数
-                    with self.connection_lock:
-                        if self.active_connections >= MAX_CONNECTIONS:
-                            logger.warning(f"Max connections reached. Rejecting {addr[0]}:{addr[1]}")
-                            client.close()
-                            continue
-                        self.active_connections += 1
-                    
-                    # 为每个连接启动一个线程
-                    t = threading.Thread(target=self.handle_client, args=(client, addr))
-                    t.daemon = True
-                    t.start()
+                    self._dispatch(client, addr)
+                except socket.timeout:
+                    continue
                 except KeyboardInterrupt:
                     break
                 except Exception as e:
-                    logger.error(f"Error accepting connection: {e}", exc_info=True)
+                    logger.error("Error accepting connection: %s", e, exc_info=True)
+            if not self.accepting:
+                self._drain()
+        finally:
+            logger.info("Shutting down server...")
+            self._log_stats()
+            self.server.close()
+            self.profiler.set_sampling(False)
+
+    def _dispatch(self, client, addr):
+        """处理一个新连接：监听 socket 上接受的连接，或多路复用会话上的一条流"""
+        if self.engine is not None:
+            self.engine.accept(client, addr)
+            return
+
+        # 准入控制：并发数、每 IP 限制；名额已满时进入等待队列
+        ticket = self.admission.try_admit(addr[0])
+        if ticket.status == admission.REJECTED:
+            self._reject(client, addr, ticket)
+            return
+
+        # 为每个连接启动一个线程（排队的连接在自己的线程里等待名额）
+        t = threading.Thread(target=self.handle_client, args=(client, addr, ticket))
+        t.daemon = True
+        t.start()
+
+    @staticmethod
+    def _read_message(client, buf, parse):
+        """从握手缓冲区解析一条报文，数据不足时继续读取；客户端关闭时返回 None"""
+        while True:
+            message = parse()
+            if message is not None:
+                return message
+            data = client.recv(4096)
+            if not data:
+                return None
+            buf.feed(data)
+
+    def _start_background(self):
+        """启动后台服务（在工作进程 fork 之后调用）"""
+        self.timers.start()
+        if self.warm_pool is not None:
+            self.warm_pool.start()
+        if self.udp_relay is not None:
+            self.udp_relay.start()
+        if self.parents is not None:
+            self.parents.start()
+        if self.metrics_port:
+            import metrics_http
+
+            self.metrics_server = metrics_http.MetricsServer(
+                self.metrics, self.settings.METRICS_HOST, self.metrics_port, self.tunnels,
+                sock=self._inherited('metrics', (self.settings.METRICS_HOST, self.metrics_port)),
+                profiler=self.profiler, token=self.settings.METRICS_TOKEN)
+            self.metrics_server.start()
+        if self.mux_server is not None:
+            self.mux_server.start()
+        if self.takeover is not None:
+            # 监听 socket 已在接受连接：通知旧进程停止接受，之后由本进程接受下一次接管
+            for sock in self.takeover.sockets.values():
+                sock.close()  # 配置中已不再使用的监听 socket
+            self.takeover.complete()
+            self.takeover = None
+        if self.handoff_path:
+            handoff.HandoffServer(self.handoff_path, self._handoff_sockets, self._handed_off).start()
+
+    def _handoff_sockets(self):
+        sockets = {'listener': self.server}
+        if self.metrics_server is not None:
+            sockets['metrics'] = self.metrics_server.httpd.socket
+        if self.mux_server is not None:
+            sockets['mux'] = self.mux_server.sock
+        return sockets
+
+    def _handed_off(self):
+        """交接线程：新进程已接管监听 socket，停止接受新连接并排空现有连接"""
+        self.stop()
+
+    def stop(self):
+        """停止接受新连接，现有连接结束（最多 DRAIN_TIMEOUT 秒）后 run() 返回；可在任意线程调用"""
+        self.accepting = False
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.mux_server is not None:
+            self.mux_server.stop()
+        if self.engine is not None:
+            self.engine.stop(self.settings.DRAIN_TIMEOUT)
+
+    def _drain(self):
+        """等待现有连接结束，最多 DRAIN_TIMEOUT 秒"""
+        deadline = time.monotonic() + self.settings.DRAIN_TIMEOUT
+        while self.admission.active and time.monotonic() < deadline:
+            time.sleep(0.5)
+        if self.admission.active:
+            logger.warning("Closing %s connection(s) still open after draining", self.admission.active)
+
+    def _log_stats(self):
+        if self.resolver is not None:
+            logger.info("DNS cache: %s", self.resolver.stats())
+        if self.warm_pool is not None:
+            logger.info("Upstream warm pool: %s", self.warm_pool.stats())
+        if self.udp_relay is not None:
+            logger.info("UDP relay: %s", self.udp_relay.stats())
+        if self.parents is not None:
+            logger.info("Parent proxies: %s", self.parents.stats())
+        if self.shaper is not None:
+            logger.info("Bandwidth shaping: %s", self.shaper.stats())
+        if self.mux_server is not None:
+            logger.info("Mux: %s", self.mux_server.stats())
+
+    def _collect_metrics(self):
+        """DNS 缓存和预连接池的统计，供 /metrics 输出"""
+        samples = []
+        if self.resolver is not None:
+            dns = self.resolver.stats()
+            samples += [
+                ('socks5_dns_cache_entries', 'gauge', 'Entries in the DNS cache', dns['size']),
+                ('socks5_dns_cache_hits_total', 'counter', 'DNS cache hits', dns['hits']),
+                ('socks5_dns_cache_misses_total', 'counter', 'DNS cache misses', dns['misses']),
+                ('socks5_dns_cache_negative_hits_total', 'counter', 'DNS cache hits on failed lookups',
+                 dns['negative_hits']),
+                ('socks5_dns_cache_coalesced_total', 'counter', 'Lookups that waited on a concurrent resolve',
+                 dns['coalesced']),
+            ]
+        if self.warm_pool is not None:
+            for dest, pool in self.warm_pool.stats().items():
+                label = f'{{destination="{dest}"}}'
+                samples += [
+                    ('socks5_warm_pool_idle' + label, 'gauge', 'Idle pre-connected sockets', pool['idle']),
+                    ('socks5_warm_pool_hits_total' + label, 'counter', 'CONNECTs served from the warm pool',
+                     pool['hits']),
+                    ('socks5_warm_pool_misses_total' + label, 'counter', 'CONNECTs that found the warm pool empty',
+                     pool['misses']),
+                ]
+        if isinstance(self.credentials, auth.CredentialStore):
+            creds = self.credentials.stats()
+            samples += [
+                ('socks5_auth_users', 'gauge', 'Users loaded from AUTH_FILE', creds['users']),
+                ('socks5_auth_cache_hits_total', 'counter', 'Logins verified from the cache', creds['cache_hits']),
+                ('socks5_auth_cache_misses_total', 'counter', 'Logins that needed a password hash',
+                 creds['cache_misses']),
+            ]
+        if self.parents is not None:
+            for parent, pool in self.parents.stats().items():
+                label = f'{{parent="{parent}"}}'
+                samples += [
+                    ('socks5_parent_up' + label, 'gauge', 'Whether the parent proxy is in use (1) or failed over (0)',
+                     int(pool['healthy'])),
+                    ('socks5_parent_pool_idle' + label, 'gauge', 'Idle authenticated parent proxy sessions',
+                     pool['idle']),
+                    ('socks5_parent_pool_hits_total' + label, 'counter', 'CONNECTs sent on a pooled parent session',
+                     pool['hits']),
+                    ('socks5_parent_pool_misses_total' + label, 'counter',
+                     'CONNECTs that needed a new parent handshake', pool['misses']),
+                ]
+        if self.router is not None:
+            for action, count in self.router.stats()['decisions'].items():
+                samples.append((f'socks5_routing_decisions_total{{action="{action}"}}', 'counter',
+                                'CONNECT requests by routing decision', count))
+        if self.mux_server is not None:
+            mux_stats = self.mux_server.stats()
+            samples += [
+                ('socks5_mux_sessions', 'gauge', 'Open multiplexed agent sessions', mux_stats['sessions']),
+                ('socks5_mux_streams', 'gauge', 'Streams open on multiplexed sessions', mux_stats['streams']),
+                ('socks5_mux_payload_bytes_total', 'counter', 'Stream bytes sent to agents before compression',
+                 mux_stats['raw_bytes']),
+                ('socks5_mux_wire_bytes_total', 'counter', 'Stream bytes sent to agents after compression',
+                 mux_stats['wire_bytes']),
+            ]
+        if self.shaper is not None:
+            shaping_stats = self.shaper.stats()
+            samples += [
+                ('socks5_shaped_tunnels', 'gauge', 'Tunnels subject to a bandwidth limit', shaping_stats['tunnels']),
+                ('socks5_shaping_throttled_total', 'counter', 'Reads paused for lack of bandwidth tokens',
+                 shaping_stats['throttled']),
+            ]
+        samples.append(('socks5_admission_queue_length', 'gauge',
+                        'Connections waiting for a MAX_CONNECTIONS slot', self.admission.stats()['queued']))
+        if self.udp_relay is not None:
+            udp_stats = self.udp_relay.stats()
+            samples += [
+                ('socks5_udp_associations_active', 'gauge', 'Open UDP ASSOCIATE sessions',
+                 udp_stats['associations']),
+                ('socks5_udp_packets_upstream_total', 'counter', 'Datagrams relayed from clients to targets',
+                 udp_stats['packets_up']),
+                ('socks5_udp_packets_downstream_total', 'counter', 'Datagrams relayed from targets to clients',
+                 udp_stats['packets_down']),
+                ('socks5_udp_bytes_upstream_total', 'counter', 'UDP payload bytes relayed to targets',
+                 udp_stats['bytes_up']),
+                ('socks5_udp_bytes_downstream_total', 'counter', 'UDP payload bytes relayed to clients',
+                 udp_stats['bytes_down']),
+                ('socks5_udp_dropped_total', 'counter', 'Datagrams dropped (malformed, fragmented or unsendable)',
+                 udp_stats['dropped']),
+            ]
+        return samples
+
+    def _target_addresses(self, address_type, address, port):
+        """返回 [(family, sockaddr), ...]；域名经 DNS 缓存解析，避免每个连接都调用阻塞的 getaddrinfo"""
+        addrs = upstream.literal_addresses(address_type, address, port)
+        if addrs is not None:
+            return addrs
+        started = self.profiler.clock()
+        if self.resolver is None:
+            addrs = upstream.resolve(address, port)
+        else:
+            addrs = self.resolver.resolve(address, port)
+        if started:
+            self.profiler.record(profiling.PHASE_DNS, started)
+        return addrs
+
+    def _setup_remote(self, sock):
+        cfg = self.settings
+        relay.tune_socket(sock, cfg.TCP_NODELAY, cfg.SOCKET_RCVBUF, cfg.SOCKET_SNDBUF)
+
+    def _connect_remote(self, address_type, address, port):
+        """双栈竞速连接目标（Happy Eyeballs），返回已连接的 socket"""
+        remote = upstream.happy_eyeballs_connect(self._target_addresses(address_type, address, port),
+                                                 self.settings.CONNECT_TIMEOUT, self.settings.HAPPY_EYEBALLS_DELAY,
+                                                 self._setup_remote)
+        # 转发阶段的 socket 不带超时，空闲超时由时间轮负责
+        remote.settimeout(None)
+        return remote
+
+    def _connect_parent(self, address_type, address, port):
+        """经上级 SOCKS5 代理连接目标（路由规则 proxy 或代理链）"""
+        if self.parents is None:
+            raise chain.ParentProxyError(protocol.REP_GENERAL_FAILURE,
+                                         "routing rule 'proxy' matched but PARENT_PROXY is not set")
+        return self.parents.connect(address_type, address, port)
+
+    def start_reactor(self):
+        """启动共享的 epoll 转发反应器（RELAY_ENGINE = 'epoll'）"""
+        import reactor
+
+        if not reactor.available():
+            logger.warning("select.epoll is not available, relaying with one thread per tunnel")
+            return
+        cfg = self.settings
+        self.reactor = reactor.RelayReactor(cfg.RELAY_THREADS, cfg.BUFFER_SIZE, cfg.RELAY_MAX_BUFFER_SIZE,
+                                            self._tunnel_closed, self.metrics, self.profiler)
+        self.reactor.start()
+
+    def _release(self, client_ip, client_port, verbose=True):
+        """连接结束后释放并发计数"""
+        self.admission.release(client_ip)
+        if verbose:
+            logger.info("Client disconnected: %s:%s (active: %s)",
+                        client_ip, client_port, self.admission.active)
+
+    def _tunnel_closed(self, record, verbose=True):
+        """反应器关闭隧道后注销登记并释放并发计数"""
+        self.tunnels.close(record)
+        self._release(record.client_ip, record.client_port, verbose)
+
+    @staticmethod
+    def _handshake_expired(sock, client_ip, client_port):
+        """时间轮线程：握手超时，shutdown 后连接线程/协程读到 EOF 并结束"""
+        logger.warning("Handshake timeout for %s:%s", client_ip, client_port)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _reject(self, client, addr, ticket):
+        """交给拒绝线程回复 SOCKS5 失败，不阻塞接受循环"""
+        logger.warning("Rejecting %s:%s (%s)", addr[0], addr[1], ticket.reason)
+        self.metrics.inc(metrics.REJECTION_COUNTERS[ticket.reason])
+        self.rejector.reject(client, ticket.rep)
+
+    @property
+    def active_connections(self):
+        return self.admission.active
+
+    @property
+    def total_connections(self):
+        return self.admission.admitted
+
+    def connection_counts(self):
+        """返回 (活跃连接数, 累计接受连接数)"""
+        return self.admission.active, self.admission.admitted
+
+    def run_asyncio(self):
+        """在单个事件循环上处理所有连接（SERVER_MODE = 'asyncio'）"""
+        from async_server import AsyncSocks5Server
+
+        cfg = self.settings
+        self.engine = AsyncSocks5Server(self.server, cfg.USERNAME, cfg.PASSWORD,
+                                        cfg.SOCKET_TIMEOUT, cfg.MAX_CONNECTIONS,
+                                        admission=self.admission,
+                                        credentials=self.credentials,
+                                        tunnels=self.tunnels,
+                                        backlog=cfg.LISTEN_BACKLOG,
+                                        buffer_size=cfg.BUFFER_SIZE,
+                                        max_buffer_size=cfg.RELAY_MAX_BUFFER_SIZE,
+                                        socket_options=(cfg.TCP_NODELAY, cfg.SOCKET_RCVBUF, cfg.SOCKET_SNDBUF),
+                                        timers=self.timers,
+                                        handshake_timeout=cfg.HANDSHAKE_TIMEOUT,
+                                        connect_timeout=cfg.CONNECT_TIMEOUT,
+                                        resolver=self.resolver,
+                                        router=self.router,
+                                        parents=self.parents,
+                                        default_route=self.default_route,
+                                        shaper=self.shaper,
+                                        profiler=self.profiler,
+                                        happy_eyeballs_delay=cfg.HAPPY_EYEBALLS_DELAY,
+                                        warm_pool=self.warm_pool,
+                                        metrics=self.metrics,
+                                        log_sampler=self.log_sampler,
+                                        udp_relay=self.udp_relay)
+        logger.info("Running in asyncio mode")
+        self._start_background()
+        self.profiler.install_signals()
+        try:
+            self.engine.run()
+        except KeyboardInterrupt:
+            pass
         finally:
             logger.info("Shutting down server...")
+            self._log_stats()
             self.server.close()
+            self.profiler.set_sampling(False)
 
-    def handle_client(self, client, addr):
+    def handle_client(self, client, addr, ticket=None):
         client_ip, client_port = addr
+        if ticket is not None and ticket.status == admission.QUEUED:
+            if not self.admission.wait(ticket):
+                self._reject(client, addr, ticket)
+                return
+        self.metrics.inc('accepted')
+        handed_off = False
+        accepted_at = time.monotonic()
+        profiler = self.profiler
+        handshake_started = profiler.clock()
+        # 未被取样的连接只输出警告和错误
+        verbose = self.log_sampler()
+        # 握手（到收到请求为止）超时由时间轮关闭连接，socket 本身不设超时
+        handshake_timer = None
+        cfg = self.settings
+        if cfg.HANDSHAKE_TIMEOUT:
+            handshake_timer = self.timers.schedule(cfg.HANDSHAKE_TIMEOUT, self._handshake_expired,
+                                                   client, client_ip, client_port)
         try:
-            client.settimeout(SOCKET_TIMEOUT)
-            logger.info(f"Client connected: {client_ip}:{client_port}")
+            relay.tune_socket(client, cfg.TCP_NODELAY, cfg.SOCKET_RCVBUF, cfg.SOCKET_SNDBUF)
+            if verbose:
+                logger.info("Client connected: %s:%s", client_ip, client_port)
             
             # 1. 握手阶段
+            # 所有握手报文从同一个缓冲区解析，客户端合并发送时只需一次 recv
+            buf = protocol.HandshakeBuffer()
+            
             # 客户端发送: 版本号(1 byte) + 方法数量(1 byte) + 方法列表(n bytes)
-            header = client.recv(2)
-            if not header:
-                logger.warning(f"Client {client_ip}:{client_port} sent empty header")
+            greeting = self._read_message(client, buf, buf.parse_greeting)
+            if greeting is None:
+                logger.warning("Client %s:%s sent empty header", client_ip, client_port)
                 return
             
-            version, nmethods = struct.unpack("!BB", header)
-            if version != 5:
-                logger.warning(f"Invalid SOCKS version {version} from {client_ip}:{client_port}")
+            version, methods = greeting
+            if version != protocol.SOCKS_VERSION:
+                logger.warning("Invalid SOCKS version %s from %s:%s", version, client_ip, client_port)
                 return
             
-            # 读取方法列表
-            methods = client.recv(nmethods)
-            
             # 认证逻辑
-            if USERNAME and PASSWORD:
+            usr = None
+            if self.credentials.enabled:
                 # 0x02 代表用户名/密码认证
-                if 2 not in methods: 
+                if protocol.METHOD_USER_PASS not in methods:
                     # 客户端不支持认证，拒绝
-                    logger.warning(f"Client {client_ip}:{client_port} does not support auth method")
-                    client.sendall(struct.pack("!BB", 5, 0xFF))
+                    logger.warning("Client %s:%s does not support auth method", client_ip, client_port)
+                    client.sendall(protocol.method_reply(protocol.METHOD_NO_ACCEPTABLE))
                     return
                 # 告诉客户端我们要用用户名密码认证
-                client.sendall(struct.pack("!BB", 5, 2))
+                client.sendall(protocol.method_reply(protocol.METHOD_USER_PASS))
                 
                 # 验证用户名密码
                 # 格式: 版本(1) + 用户名长度(1) + 用户名 + 密码长度(1) + 密码
-                auth_version = ord(client.recv(1))
-                usr_len = ord(client.recv(1))
-                usr = client.recv(usr_len).decode('utf-8', errors='ignore')
-                pwd_len = ord(client.recv(1))
-                pwd = client.recv(pwd_len).decode('utf-8', errors='ignore')
+                credentials = self._read_message(client, buf, buf.parse_auth)
+                if credentials is None:
+                    logger.warning("Client %s:%s closed during authentication", client_ip, client_port)
+                    return
+                usr, pwd = credentials
                 
-                if usr == USERNAME and pwd == PASSWORD:
+                auth_started = profiler.clock()
+                authenticated = self.credentials.verify(usr, pwd)
+                if auth_started:
+                    profiler.record(profiling.PHASE_AUTH, auth_started)
+                if authenticated:
                     # 认证成功: 版本(1) + 状态(0=成功)
-                    logger.info(f"Auth successful for {client_ip}:{client_port}")
-                    client.sendall(struct.pack("!BB", 1, 0))
+                    if verbose:
+                        logger.info("Auth successful for %s:%s", client_ip, client_port)
+                    client.sendall(protocol.auth_reply(0))
                 else:
                     # 认证失败
-                    logger.warning(f"Auth failed for {client_ip}:{client_port} (user: {usr})")
-                    client.sendall(struct.pack("!BB", 1, 1))
+                    logger.warning("Auth failed for %s:%s (user: %s)", client_ip, client_port, usr)
+                    self.metrics.inc('auth_failures')
+                    client.sendall(protocol.auth_reply(1))
                     return
             else:
                 # 无需认证: 0x00
-                client.sendall(struct.pack("!BB", 5, 0))
+                client.sendall(protocol.method_reply(protocol.METHOD_NO_AUTH))
 
             # 2. 请求阶段
             # 格式: Ver(1) + Cmd(1) + Rsv(1) + Atyp(1) + DstAddr(...) + DstPort(2)
-            version, cmd, _, address_type = struct.unpack("!BBBB", client.recv(4))
+            request = self._read_message(client, buf, buf.parse_request)
+            if request is None:
+                logger.warning("Client %s:%s closed before sending a request", client_ip, client_port)
+                return
+            if not self.timers.cancel(handshake_timer):
+                return  # 握手恰好超时，连接已被 shutdown
             
-            if address_type == 1:  # IPv4
-                address = socket.inet_ntoa(client.recv(4))
-            elif address_type == 3:  # Domain name
-                domain_length = ord(client.recv(1))
-                address = client.recv(domain_length).decode('utf-8', errors='ignore')
-            elif address_type == 4:  # IPv6
-                address = socket.inet_ntop(socket.AF_INET6, client.recv(16))
-            else:
-                logger.warning(f"Unsupported address type {address_type} from {client_ip}:{client_port}")
-                client.sendall(struct.pack("!BBBBIH", 5, 8, 0, 1, 0, 0))  # Address type not supported
+            cmd, address_type, address, port = request
+            self.metrics.observe(self.metrics.handshake_latency, time.monotonic() - accepted_at)
+            if handshake_started:
+                profiler.record(profiling.PHASE_HANDSHAKE, handshake_started)
+            if address is None:
+                logger.warning("Unsupported address type %s from %s:%s", address_type, client_ip, client_port)
+                client.sendall(protocol.failure_reply(protocol.REP_ADDRESS_TYPE_NOT_SUPPORTED))
                 return
             
-            port = struct.unpack('!H', client.recv(2))[0]
+            # 请求之后提前到达的数据（如 TLS ClientHello），连接成功后转发给目标
+            early_data = buf.remaining()
 
             # 3. 连接目标服务器
             try:
                 if cmd == 1:  # CONNECT
-                    logger.info(f"CONNECT request from {client_ip}:{client_port} to {address}:{port}")
-                    remote = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    remote.settimeout(SOCKET_TIMEOUT)
-                    remote.connect((address, port))
-                    bind_address = remote.getsockname()
-                    bind_port = bind_address[1]
+                    if verbose:
+                        logger.info("CONNECT request from %s:%s to %s:%s",
+                                    client_ip, client_port, address, port)
+                    route_started = profiler.clock()
+                    route = self.router.decide(address_type, address) if self.router is not None else self.default_route
+                    if route_started:
+                        profiler.record(profiling.PHASE_ROUTE, route_started)
+                    if route == routing.BLOCK:
+                        logger.warning("Blocked CONNECT from %s:%s to %s:%s by routing rules",
+                                       client_ip, client_port, address, port)
+                        client.sendall(protocol.failure_reply(protocol.REP_NOT_ALLOWED))
+                        return
+                    connect_started = time.monotonic()
+                    connect_clock = profiler.clock()
+                    remote = None
+                    if route == routing.PROXY:
+                        remote = self._connect_parent(address_type, address, port)
+                    elif self.warm_pool is not None:
+                        remote = self.warm_pool.acquire(address, port)
+                    if remote is None:
+                        remote = self._connect_remote(address_type, address, port)
+                    self.metrics.observe(self.metrics.connect_latency, time.monotonic() - connect_started)
+                    if connect_clock:
+                        profiler.record(profiling.PHASE_CONNECT, connect_clock)
                     
-                    # 响应 IPv4 地址
-                    addr_ip = struct.unpack("!I", socket.inet_aton(bind_address[0]))[0]
+                    # 回复客户端连接成功: Ver(5) + Rep(0) + Rsv(0) + Atyp + BndAddr + BndPort(2)
+                    client.sendall(protocol.success_reply(remote.getsockname()))
                     
-                    # 回复客户端连接成功: Ver(5) + Rep(0) + Rsv(0) + Atyp(1) + BndAddr(4) + BndPort(2)
-                    reply = struct.pack("!BBBBIH", 5, 0, 0, 1, addr_ip, bind_port)
-                    client.sendall(reply)
-                    
-                    logger.info(f"Connected to {address}:{port} for {client_ip}:{client_port}")
+                    if verbose:
+                        logger.info("Connected to %s:%s for %s:%s", address, port, client_ip, client_port)
+                    if early_data:
+                        remote.sendall(early_data)
+                    record = self.tunnels.open(tunnel.KIND_CONNECT, client_ip, client_port,
+                                               address, port, (client, remote), usr)
+                    limits = self.shaper.attach(client_ip, usr) if self.shaper is not None else None
                     
                     # 4. 数据转发阶段
-                    self.exchange_loop(client, remote, client_ip, client_port, address, port)
+                    if self.reactor is not None:
+                        # 交给 epoll 反应器转发，本线程随即结束
+                        self.reactor.add(client, remote, record, verbose, limits)
+                        handed_off = True
+                    else:
+                        self.exchange_loop(client, remote, record, verbose, limits)
+                elif (cmd == protocol.CMD_UDP_ASSOCIATE and self.udp_relay is not None
+                      and client.family in (socket.AF_INET, socket.AF_INET6)):
+                    self.udp_associate(client, client_ip, client_port, port, verbose)
                 else:
-                    # 暂不支持 BIND 或 UDP ASSOCIATE
-                    logger.warning(f"Unsupported command {cmd} from {client_ip}:{client_port}")
-                    client.sendall(struct.pack("!BBBBIH", 5, 7, 0, 1, 0, 0))  # Command not supported
+                    # 暂不支持 BIND；多路复用流（本地 socketpair）上没有可回复的 UDP 地址，也不支持 UDP ASSOCIATE
+                    logger.warning("Unsupported command %s from %s:%s", cmd, client_ip, client_port)
+                    client.sendall(protocol.failure_reply(protocol.REP_COMMAND_NOT_SUPPORTED))
                     
             except socket.timeout:
-                logger.warning(f"Connection timeout to {address}:{port} for {client_ip}:{client_port}")
-                client.sendall(struct.pack("!BBBBIH", 5, 1, 0, 1, 0, 0))  # General failure
+                logger.warning("Connection timeout to %s:%s for %s:%s",
+                               address, port, client_ip, client_port)
+                client.sendall(protocol.failure_reply(protocol.REP_GENERAL_FAILURE))
+            except chain.ParentProxyError as e:
+                logger.warning("Parent proxy failed for %s:%s from %s:%s: %s",
+                               address, port, client_ip, client_port, e)
+                client.sendall(protocol.failure_reply(e.rep))
             except ConnectionRefusedError:
-                logger.warning(f"Connection refused to {address}:{port} from {client_ip}:{client_port}")
-                client.sendall(struct.pack("!BBBBIH", 5, 5, 0, 1, 0, 0))  # Connection refused
+                logger.warning("Connection refused to %s:%s from %s:%s",
+                               address, port, client_ip, client_port)
+                client.sendall(protocol.failure_reply(protocol.REP_CONNECTION_REFUSED))
             except Exception as e:
-                logger.error(f"Error connecting to {address}:{port}: {e}", exc_info=True)
+                logger.error("Error connecting to %s:%s: %s", address, port, e, exc_info=True)
                 try:
-                    client.sendall(struct.pack("!BBBBIH", 5, 1, 0, 1, 0, 0))  # General failure
+                    client.sendall(protocol.failure_reply(protocol.REP_GENERAL_FAILURE))
                 except:
                     pass
 
         except socket.timeout:
-            logger.warning(f"Socket timeout for {client_ip}:{client_port}")
+            logger.warning("Socket timeout for %s:%s", client_ip, client_port)
         except Exception as e:
-            logger.error(f"Handler error for {client_ip}:{client_port}: {e}", exc_info=True)
+            logger.error("Handler error for %s:%s: %s", client_ip, client_port, e, exc_info=True)
         finally:
-            try:
-                client.close()
-            except:
-                pass
-            with self.connection_lock:
-                self.active_connections -= 1
-            logger.info(f"Client disconnected: {client_ip}:{client_port} (active: {self.active_connections})")
-
-    def exchange_loop(self, client, remote, client_ip, client_port, target_addr, target_port):
-        """在客户端和远程服务器之间转发数据"""
-        bytes_sent = 0
-        bytes_received = 0
+            self.timers.cancel(handshake_timer)
+            if not handed_off:
+                try:
+                    client.close()
+                except:
+                    pass
+                self._release(client_ip, client_port, verbose)
+
+    def udp_associate(self, client, client_ip, client_port, udp_port, verbose=True):
+        """建立 UDP 关联并保持到控制连接关闭；数据报由 UdpRelay 线程转发"""
+        expired = threading.Event()
+        assoc = self.udp_relay.associate(client_ip, udp_port, on_close=expired.set)
+        assoc.record = self.tunnels.open(tunnel.KIND_UDP, client_ip, client_port, 'udp', assoc.port, (client,))
         try:
-            while True:
-                # 使用 select 监听两个 socket 谁有数据
-                r, w, e = select.select([client, remote], [], [], SOCKET_TIMEOUT)
-                
-                if not r:  # 超时无数据
-                    logger.warning(f"Data transfer timeout for {client_ip}:{client_port} -> {target_addr}:{target_port}")
-                    break
-                
-                if client in r:
-                    data = client.recv(4096)
-                    if not data:
+            # 回复控制连接所到达的本机地址和关联的 UDP 端口
+            client.sendall(protocol.success_reply((client.getsockname()[0], assoc.port)))
+            if verbose:
+                logger.info("UDP ASSOCIATE for %s:%s on port %s", client_ip, client_port, assoc.port)
+            # 关联的生命周期与控制连接一致，控制连接上的其他数据忽略
+            control = relay.Readiness([client])
+            while not expired.is_set():
+                r = control.wait(1)
+                try:
+                    if r and not client.recv(4096):
                         break
+                except ConnectionError:
+                    break
+        finally:
+            self.udp_relay.release(assoc)
+            self.tunnels.close(assoc.record)
+            if verbose:
+                logger.info("UDP association closed for %s:%s", client_ip, client_port)
+
+    def exchange_loop(self, client, remote, record, verbose=True, limits=None):
+        """在客户端和远程服务器之间转发数据，字节数和活跃时间记在隧道记录 record 上
+
+        limits 为 shaping.Limits 时按限额授权每次读取，结束时释放；
+        打开分阶段计时时每轮（一次等待及随后的读写）计为一次转发，系统调用按等待 1 次、
+        每块读写各 1 次统计
+        """
+        profiler = self.profiler
+        client_ip, client_port = record.client_ip, record.client_port
+        target_addr, target_port = record.target_addr, record.target_port
+        # 每个方向独立调整块大小：交互流量保持小块，批量传输逐步增大
+        cfg = self.settings
+        up_chunk = relay.AdaptiveChunk(cfg.BUFFER_SIZE, cfg.RELAY_MAX_BUFFER_SIZE)
+        down_chunk = relay.AdaptiveChunk(cfg.BUFFER_SIZE, cfg.RELAY_MAX_BUFFER_SIZE)
+        # 不设超时：空闲超时由隧道登记表的时间轮 shutdown 两端 socket，阻塞的读写随即返回
+        upstream = relay.make_pump(cfg.BUFFER_SIZE, None, cfg.RELAY_SPLICE, cfg.RELAY_MAX_BUFFER_SIZE)
+        downstream = relay.make_pump(cfg.BUFFER_SIZE, None, cfg.RELAY_SPLICE, cfg.RELAY_MAX_BUFFER_SIZE)
+        # 字节数先记在隧道自己的计数器里，每秒最多合并一次到全局指标
+        meter = self.metrics.meter()
+        self.metrics.inc('tunnels_active')
+        readiness = relay.Readiness([client, remote])
+        paused = shaping.PausedReads(readiness) if limits is not None else None
+        try:
+            while True:
+                # 监听两个 socket 谁有数据
+                r = readiness.wait(paused.timeout() if paused is not None else None)
+                started = profiler.clock()
+                if started:
+                    record.syscalls += 1
+
+                up_size, down_size = up_chunk.size, down_chunk.size
+                if paused is not None:
+                    # 令牌不足的方向暂停读取，另一个方向照常转发
+                    if client in r:
+                        up_size = paused.grant(limits.up, client, up_size)
+                    if remote in r:
+                        down_size = paused.grant(limits.down, remote, down_size)
+
+                if client in r and up_size:
                     try:
-                        remote.sendall(data)
-                        bytes_sent += len(data)
+                        n = upstream.transfer(client, remote, up_size)
                     except BrokenPipeError:
-                        logger.info(f"Remote closed connection for {client_ip}:{client_port}")
+                        if verbose:
+                            logger.info("Remote closed connection for %s:%s", client_ip, client_port)
                         break
-                
-                if remote in r:
-                    data = remote.recv(4096)
-                    if not data:
+                    if paused is not None:
+                        limits.up.refund(up_size - (n or 0))
+                    if n == 0:
                         break
+                    if n:
+                        up_chunk.update(n)
+                        record.bytes_up += n
+                        record.last_active = time.monotonic()
+                        meter.add(n, 0)
+                        if started:
+                            record.syscalls += 2
+                
+                if remote in r and down_size:
                     try:
-                        client.sendall(data)
-                        bytes_received += len(data)
+                        n = downstream.transfer(remote, client, down_size)
                     except BrokenPipeError:
-                        logger.info(f"Client closed connection for {client_ip}:{client_port}")
+                        if verbose:
+                            logger.info("Client closed connection for %s:%s", client_ip, client_port)
+                        break
+                    if paused is not None:
+                        limits.down.refund(down_size - (n or 0))
+                    if n == 0:
                         break
+                    if n:
+                        down_chunk.update(n)
+                        record.bytes_down += n
+                        record.last_active = time.monotonic()
+                        meter.add(0, n)
+                        if started:
+                            record.syscalls += 2
+                if started:
+                    profiler.record(profiling.PHASE_RELAY, started)
         except Exception as e:
-            logger.error(f"Data exchange error for {client_ip}:{client_port}: {e}", exc_info=False)
+            logger.error("Data exchange error for %s:%s: %s", client_ip, client_port, e, exc_info=False)
         finally:
+            meter.flush()
+            self.metrics.inc('tunnels_active', -1)
+            upstream.close()
+            downstream.close()
+            if limits is not None:
+                limits.close()
+            self.tunnels.close(record)
             try:
                 remote.close()
             except:
                 pass
-            logger.info(f"Connection closed: {client_ip}:{client_port} -> {target_addr}:{target_port} "
-                       f"(sent: {bytes_sent} bytes, received: {bytes_received} bytes)")
+            if verbose:
+                logger.info("Connection closed: %s:%s -> %s:%s (sent: %s bytes, received: %s bytes)",
+                            client_ip, client_port, target_addr, target_port,
+                            record.bytes_up, record.bytes_down)
 
-if __name__ == "__main__":
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='SOCKS5 proxy server')
+    parser.add_argument('-c', '--config', help='Configuration file (default: config.py next to this script)')
+    parser.add_argument('--host', help='Listen address (HOST)')
+    parser.add_argument('--port', type=int, help='Listen port (PORT)')
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), help='Connection engine (SERVER_MODE)')
+    parser.add_argument('--workers', type=int, help='Worker processes, 0 = one per CPU core (WORKERS)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='Override any setting, e.g. --set MAX_CONNECTIONS=500 (repeatable)')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='Exit at once if the port cannot be bound instead of retrying (BIND_RETRIES = 1)')
+    parser.add_argument('--check', action='store_true', help='Validate the configuration and exit')
+    parser.add_argument('--strict', action='store_true',
+                        help='Treat unknown SOCKS5_* environment variables as errors instead of ignoring them')
+    parser.add_argument('--takeover', action='store_true',
+                        help='Take over the listening sockets of the running server (hot restart)')
+    return parser.parse_args(argv)
+
+
+def load_config(args):
+    """配置文件 < 环境变量 SOCKS5_* < --set < --host/--port 等专用参数；不合法时抛出 ConfigError"""
+    overrides, problems = {}, []
+    for item in args.set:
+        name, sep, text = item.partition('=')
+        name = name.strip()
+        try:
+            if not sep:
+                raise ValueError("expected NAME=VALUE")
+            overrides[name] = parse_setting(name, text)
+        except ValueError as e:
+            problems.append(f"--set {item}: {e}")
+    for name, value in (('HOST', args.host), ('PORT', args.port), ('SERVER_MODE', args.mode),
+                        ('WORKERS', args.workers)):
+        if value is not None:
+            overrides[name] = value
+    if args.fail_fast:
+        overrides['BIND_RETRIES'] = 1
+    try:
+        cfg = load_settings(args.config, overrides=overrides, strict=args.strict)
+    except ConfigError as e:
+        # 一次列出所有问题，而不是改一个报一个
+        raise ConfigError(problems + e.problems) from None
+    if problems:
+        raise ConfigError(problems)
+    return cfg
+
+
+def main(argv=None):
+    args = parse_args(argv)
     try:
-        server = Socks5Server(HOST, PORT)
+        cfg = load_config(args)
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.check:
+        print("Configuration OK (%s)" % ', '.join(cfg.sources))
+        if cfg.ignored:
+            print("Ignored unknown environment variables: %s" % ', '.join(cfg.ignored))
+        return 0
+
+    # 日志经队列交给后台线程写入（自动创建日志目录，按大小轮转）
+    logutil.setup_logging(cfg.LOG_FILE, cfg.LOG_LEVEL, cfg.MAX_LOG_SIZE, cfg.LOG_BACKUP_COUNT, cfg.LOG_QUEUE_SIZE)
+    try:
+        workers = cfg.WORKERS or os.cpu_count() or 1
         logger.info("=" * 60)
         logger.info("SOCKS5 Server started successfully")
-        logger.info(f"Host: {HOST}, Port: {PORT}")
-        logger.info(f"Authentication: {'Enabled (' + USERNAME + ')' if USERNAME else 'Disabled'}")
+        logger.info("Host: %s, Port: %s", cfg.HOST, cfg.PORT)
+        logger.info("Configuration: %s", ', '.join(cfg.sources))
+        if cfg.ignored:
+            logger.warning("Ignoring unknown environment variables: %s", ', '.join(cfg.ignored))
+        if cfg.AUTH_FILE:
+            logger.info("Authentication: Enabled (users from %s)", cfg.AUTH_FILE)
+        else:
+            logger.info("Authentication: %s", 'Enabled (' + cfg.USERNAME + ')' if cfg.USERNAME else 'Disabled')
         logger.info("=" * 60)
+        if workers > 1:
+            from workers import WorkerSupervisor
+            if WorkerSupervisor.supported():
+                # 每个工作进程的指标端点依次使用 METRICS_PORT + 序号
+                if args.takeover:
+                    logger.warning("--takeover needs WORKERS = 1, starting alongside the running server")
+                worker_cfg = cfg.replace(HANDOFF_SOCKET=None)
+                WorkerSupervisor(lambda slot: Socks5Server(
+                                     metrics_port=cfg.METRICS_PORT and cfg.METRICS_PORT + slot,
+                                     settings=worker_cfg),
+                                 workers,
+                                 stats_interval=cfg.WORKER_STATS_INTERVAL).run()
+                return 0
+            logger.warning("SO_REUSEPORT is not available, falling back to a single process")
+        # 热重启：从正在运行的旧进程接管监听 socket（没有旧进程时正常 bind）
+        takeover = None
+        if args.takeover and cfg.HANDOFF_SOCKET:
+            takeover = handoff.request(cfg.HANDOFF_SOCKET)
+        server = Socks5Server(takeover=takeover, settings=cfg)
         server.run()
     except KeyboardInterrupt:
         logger.info("Server interrupted by user")
     except Exception as e:
-        logger.critical(f"Fatal error: {e}", exc_info=True)
+        logger.critical("Fatal error: %s", e, exc_info=True)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
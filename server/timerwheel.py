@@ -0,0 +1,139 @@
+"""
+分层时间轮
+
+握手、连接建立和空闲超时都登记为时间轮上的定时器，由一个后台线程按固定刻度推进，
+不再让每条连接的线程/协程各自带超时等待：
+
+- 每层 64 个槽，第 0 层每槽一个刻度，第 n 层每槽 64^n 个刻度，4 层可覆盖约 194 天（刻度 1 秒）
+- 登记和取消都是 O(1)：定时器放入对应层的槽（集合）中，取消时直接从槽中移除
+- 每个刻度只处理当前槽；高层的槽在低层转完一圈时整体下放到低层
+- 空闲超时不在每次收发数据时重新登记：数据路径只更新最后活跃时间，
+  定时器到期时由回调检查，仍有剩余时间就按剩余时间重新登记
+
+回调在时间轮线程中执行，应当很快返回（例如对 socket 调用 shutdown）。
+"""
+
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_SLOT_BITS = 6
+_SLOTS = 1 << _SLOT_BITS
+_MASK = _SLOTS - 1
+
+
+class Timer:
+    __slots__ = ('deadline', 'expires', 'callback', 'args', 'bucket')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline  # time.monotonic() 时间
+        self.expires = 0          # 到期刻度
+        self.callback = callback
+        self.args = args
+        self.bucket = None        # 所在的槽，None 表示已到期或已取消
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, levels=4):
+        self.tick = tick
+        self.levels = levels
+        self.wheels = [[set() for _ in range(_SLOTS)] for _ in range(levels)]
+        self.origin = time.monotonic()
+        self.ticks = 0        # 已处理到的刻度
+        self.pending = 0      # 已登记、尚未到期或取消的定时器数
+        self.fired = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        t = threading.Thread(target=self._run, name="timer-wheel")
+        t.daemon = True
+        t.start()
+
+    def schedule(self, delay, callback, *args):
+        """delay 秒后在时间轮线程中调用 callback(*args)，返回可用于 cancel 的 Timer"""
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self._lock:
+            self._add(timer)
+            self.pending += 1
+        return timer
+
+    def cancel(self, timer):
+        """取消尚未到期的定时器；返回 False 表示定时器已经到期（回调已经或即将执行）"""
+        if timer is None:
+            return True
+        with self._lock:
+            if timer.bucket is None:
+                return False
+            timer.bucket.discard(timer)
+            timer.bucket = None
+            self.pending -= 1
+            return True
+
+    def stats(self):
+        return {'pending': self.pending, 'fired': self.fired}
+
+    def _add(self, timer):
+        """按截止时间登记；调用方需持有锁"""
+        self._place(timer, max(math.ceil((timer.deadline - self.origin) / self.tick), self.ticks + 1))
+
+    def _place(self, timer, expires):
+        """放入到期刻度所在层的槽；调用方需持有锁"""
+        delta = expires - self.ticks
+        for level in range(self.levels):
+            if delta < 1 << (_SLOT_BITS * (level + 1)):
+                break
+        else:
+            # 超出时间轮范围：先放在最高层最远的槽，到期时按真实截止时间重新登记
+            level = self.levels - 1
+            expires = self.ticks + (1 << (_SLOT_BITS * self.levels)) - 1
+        timer.expires = expires
+        timer.bucket = self.wheels[level][(expires >> (_SLOT_BITS * level)) & _MASK]
+        timer.bucket.add(timer)
+
+    def advance(self, now):
+        """推进到 now 对应的刻度，返回到期的定时器列表（不调用回调）"""
+        target = int((now - self.origin) / self.tick)
+        due = []
+        with self._lock:
+            while self.ticks < target:
+                self.ticks += 1
+                # 低层转完一圈时，把高层当前槽下放到低层
+                level = 1
+                while level < self.levels and self.ticks & ((1 << (_SLOT_BITS * level)) - 1) == 0:
+                    level += 1
+                for upper in range(level - 1, 0, -1):
+                    bucket = self.wheels[upper][(self.ticks >> (_SLOT_BITS * upper)) & _MASK]
+                    timers = list(bucket)
+                    bucket.clear()
+                    for timer in timers:
+                        self._place(timer, timer.expires)
+                bucket = self.wheels[0][self.ticks & _MASK]
+                for timer in bucket:
+                    timer.bucket = None
+                    due.append(timer)
+                bucket.clear()
+            # 超出范围被提前放入的定时器按真实截止时间重新登记
+            early = [t for t in due if t.deadline > now + self.tick]
+            if early:
+                due = [t for t in due if t.deadline <= now + self.tick]
+                for timer in early:
+                    self._add(timer)
+            self.pending -= len(due)
+            self.fired += len(due)
+        return due
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            for timer in self.advance(time.monotonic()):
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    logger.error("Timer callback failed: %s", e, exc_info=True)
@@ -0,0 +1,144 @@
+"""
+活跃隧道登记表
+
+每条已建立的隧道（CONNECT 或 UDP ASSOCIATE）对应一个 __slots__ 的 Tunnel 记录，
+集中保存客户端/目标地址、字节数和最后活跃时间，三种转发方式共用：
+- 枚举活跃隧道及其空闲时间
+- 按 ID 或客户端 IP 关闭隧道
+- 空闲超时：登记时在时间轮上放一个定时器，数据路径只更新 last_active
+
+关闭隧道只对 socket 调用 shutdown，可在任意线程执行：负责转发的线程或事件循环
+随即读到 EOF，按正常流程清理，不会与其并发 close 同一个文件描述符。
+"""
+
+import sys
+import time
+import socket
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+KIND_CONNECT = 'connect'
+KIND_UDP = 'udp'
+
+
+class Tunnel:
+    __slots__ = ('id', 'kind', 'client_ip', 'client_port', 'target_addr', 'target_port',
+                 'created', 'last_active', 'bytes_up', 'bytes_down', 'socks', 'timer', 'user', 'syscalls')
+
+    def __init__(self, tunnel_id, kind, client_ip, client_port, target_addr, target_port, socks, user=None):
+        self.id = tunnel_id
+        self.kind = kind
+        self.client_ip = client_ip
+        self.client_port = client_port
+        self.target_addr = target_addr
+        self.target_port = target_port
+        self.created = self.last_active = time.monotonic()
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.socks = socks  # kill() 时 shutdown 的 socket
+        self.timer = None   # 空闲超时定时器
+        self.user = user    # 认证用户名（未启用认证时为 None）
+        self.syscalls = 0   # 转发的系统调用数，只在打开分阶段计时（profiling）期间统计
+
+    def idle(self, now=None):
+        return (now or time.monotonic()) - self.last_active
+
+    def kill(self):
+        for sock in self.socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # 已关闭
+
+    def as_dict(self, now):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'client': f'{self.client_ip}:{self.client_port}',
+            'user': self.user,
+            'target': f'{self.target_addr}:{self.target_port}',
+            'age': round(now - self.created, 1),
+            'idle': round(now - self.last_active, 1),
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'syscalls': self.syscalls,
+        }
+
+
+class TunnelRegistry:
+    def __init__(self, timers=None, idle_timeout=0):
+        """timers 为 timerwheel.TimerWheel；idle_timeout 秒内没有数据的隧道被关闭（0 表示不限制）"""
+        self.timers = timers
+        self.idle_timeout = idle_timeout
+        self._tunnels = {}  # id -> Tunnel
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tunnels)
+
+    def open(self, kind, client_ip, client_port, target_addr, target_port, socks, user=None):
+        """登记一条已建立的隧道，返回其 Tunnel 记录"""
+        with self._lock:
+            tunnel = Tunnel(next(self._ids), kind, client_ip, client_port, target_addr, target_port,
+                            socks, user)
+            self._tunnels[tunnel.id] = tunnel
+        if self.timers is not None and self.idle_timeout:
+            tunnel.timer = self.timers.schedule(self.idle_timeout, self._check_idle, tunnel)
+        return tunnel
+
+    def close(self, tunnel):
+        with self._lock:
+            self._tunnels.pop(tunnel.id, None)
+        if self.timers is not None:
+            self.timers.cancel(tunnel.timer)
+
+    def _check_idle(self, tunnel):
+        """时间轮线程：期间有过数据就按剩余时间重新登记，否则关闭隧道"""
+        if tunnel.id not in self._tunnels:
+            return
+        remaining = tunnel.last_active + self.idle_timeout - time.monotonic()
+        if remaining > 0:
+            tunnel.timer = self.timers.schedule(remaining, self._check_idle, tunnel)
+            return
+        logger.warning("Idle timeout for %s:%s -> %s:%s after %ss",
+                       tunnel.client_ip, tunnel.client_port, tunnel.target_addr, tunnel.target_port,
+                       self.idle_timeout)
+        tunnel.kill()
+
+    def snapshot(self, client_ip=None):
+        """按空闲时间从长到短返回隧道信息列表"""
+        now = time.monotonic()
+        with self._lock:
+            tunnels = list(self._tunnels.values())
+        if client_ip is not None:
+            tunnels = [t for t in tunnels if t.client_ip == client_ip]
+        tunnels.sort(key=lambda t: t.last_active)
+        return [t.as_dict(now) for t in tunnels]
+
+    def kill(self, tunnel_id):
+        """关闭指定 ID 的隧道，返回是否存在"""
+        tunnel = self._tunnels.get(tunnel_id)
+        if tunnel is None:
+            return False
+        tunnel.kill()
+        return True
+
+    def kill_ip(self, client_ip):
+        """关闭某个客户端 IP 的全部隧道，返回关闭的数量"""
+        with self._lock:
+            tunnels = [t for t in self._tunnels.values() if t.client_ip == client_ip]
+        for tunnel in tunnels:
+            tunnel.kill()
+        return len(tunnels)
+
+    def stats(self):
+        # 记录本身的大小（不含地址字符串和 socket 对象），用于估算登记表的内存开销
+        return {
+            'tunnels': len(self._tunnels),
+            'record_bytes': sys.getsizeof(Tunnel(0, KIND_CONNECT, '', 0, '', 0, ())),
+            'idle_timeout': self.idle_timeout,
+        }
@@ -0,0 +1,324 @@
+"""
+UDP ASSOCIATE 数据报转发（RFC 1928 第 7 节）
+
+每个关联（association）使用一个独立的 UDP socket：客户端把带 SOCKS 报文头的数据报
+发到这个 socket，去掉报文头后转发给目标；目标的回包加上报文头后发回客户端。
+所有关联由一个后台线程统一转发：
+
+- 每个 socket 可读时一次读到 EAGAIN（设有预算），批量处理后再回到 selector
+- 关联对象直接挂在 selector 的 key.data 上，收发包时不查找也不修改任何全局字典
+- 目标地址和回包报文头按关联缓存，稳定的数据流每个包只做一次字典查询
+- 回包用 sendmsg 把报文头和负载一起发出，不拼接负载
+- 关联在控制 TCP 连接关闭或空闲超过 idle_timeout 后关闭
+"""
+
+import os
+import time
+import socket
+import logging
+import selectors
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# 单个 socket 每轮最多处理的数据报数，超出后让出给其他关联
+_RECV_BUDGET = 64
+# 每个关联缓存的目标地址/回包报文头数量上限
+_CACHE_SIZE = 256
+# 数据报最大长度
+_MAX_DATAGRAM = 65535
+
+
+def _unmap(host):
+    """双栈 socket 上的 IPv4 映射地址 ::ffff:a.b.c.d -> a.b.c.d"""
+    if host.startswith('::ffff:') and '.' in host:
+        return host[7:]
+    return host
+
+
+class _Association:
+    __slots__ = ('sock', 'dual_stack', 'client_host', 'client_port', 'client_addr', 'targets',
+                 'headers', 'last_active', 'on_close', 'closed', 'record')
+
+    def __init__(self, sock, dual_stack, client_host, client_port, on_close):
+        self.sock = sock
+        self.dual_stack = dual_stack
+        self.client_host = client_host
+        self.client_port = client_port  # 0 表示客户端未在请求中声明 UDP 端口
+        self.client_addr = None         # 收到客户端第一个数据报后确定
+        self.targets = {}               # 报文头地址部分 -> 目标 sockaddr
+        self.headers = {}               # 回包来源 sockaddr -> SOCKS 报文头
+        self.last_active = time.monotonic()
+        self.on_close = on_close
+        self.closed = False
+        self.record = None              # 隧道登记表中的记录（tunnel.Tunnel），由调用方设置
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def sockaddr(self, family, sockaddr):
+        """把解析结果转换为本关联 socket 可用的目标地址，地址族不兼容时返回 None"""
+        host, port = sockaddr[:2]
+        if self.dual_stack:
+            if family == socket.AF_INET:
+                return ('::ffff:' + host, port, 0, 0)
+            return (host, port, 0, 0)
+        return (host, port) if family == socket.AF_INET else None
+
+
+class UdpRelay:
+    def __init__(self, idle_timeout=60, resolve=upstream.resolve, lookup=None,
+                 socket_buffer=1024 * 1024, resolver_threads=4):
+        """resolve(host, port) / lookup(host, port) 返回 [(family, sockaddr), ...]
+
+        lookup 只查缓存（未命中返回 None），命中时域名目标不必交给解析线程池。
+        """
+        self.idle_timeout = idle_timeout
+        self.resolve = resolve
+        self.lookup = lookup
+        self.socket_buffer = socket_buffer
+        self.dual_stack = socket.has_dualstack_ipv6()
+        self.selector = selectors.DefaultSelector()
+        self.executor = ThreadPoolExecutor(resolver_threads, thread_name_prefix="udp-resolve")
+        self.buffer = bytearray(_MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+        # 其他线程提交的注册/关闭请求，经唤醒管道通知转发线程
+        self.commands = deque()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+        self.associations = 0
+        self.packets_up = 0
+        self.packets_down = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.dropped = 0
+
+    def start(self):
+        t = threading.Thread(target=self._run, name="udp-relay")
+        t.daemon = True
+        t.start()
+        logger.info("UDP relay started")
+
+    def associate(self, client_host, client_port=0, on_close=None):
+        """为客户端创建关联，返回 _Association（其 port 用于 UDP ASSOCIATE 回复）
+
+        on_close() 在关联因空闲超时关闭时由转发线程调用。
+        """
+        if self.dual_stack:
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            sock.bind(('::', 0))
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('0.0.0.0', 0))
+        sock.setblocking(False)
+        if self.socket_buffer:
+            for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, option, self.socket_buffer)
+                except OSError:
+                    pass
+        assoc = _Association(sock, self.dual_stack, _unmap(client_host), client_port, on_close)
+        self._submit(self._register, assoc)
+        return assoc
+
+    def release(self, assoc):
+        """控制连接结束后关闭关联（可在任意线程调用）"""
+        self._submit(self._close, assoc)
+
+    def stats(self):
+        return {
+            'associations': self.associations,
+            'packets_up': self.packets_up,
+            'packets_down': self.packets_down,
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'dropped': self.dropped,
+        }
+
+    def _submit(self, command, assoc):
+        self.commands.append((command, assoc))
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # 管道已满，转发线程必定会被唤醒
+
+    def _run(self):
+        next_sweep = time.monotonic() + 1
+        while True:
+            for key, _ in self.selector.select(1):
+                if key.data is None:
+                    self._drain_commands()
+                elif not key.data.closed:
+                    try:
+                        self._pump(key.data)
+                    except Exception as e:
+                        # 一个数据报出错不能让所有关联共用的转发线程退出
+                        logger.error("UDP relay error on port %s: %s", key.data.port, e)
+
+            now = time.monotonic()
+            if now >= next_sweep:
+                self._sweep(now)
+                next_sweep = now + 1
+
+    def _drain_commands(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.commands:
+            command, assoc = self.commands.popleft()
+            command(assoc)
+
+    def _register(self, assoc):
+        if assoc.closed:
+            return
+        self.selector.register(assoc.sock, selectors.EVENT_READ, assoc)
+        self.associations += 1
+
+    def _close(self, assoc, notify=False):
+        if assoc.closed:
+            return
+        assoc.closed = True
+        try:
+            self.selector.unregister(assoc.sock)
+            self.associations -= 1
+        except (KeyError, ValueError):
+            pass  # 注册请求尚未处理
+        assoc.sock.close()
+        if notify and assoc.on_close is not None:
+            try:
+                assoc.on_close()
+            except Exception as e:
+                logger.error("UDP association close callback failed: %s", e)
+
+    def _sweep(self, now):
+        deadline = now - self.idle_timeout
+        expired = [key.data for key in list(self.selector.get_map().values())
+                   if key.data is not None and key.data.last_active < deadline]
+        for assoc in expired:
+            logger.info("UDP association on port %s idle for %ss, closing",
+                        assoc.port, self.idle_timeout)
+            self._close(assoc, notify=True)
+
+    def _pump(self, assoc):
+        sock = assoc.sock
+        buffer, view = self.buffer, self.view
+        for _ in range(_RECV_BUDGET):
+            try:
+                n, addr = sock.recvfrom_into(buffer)
+            except BlockingIOError:
+                break
+            except OSError:
+                # 之前发往目标的数据报触发的 ICMP 错误，忽略
+                continue
+
+            if addr == assoc.client_addr:
+                self._forward(assoc, view, n)
+            elif assoc.client_addr is None and self._from_client(assoc, addr):
+                assoc.client_addr = addr
+                self._forward(assoc, view, n)
+            elif assoc.client_addr is not None:
+                self._reply(assoc, view, n, addr)
+            else:
+                self.dropped += 1
+        assoc.last_active = time.monotonic()
+        if assoc.record is not None:
+            assoc.record.last_active = assoc.last_active
+
+    @staticmethod
+    def _from_client(assoc, addr):
+        """客户端的第一个数据报必须来自控制连接的 IP（以及声明的端口）"""
+        if _unmap(addr[0]) != assoc.client_host:
+            return False
+        return assoc.client_port == 0 or addr[1] == assoc.client_port
+
+    def _forward(self, assoc, view, n):
+        """客户端 -> 目标：去掉 SOCKS 报文头后发送"""
+        header_length = protocol.udp_header_length(view, n)
+        if not header_length:
+            self.dropped += 1
+            return
+        key = bytes(view[3:header_length])
+        target = assoc.targets.get(key)
+        if target is None:
+            address_type, address, port = protocol.parse_udp_address(bytes(view[:header_length]))
+            if address_type == protocol.ATYP_DOMAIN:
+                try:
+                    addrs = self.lookup(address, port) if self.lookup is not None else None
+                except OSError:
+                    # 解析失败的结果已缓存（负缓存），直接丢弃
+                    self.dropped += 1
+                    return
+                if addrs is None:
+                    # 域名未缓存：复制负载交给解析线程，转发线程不等待 DNS
+                    self.executor.submit(self._resolve_and_send, assoc,
+                                         bytes(view[header_length:n]), address, port)
+                    return
+            else:
+                family = socket.AF_INET6 if address_type == protocol.ATYP_IPV6 else socket.AF_INET
+                addrs = [(family, (address, port))]
+                # 只缓存 IP 字面量目标，域名结果以 DNS 缓存的 TTL 为准
+                if len(assoc.targets) >= _CACHE_SIZE:
+                    assoc.targets.clear()
+            target = self._pick(assoc, addrs)
+            if target is None:
+                self.dropped += 1
+                return
+            if address_type != protocol.ATYP_DOMAIN:
+                assoc.targets[key] = target
+        self._send(assoc, view[header_length:n], target)
+        self.packets_up += 1
+        self.bytes_up += n - header_length
+
+    def _reply(self, assoc, view, n, addr):
+        """目标 -> 客户端：加上标识来源地址的 SOCKS 报文头"""
+        header = assoc.headers.get(addr)
+        if header is None:
+            if len(assoc.headers) >= _CACHE_SIZE:
+                assoc.headers.clear()
+            header = assoc.headers[addr] = protocol.udp_header(_unmap(addr[0]), addr[1])
+        try:
+            assoc.sock.sendmsg([header, view[:n]], [], 0, assoc.client_addr)
+        except (BlockingIOError, OSError):
+            self.dropped += 1
+            return
+        self.packets_down += 1
+        self.bytes_down += n
+
+    @staticmethod
+    def _pick(assoc, addrs):
+        for family, sockaddr in addrs:
+            target = assoc.sockaddr(family, sockaddr)
+            if target is not None:
+                return target
+        return None
+
+    def _send(self, assoc, payload, target):
+        try:
+            assoc.sock.sendto(payload, target)
+        except (BlockingIOError, OSError):
+            # UDP 不保证送达：发送缓冲区满或目标不可达时直接丢弃
+            self.dropped += 1
+
+    def _resolve_and_send(self, assoc, payload, address, port):
+        try:
+            target = self._pick(assoc, self.resolve(address, port))
+        except OSError as e:
+            logger.warning("UDP target %s:%s could not be resolved: %s", address, port, e)
+            target = None
+        if target is None or assoc.closed:
+            self.dropped += 1
+            return
+        self._send(assoc, payload, target)
+        self.packets_up += 1
+        self.bytes_up += len(payload)
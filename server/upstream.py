@@ -0,0 +1,300 @@
+"""
+连接目标服务器
+
+按 RFC 8305（Happy Eyeballs v2）对解析出的多个地址交替排列 IPv6/IPv4，
+错开 HAPPY_EYEBALLS_DELAY 依次发起连接，最先成功的连接胜出，其余全部关闭。
+某个地址族缓慢或不可达时，不必等它超时才尝试下一个地址。
+
+WarmPool 为少量热点目标预先建立空闲连接，CONNECT 时直接取用，省去一次 TCP 握手。
+"""
+
+import os
+import time
+import errno
+import select
+import socket
+import logging
+import threading
+from collections import deque
+
+import protocol
+
+logger = logging.getLogger(__name__)
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def resolve(host, port):
+    """未启用 DNS 缓存时直接解析，返回 [(family, sockaddr), ...]"""
+    infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    return [(info[0], info[4]) for info in infos]
+
+
+def literal_addresses(address_type, address, port):
+    """IPv4/IPv6 地址直接构造 sockaddr，域名返回 None"""
+    if address_type == protocol.ATYP_IPV4:
+        return [(socket.AF_INET, (address, port))]
+    if address_type == protocol.ATYP_IPV6:
+        return [(socket.AF_INET6, (address, port, 0, 0))]
+    return None
+
+
+def interleave(addrinfos):
+    """以第一个地址的地址族开头，交替排列两种地址族（RFC 8305 第 4 节）"""
+    if not addrinfos:
+        return []
+    first_family = addrinfos[0][0]
+    first = [a for a in addrinfos if a[0] == first_family]
+    second = [a for a in addrinfos if a[0] != first_family]
+    result = []
+    for i in range(max(len(first), len(second))):
+        if i < len(first):
+            result.append(first[i])
+        if i < len(second):
+            result.append(second[i])
+    return result
+
+
+def _new_socket(family, setup):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    if setup is not None:
+        setup(sock)
+    return sock
+
+
+def _oserror(err):
+    # OSError 会根据 errno 自动构造对应子类，例如 ConnectionRefusedError
+    return OSError(err, os.strerror(err))
+
+
+def happy_eyeballs_connect(addrinfos, timeout, delay=0.25, setup=None):
+    """返回已连接的阻塞 socket；全部失败时抛出最后一个错误，超时抛出 socket.timeout
+
+    timeout 为 0 或 None 时不设截止时间
+    """
+    queue = interleave(addrinfos)
+    if not queue:
+        raise OSError(errno.EHOSTUNREACH, "No address to connect to")
+
+    deadline = time.monotonic() + timeout if timeout else None
+    pending = {}  # fd -> socket
+    poller = select.poll()
+    last_error = None
+    next_attempt = 0
+
+    try:
+        while True:
+            now = time.monotonic()
+            if queue and (not pending or now >= next_attempt):
+                family, sockaddr = queue.pop(0)
+                sock = _new_socket(family, setup)
+                err = sock.connect_ex(sockaddr)
+                if err == 0:
+                    pending[sock.fileno()] = sock
+                    return _won(sock, pending)
+                if err not in _IN_PROGRESS:
+                    last_error = _oserror(err)
+                    sock.close()
+                    continue
+                pending[sock.fileno()] = sock
+                poller.register(sock, select.POLLOUT)
+                next_attempt = now + delay
+                continue
+
+            if not pending:
+                raise last_error
+
+            wait = None
+            if deadline is not None:
+                if now >= deadline:
+                    raise socket.timeout("timed out")
+                wait = deadline - now
+            if queue:
+                retry = max(0, next_attempt - now)
+                wait = retry if wait is None else min(wait, retry)
+
+            for fd, _ in poller.poll(None if wait is None else wait * 1000):
+                sock = pending[fd]
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    return _won(sock, pending)
+                # 失败后立即尝试下一个地址
+                last_error = _oserror(err)
+                poller.unregister(fd)
+                del pending[fd]
+                sock.close()
+                next_attempt = 0
+    except BaseException:
+        for sock in pending.values():
+            sock.close()
+        raise
+
+
+def _won(sock, pending):
+    del pending[sock.fileno()]
+    for other in pending.values():
+        other.close()
+    pending.clear()
+    sock.setblocking(True)
+    return sock
+
+
+async def async_happy_eyeballs_connect(addrinfos, delay=0.25, setup=None):
+    """asyncio 版本，返回已连接的非阻塞 socket；超时由调用方的 wait_for 控制"""
+    # 只有 asyncio 模式用到，线程模式启动时不加载 asyncio
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    queue = interleave(addrinfos)
+    if not queue:
+        raise OSError(errno.EHOSTUNREACH, "No address to connect to")
+
+    attempts = {}  # task -> socket
+    last_error = None
+    try:
+        while queue or attempts:
+            if queue:
+                family, sockaddr = queue.pop(0)
+                sock = _new_socket(family, setup)
+                attempts[asyncio.ensure_future(loop.sock_connect(sock, sockaddr))] = sock
+
+            done, _ = await asyncio.wait(list(attempts), timeout=delay if queue else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                sock = attempts.pop(task)
+                if task.exception() is None:
+                    return sock
+                last_error = task.exception()
+                sock.close()
+        raise last_error
+    finally:
+        for task, sock in attempts.items():
+            task.cancel()
+            sock.close()
+
+
+def parse_destination(value):
+    """'host:port' 或 '[ipv6]:port' -> (host, port)"""
+    host, _, port = value.rpartition(':')
+    return host.strip('[]').lower(), int(port)
+
+
+def idle_alive(sock):
+    """空闲连接是否仍可用：对端关闭时 MSG_PEEK 读到 EOF"""
+    # 带超时的 socket 在 recv 前会先等待可读，检查时需临时切换为非阻塞
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return sock.recv(1, socket.MSG_PEEK) != b''
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+class _WarmStats:
+    __slots__ = ('hits', 'misses', 'connects', 'connect_time')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.connects = 0
+        self.connect_time = 0.0
+
+
+class WarmPool:
+    """热点目标的预连接池
+
+    后台线程为每个目标保持 size 个空闲连接，空闲超过 idle_timeout 的连接在
+    被对端关闭之前主动替换。acquire() 只对配置中的目标生效。
+    """
+
+    def __init__(self, destinations, size, idle_timeout, connect, interval=1):
+        """connect(host, port) 返回已连接的 socket"""
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connect = connect
+        self.interval = interval
+        self._idle = {dest: deque() for dest in destinations}  # dest -> deque[(创建时间, socket)]
+        self._stats = {dest: _WarmStats() for dest in destinations}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        t = threading.Thread(target=self._run, name="warm-pool")
+        t.daemon = True
+        t.start()
+        logger.info("Upstream warm pool started for %s destination(s)", len(self._idle))
+
+    def acquire(self, host, port):
+        """取出一个可用的预连接，目标不在池中或池已空时返回 None"""
+        dest = (host.lower(), port)
+        idle = self._idle.get(dest)
+        if idle is None:
+            return None
+        stats = self._stats[dest]
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            while idle:
+                created, sock = idle.popleft()
+                if created > deadline and self._alive(sock):
+                    stats.hits += 1
+                    self._wakeup.set()
+                    return sock
+                sock.close()
+            stats.misses += 1
+        self._wakeup.set()
+        return None
+
+    def stats(self):
+        result = {}
+        for (host, port), stats in self._stats.items():
+            total = stats.hits + stats.misses
+            result[f"{host}:{port}"] = {
+                'idle': len(self._idle[(host, port)]),
+                'hits': stats.hits,
+                'misses': stats.misses,
+                'hit_rate': round(stats.hits / total, 3) if total else 0.0,
+                # 未命中时客户端需要额外等待的平均握手耗时
+                'avg_connect_ms': round(stats.connect_time / stats.connects * 1000, 1) if stats.connects else 0.0,
+            }
+        return result
+
+    _alive = staticmethod(idle_alive)
+
+    def _run(self):
+        while True:
+            for dest in self._idle:
+                try:
+                    self._maintain(dest)
+                except Exception as e:
+                    logger.warning("Warm pool refill failed for %s:%s: %s", dest[0], dest[1], e)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _maintain(self, dest):
+        idle = self._idle[dest]
+        # 提前一个刷新周期替换即将过期的连接
+        deadline = time.monotonic() - self.idle_timeout + self.interval
+        with self._lock:
+            fresh = []
+            for created, sock in idle:
+                if created > deadline and self._alive(sock):
+                    fresh.append((created, sock))
+                else:
+                    sock.close()
+            idle.clear()
+            idle.extend(fresh)
+            missing = self.size - len(idle)
+
+        stats = self._stats[dest]
+        for _ in range(missing):
+            started = time.monotonic()
+            sock = self.connect(*dest)
+            stats.connects += 1
+            stats.connect_time += time.monotonic() - started
+            with self._lock:
+                idle.append((time.monotonic(), sock))
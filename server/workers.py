@@ -0,0 +1,175 @@
+"""
+多进程 SO_REUSEPORT 工作进程池
+
+主进程（supervisor）fork 出 N 个工作进程，每个工作进程各自在 HOST:PORT 上
+绑定监听 socket（依赖 SO_REUSEPORT），由内核在各进程之间分发新连接。
+工作进程异常退出后会被自动重启；各进程的连接计数写入共享内存，
+由主进程定期汇总输出。主进程收到的性能剖析开关信号（SIGUSR1 / SIGUSR2）
+转发给全部工作进程。
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import threading
+import multiprocessing
+
+import logutil
+
+logger = logging.getLogger(__name__)
+
+# 共享内存中每个工作进程占用的槽位: active, total
+_SLOT_FIELDS = 2
+
+# 转发给工作进程的信号：性能剖析开关（profiling）
+_FORWARDED_SIGNALS = tuple(getattr(signal, name) for name in ('SIGUSR1', 'SIGUSR2') if hasattr(signal, name))
+
+
+class WorkerSupervisor:
+    def __init__(self, server_factory, workers, stats_interval=60,
+                 restart_delay=1, max_restart_delay=30):
+        """server_factory(slot) 在工作进程中调用，返回已绑定端口的 Socks5Server"""
+        self.server_factory = server_factory
+        self.workers = workers
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stats = multiprocessing.RawArray('q', workers * _SLOT_FIELDS)
+        self.pids = {}          # pid -> slot
+        self.started_at = {}    # slot -> 启动时间
+        self.delays = [restart_delay] * workers
+        self.retired_total = 0  # 已退出工作进程的累计连接数
+        self.stopping = False
+
+    @staticmethod
+    def supported():
+        return hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'fork')
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        for signum in _FORWARDED_SIGNALS:
+            signal.signal(signum, self._forward_signal)
+        logger.info("Starting %s worker processes (SO_REUSEPORT)", self.workers)
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        next_report = time.monotonic() + self.stats_interval
+        try:
+            while not self.stopping:
+                self._reap()
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report = time.monotonic() + self.stats_interval
+                time.sleep(1)
+        finally:
+            self._shutdown()
+
+    def counts(self):
+        """返回 (各进程活跃连接数, 活跃总数, 累计接受总数)"""
+        per_worker = [self.stats[slot * _SLOT_FIELDS] for slot in range(self.workers)]
+        total = sum(self.stats[slot * _SLOT_FIELDS + 1] for slot in range(self.workers))
+        return per_worker, sum(per_worker), self.retired_total + total
+
+    def report(self):
+        per_worker, active, total = self.counts()
+        logger.info("Workers alive: %s/%s, active connections: %s (per worker: %s), total accepted: %s",
+                    len(self.pids), self.workers, active, per_worker, total)
+
+    def _on_signal(self, signum, frame):
+        self.stopping = True
+
+    def _forward_signal(self, signum, frame):
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            self._worker_main(slot)  # 不会返回
+        self.pids[pid] = slot
+        self.started_at[slot] = time.monotonic()
+        logger.info("Worker %s started (pid %s)", slot, pid)
+
+    def _reap(self):
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.pids.pop(pid, None)
+            if slot is None:
+                continue
+            # 工作进程退出后其连接已全部断开
+            self.stats[slot * _SLOT_FIELDS] = 0
+            self.retired_total += self.stats[slot * _SLOT_FIELDS + 1]
+            self.stats[slot * _SLOT_FIELDS + 1] = 0
+            if self.stopping:
+                continue
+
+            # 启动后很快崩溃时逐步加大重启间隔，避免 fork 风暴
+            if time.monotonic() - self.started_at[slot] < self.max_restart_delay:
+                delay = self.delays[slot]
+                self.delays[slot] = min(delay * 2, self.max_restart_delay)
+            else:
+                delay = self.delays[slot] = self.restart_delay
+            logger.warning("Worker %s (pid %s) exited with status %s, restarting in %ss", slot, pid, status, delay)
+            time.sleep(delay)
+            self._spawn(slot)
+
+    def _shutdown(self):
+        logger.info("Stopping worker processes...")
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.pids):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.pids.clear()
+
+    def _worker_main(self, slot):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        # 服务器开始运行后再由它安装剖析开关的处理函数
+        for signum in _FORWARDED_SIGNALS:
+            signal.signal(signum, signal.SIG_IGN)
+        code = 0
+        try:
+            server = self.server_factory(slot)
+            t = threading.Thread(target=self._publish, args=(server, slot))
+            t.daemon = True
+            t.start()
+            server.run()
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            logger.critical("Worker %s failed: %s", slot, e, exc_info=True)
+            code = 1
+        finally:
+            # os._exit 不执行 atexit，先写完队列中的日志
+            logutil.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _publish(self, server, slot):
+        """定期把本进程的连接计数写入共享内存（单写者，无需加锁）"""
+        base = slot * _SLOT_FIELDS
+        while True:
+            active, total = server.connection_counts()
+            self.stats[base] = active
+            self.stats[base + 1] = total
+            time.sleep(1)
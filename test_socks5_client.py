@@ -11,7 +11,8 @@ import argparse
 
 
 class Socks5Client:
-    def __init__(self, proxy_host, proxy_port, target_host, target_port, username=None, password=None):
+    def __init__(self, proxy_host, proxy_port, target_host, target_port, username=None, password=None,
+                 verbose=True):
         self.proxy_host = proxy_host
         self.proxy_port = proxy_port
         self.target_host = target_host
@@ -19,16 +20,21 @@ class Socks5Client:
         self.username = username
         self.password = password
         self.sock = None
+        self.verbose = verbose
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
 
     def connect(self):
         """Connect to SOCKS5 proxy"""
         try:
-            print(f"[*] Connecting to SOCKS5 proxy: {self.proxy_host}:{self.proxy_port}")
+            self._log(f"[*] Connecting to SOCKS5 proxy: {self.proxy_host}:{self.proxy_port}")
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((self.proxy_host, self.proxy_port))
-            print("[✓] Connected to proxy")
+            self._log("[✓] Connected to proxy")
         except Exception as e:
-            print(f"[✗] Failed to connect: {e}")
+            self._log(f"[✗] Failed to connect: {e}")
             return False
         return True
 
@@ -42,45 +48,45 @@ class Socks5Client:
                 methods.append(2)  # Username/password auth
             
             greeting = struct.pack("!BB", 5, len(methods)) + bytes(methods)
-            print(f"[*] Sending greeting with {len(methods)} authentication method(s)")
+            self._log(f"[*] Sending greeting with {len(methods)} authentication method(s)")
             self.sock.sendall(greeting)
             
             # Server response
             # VER (1) + METHOD (1)
             response = self.sock.recv(2)
             if len(response) < 2:
-                print("[✗] Invalid server response")
+                self._log("[✗] Invalid server response")
                 return False
             
             version, method = struct.unpack("!BB", response)
-            print(f"[*] Server response: version={version}, method={method}")
+            self._log(f"[*] Server response: version={version}, method={method}")
             
             if method == 0xFF:
-                print("[✗] No acceptable method")
+                self._log("[✗] No acceptable method")
                 return False
             
             # Authentication if required
             if method == 2:
                 return self.authenticate()
             elif method == 0:
-                print("[✓] No authentication required")
+                self._log("[✓] No authentication required")
                 return True
             else:
-                print(f"[!] Unsupported method: {method}")
+                self._log(f"[!] Unsupported method: {method}")
                 return False
                 
         except Exception as e:
-            print(f"[✗] Handshake error: {e}")
+            self._log(f"[✗] Handshake error: {e}")
             return False
 
     def authenticate(self):
         """Authenticate using username/password"""
         try:
             if not self.username or not self.password:
-                print("[✗] Authentication required but no credentials provided")
+                self._log("[✗] Authentication required but no credentials provided")
                 return False
             
-            print(f"[*] Authenticating with username: {self.username}")
+            self._log(f"[*] Authenticating with username: {self.username}")
             
             # Auth request
             # VER (1) + ULEN (1) + UNAME + PLEN (1) + PASSWD
@@ -95,25 +101,25 @@ class Socks5Client:
             # VER (1) + STATUS (1)
             response = self.sock.recv(2)
             if len(response) < 2:
-                print("[✗] Invalid auth response")
+                self._log("[✗] Invalid auth response")
                 return False
             
             version, status = struct.unpack("!BB", response)
             if status == 0:
-                print("[✓] Authentication successful")
+                self._log("[✓] Authentication successful")
                 return True
             else:
-                print("[✗] Authentication failed")
+                self._log("[✗] Authentication failed")
                 return False
                 
         except Exception as e:
-            print(f"[✗] Authentication error: {e}")
+            self._log(f"[✗] Authentication error: {e}")
             return False
 
     def request_connection(self):
         """Request CONNECT to target server"""
         try:
-            print(f"[*] Requesting CONNECT to {self.target_host}:{self.target_port}")
+            self._log(f"[*] Requesting CONNECT to {self.target_host}:{self.target_port}")
             
             # CONNECT request
             # VER (1) + CMD (1) + RSV (1) + ATYP (1) + DST.ADDR + DST.PORT
@@ -139,7 +145,7 @@ class Socks5Client:
             # VER (1) + REP (1) + RSV (1) + ATYP (1) + BND.ADDR + BND.PORT
             response = self.sock.recv(4)
             if len(response) < 4:
-                print("[✗] Invalid connection response")
+                self._log("[✗] Invalid connection response")
                 return False
             
             version, rep, rsv, atyp = struct.unpack("!BBBB", response)
@@ -150,13 +156,19 @@ class Socks5Client:
                 port_data = self.sock.recv(2)
                 addr = socket.inet_ntoa(addr_data)
                 port = struct.unpack("!H", port_data)[0]
-                print(f"[*] Bound address: {addr}:{port}")
+                self._log(f"[*] Bound address: {addr}:{port}")
+            elif atyp == 4:  # IPv6
+                addr_data = self.sock.recv(16)
+                port_data = self.sock.recv(2)
+                addr = socket.inet_ntop(socket.AF_INET6, addr_data)
+                port = struct.unpack("!H", port_data)[0]
+                self._log(f"[*] Bound address: [{addr}]:{port}")
             elif atyp == 3:  # Domain
                 domain_len = ord(self.sock.recv(1))
                 domain = self.sock.recv(domain_len).decode('utf-8')
                 port_data = self.sock.recv(2)
                 port = struct.unpack("!H", port_data)[0]
-                print(f"[*] Bound address: {domain}:{port}")
+                self._log(f"[*] Bound address: {domain}:{port}")
             
             # Check response status
             error_messages = {
@@ -173,14 +185,14 @@ class Socks5Client:
             
             status_msg = error_messages.get(rep, f"Unknown error ({rep})")
             if rep == 0:
-                print(f"[✓] {status_msg}")
+                self._log(f"[✓] {status_msg}")
                 return True
             else:
-                print(f"[✗] Connection failed: {status_msg}")
+                self._log(f"[✗] Connection failed: {status_msg}")
                 return False
                 
         except Exception as e:
-            print(f"[✗] Connection request error: {e}")
+            self._log(f"[✗] Connection request error: {e}")
             return False
 
     def close(self):
@@ -200,7 +212,7 @@ class Socks5Client:
                 return False
             if not self.request_connection():
                 return False
-            print("[✓] Test completed successfully!")
+            self._log("[✓] Test completed successfully!")
             return True
         finally:
             self.close()